@@ -40,11 +40,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django_extensions',
     'rest_framework',
-    'content',
-    'user',
+    'content.apps.ContentConfig',
+    'user.apps.UserConfig',
 ]
 
 MIDDLEWARE = [
+    'content.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,9 +77,11 @@ WSGI_APPLICATION = 'TestProject.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'user.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'content.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 JWT_AUTH = {
@@ -86,8 +89,13 @@ JWT_AUTH = {
     'JWT_AUTH_COOKIE': 'Authorization',
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(minutes = 10),
     'JWT_EXPIRATION_DELTA': datetime.timedelta(hours = 1),
+    'JWT_PAYLOAD_HANDLER': 'user.authentication.jwt_payload_handler',
 }
 
+# authenticated users are cached with their profile, saving a User or Profile removes them from the cache
+AUTH_USER_CACHE = 'shared'
+AUTH_USER_CACHE_TIMEOUT = 60
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -103,6 +111,34 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# 'shared' is a local stand-in, point it at memcached or redis when running more than one process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
+# the data of the catalogue read endpoints, invalidated by the signals of the models they read
+RESPONSE_CACHE = 'shared'
+RESPONSE_CACHE_TIMEOUT = 300
+
+ENTITLEMENT_CACHE = {
+    'BACKEND': 'content.cache.TieredCache',
+    'TIMEOUT': 300,
+    'LOCAL_TIMEOUT': 30,
+    'MAX_ENTRIES': 10000,
+    'SHARED_CACHE': 'shared',
+    'KEY_PREFIX': 'entitlement',
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -145,3 +181,97 @@ STATIC_URL = '/static/'
 # ]
 MEDIA_ROOT  = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# files are stored once per content under their sha256, see content.storage. on several hosts use
+# 'content.storage.S3ContentAddressedStorage' to keep them in an s3 compatible bucket (needs boto3), set
+# S3_ENDPOINT_URL for minio or another store than aws. parts of S3_MULTIPART_CHUNKSIZE are sent S3_MAX_CONCURRENCY
+# at a time and downloads are redirected to presigned urls valid for SIGNED_URL_MAX_AGE
+DEFAULT_FILE_STORAGE = 'content.storage.ContentAddressedStorage'
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_LOCATION = ''
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+S3_REGION = os.environ.get('S3_REGION')
+S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+S3_MAX_CONCURRENCY = 8
+
+# downloads are counted per blob and `manage.py rebalance_tiers` places them: the TIERING_CACHE_SIZE bytes of the
+# hottest blobs (by TIERING_EVICTION, 'lfu' or 'lru') are copied to TIERING_CACHE_ROOT on the local disk, nginx
+# serves it at TIERING_CACHE_URL. blobs not downloaded for TIERING_COLD_AFTER move to TIERING_ARCHIVE_STORAGE, e.g.
+# 'content.storage.GzipStorage' with TIERING_ARCHIVE_OPTIONS = {'location' : ...}. downloads read through the tiers
+TIERING_CACHE_ROOT = None
+TIERING_CACHE_URL = '/cached/'
+TIERING_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+TIERING_EVICTION = 'lfu'
+TIERING_HOT_MIN_DOWNLOADS = 5
+TIERING_DECAY = 0.5
+TIERING_ARCHIVE_STORAGE = None
+TIERING_ARCHIVE_OPTIONS = {}
+TIERING_COLD_AFTER = datetime.timedelta(days = 90)
+TIERING_ACCESS_FLUSH_INTERVAL = 30
+
+# Blobs of COMPRESSIBLE_MIME_TYPES are stored compressed with STORAGE_COMPRESSION ('gzip', or 'zstd' which
+# needs the zstandard package) when the first COMPRESSION_SAMPLE_SIZE bytes shrink to COMPRESSION_MAX_RATIO
+# of their size, COMPRESSION_LEVEL None is the default level of the encoding. turning it off again keeps the
+# compressed blobs readable.
+STORAGE_COMPRESSION = None
+COMPRESSIBLE_MIME_TYPES = ('application/pdf', 'audio/x-wav', 'audio/wav', 'audio/x-aiff', 'audio/aiff', 'audio/x-ms-wma')
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MAX_RATIO = 0.9
+COMPRESSION_LEVEL = None
+
+# Media is never served directly, downloads go through content/download/<pk>/ which checks the
+# customer's entitlements and then hands the transfer to the front server:
+# 'nginx' uses X-Accel-Redirect to SENDFILE_URL (an internal location aliased to MEDIA_ROOT),
+# 'xsendfile' uses X-Sendfile (Apache mod_xsendfile, lighttpd) and None streams the file from django.
+SENDFILE_BACKEND = None
+SENDFILE_URL = '/protected/'
+
+# Resumable uploads append their chunks to a file in UPLOAD_STAGING_ROOT, keep it on the same disk as
+# MEDIA_ROOT so finalizing an upload is a rename. Sessions untouched for UPLOAD_SESSION_EXPIRY are removed
+# by the clear_upload_sessions command.
+UPLOAD_STAGING_ROOT = os.path.join(MEDIA_ROOT, '.staging')
+
+# uploads are written once into UPLOAD_STAGING_ROOT while they are hashed and sniffed, then moved into place
+FILE_UPLOAD_HANDLERS = ['content.uploadhandlers.StreamingUploadHandler']
+# the staged uploads are 0600 temporary files, the front server reads the blobs they become as another user
+FILE_UPLOAD_PERMISSIONS = 0o644
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_EXPIRY = datetime.timedelta(days = 1)
+
+# the most files or products one bulk upload or bulk update request may contain
+BULK_MAX_ITEMS = 1000
+
+# uploads are probed, previewed and optionally transcoded in the background by `manage.py process_media`,
+# failed jobs are retried PROCESSING_MAX_ATTEMPTS times after PROCESSING_RETRY_DELAY, doubled each time
+FFPROBE_BINARY = 'ffprobe'
+FFMPEG_BINARY = 'ffmpeg'
+PROCESSING_CONCURRENCY = 2
+PROCESSING_MAX_ATTEMPTS = 3
+PROCESSING_RETRY_DELAY = datetime.timedelta(minutes = 1)
+PROCESSING_JOB_TIMEOUT = datetime.timedelta(hours = 2)
+PROCESSING_COMMAND_TIMEOUT = 60 * 60
+PROCESSING_TRANSCODE = False
+
+# stream formats ('hls', 'dash') audio and video files are packaged to after processing, none by default.
+# the segments are PACKAGING_SEGMENT_SECONDS long and stored next to the content of the file
+PACKAGING_FORMATS = ()
+PACKAGING_SEGMENT_SECONDS = 6
+
+# get_file_data links to content/download/<pk>/, which checks the purchase on every request. 'signed' links to
+# content/signed_download/<token>/, whose token is verified without a query, and 'secure_link' links straight to
+# SECURE_LINK_URL for nginx's secure_link module (see README). signed links are valid for SIGNED_URL_MAX_AGE
+DOWNLOAD_URL_SIGNING = None
+SIGNED_URL_MAX_AGE = datetime.timedelta(hours = 6)
+SIGNED_URL_SECRET = SECRET_KEY
+SECURE_LINK_URL = '/signed/'
+
+# every request is timed by content.middleware.InstrumentationMiddleware, content/metrics/ serves the metrics
+# to the requests with the header "Authorization: Bearer <METRICS_TOKEN>", without a token it is off.
+# SERVER_TIMING adds a Server-Timing header with the sql and rendering time, requests slower than
+# SLOW_REQUEST_THRESHOLD seconds are logged with their sql, None turns the log off
+SERVER_TIMING = DEBUG
+SLOW_REQUEST_THRESHOLD = 1.0
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
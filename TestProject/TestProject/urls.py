@@ -15,18 +15,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
-# from content.views import check_download_requirements
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('content/', include('content.urls')),
     path('user/', include('user.urls')),
     path('', include('user.urls')),
-    # path('media/<str:file_name>', check_download_requirements.as_view(), name = 'check_download_requirements')
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
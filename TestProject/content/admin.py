@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, Store, File, Subscription, Cart
+from .models import Category, Product, Store, File, Subscription, Cart, Purchase, SubscriptionPurchase, Entitlement, UploadSession, Blob, ProcessingJob
 
 
 @admin.register(Category, Store)
@@ -15,8 +15,9 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(File)
 class FileAdmin(admin.ModelAdmin):
     exclude = ['buy_confirmation']
-    readonly_fields = ['file_name', 'file_price', 'is_free','file_data', 
-                      'file_product','updated_date', 'created_date']
+    readonly_fields = ['file_name', 'file_price', 'is_free','file_data', 'content_hash', 'file_size',
+                      'file_product', 'processing_status', 'duration', 'bitrate', 'page_count',
+                      'preview', 'stream_data', 'stream_formats', 'updated_date', 'created_date']
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
@@ -26,7 +27,35 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    readonly_fields = ['user', 'baught_products', 'baught_files', 'baught_subscriptions',
-                      'date_of_buying_subscription','updated_date', 'created_date']
+    readonly_fields = ['user', 'updated_date', 'created_date']
 
 
+
+@admin.register(Purchase)
+class PurchaseAdmin(admin.ModelAdmin):
+    readonly_fields = ['user', 'product', 'file', 'created_at']
+
+@admin.register(SubscriptionPurchase)
+class SubscriptionPurchaseAdmin(admin.ModelAdmin):
+    readonly_fields = ['user', 'subscription', 'baught_at', 'expires_at']
+
+@admin.register(Entitlement)
+class EntitlementAdmin(admin.ModelAdmin):
+    readonly_fields = ['user', 'file', 'product', 'store', 'valid_until']
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    readonly_fields = ['owner', 'file_name', 'file_price', 'file_product', 'is_free', 'upload_name',
+                      'upload_size', 'offset', 'created_at', 'updated_at']
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'ref_count', 'download_count', 'last_accessed', 'archived']
+    list_filter = ['archived']
+    readonly_fields = ['name', 'size', 'ref_count', 'download_count', 'recent_downloads', 'last_accessed', 'archived', 'primary_expires']
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ['file', 'kind', 'status', 'attempts', 'run_after']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['file', 'kind', 'attempts', 'locked_by', 'locked_at', 'last_error', 'created_at', 'updated_at']
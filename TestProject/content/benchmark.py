@@ -0,0 +1,222 @@
+import json
+import math
+import time
+import random
+import urllib.request
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from user.models import Profile
+from .models import Category, Store, Product, File, Subscription, Cart, ProcessingJob
+from .checkout import checkout
+
+
+bench_password = 'bench-pass'
+
+
+def percentile(values, percent):
+    ''' nearest rank percentile of a list of numbers '''
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+def summarize(latencies, elapsed, queries = None, errors = 0):
+    ''' latencies in seconds of every request and the wall time of the whole run '''
+
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        'requests' : len(latencies),
+        'errors' : errors,
+        'p50_ms' : round(percentile(milliseconds, 50), 3),
+        'p95_ms' : round(percentile(milliseconds, 95), 3),
+        'p99_ms' : round(percentile(milliseconds, 99), 3),
+        'throughput_rps' : round(len(latencies) / elapsed, 3) if elapsed else None,
+        'queries_per_request' : round(sum(queries) / len(queries), 3) if queries else None,
+    }
+
+
+def seed_catalogue(stores = 10, products = 200, files = 600, carts = 50, subscriptions = 10, seed = 0):
+    ''' a synthetic catalogue, everything is spread round robin and the customers buy a few items each
+
+    the files point at blobs which do not exist, so they are marked ready instead of being processed.
+    returns the usernames of the customers, their password is bench_password.
+    '''
+
+    rng = random.Random(seed)
+    prefix = 'bench-%d-' % int(time.time())
+
+    categories = [Category.objects.get_or_create(category_name = name)[0] for name, label in Category.category_choices]
+
+    store_objs = []
+    for i in range(stores):
+        owner = User.objects.create_user(username = '%sowner-%d' % (prefix, i), password = bench_password)
+        Profile.objects.create(user = owner, is_owner = True)
+        store_objs.append(Store.objects.create(owner = owner))
+
+    subscription_objs = [
+        Subscription.objects.create(amount = rng.randint(1, 100), expiry_date_amount = rng.randint(1, 12),
+                                    expiry_date_unit = 'day', store_subscription = store_objs[i % stores])
+        for i in range(subscriptions)
+    ]
+
+    product_objs = []
+    for i in range(products):
+        is_free = rng.random() < 0.2
+        product = Product.objects.create(product_name = 'product %d' % i, is_free = is_free,
+                                         product_price = None if is_free else rng.randint(1, 200),
+                                         product_store = store_objs[i % stores])
+        product.product_category.add(*rng.sample(categories, 2))
+        product_objs.append(product)
+
+    file_objs = []
+    for i in range(files):
+        product = product_objs[i % products]
+        file_objs.append(File.objects.create(file_name = 'file %d' % i, file_data = '%sfile_%d.pdf' % (prefix, i),
+                                             file_product = product, is_free = product.is_free,
+                                             file_price = None if product.is_free else rng.randint(1, 50)))
+    ProcessingJob.objects.filter(file__in = file_objs).delete()
+    File.objects.filter(pk__in = [file_obj.pk for file_obj in file_objs]).update(processing_status = 'ready')
+
+    customers = []
+    for i in range(carts):
+        customer = User.objects.create_user(username = '%scustomer-%d' % (prefix, i), password = bench_password)
+        Cart.objects.create(user = customer)
+        checkout(customer,
+                 [product.pk for product in rng.sample(product_objs, min(3, products))],
+                 [file_obj.pk for file_obj in rng.sample(file_objs, min(3, files))],
+                 [sub.pk for sub in rng.sample(subscription_objs, min(1, subscriptions))])
+        customers.append(customer.username)
+
+    return customers
+
+
+def get_scenarios():
+    ''' (name, path) of every benchmarked GET, ids are taken from the seeded catalogue '''
+
+    product = Product.objects.order_by('-id').first()
+    file_obj = File.objects.order_by('-id').first()
+    subscription = Subscription.objects.order_by('-id').first()
+
+    scenarios = [
+        ('show_products', '/content/show_products/'),
+        ('show_files', '/content/show_files/'),
+        ('show_store', '/content/show_store/'),
+        ('show_subscription', '/content/show_subscription/'),
+        ('show_my_cart', '/content/show_my_cart/'),
+        ('search_products', '/content/search_products/?q=product'),
+        ('search_files', '/content/search_files/?q=file&is_free=false'),
+    ]
+    if product:
+        scenarios.append(('show_product', '/content/show_products/%d/' % product.pk))
+    if file_obj:
+        scenarios.append(('show_file', '/content/show_files/%d/' % file_obj.pk))
+    if subscription:
+        scenarios.append(('show_subscription_detail', '/content/show_subscription/%d/' % subscription.pk))
+    return scenarios
+
+def login_data(username):
+    return {'username' : username, 'password' : bench_password}
+
+
+def run_client(username, requests = 100):
+    ''' drive the scenarios and the jwt login in process through the test client, with the queries of every request '''
+
+    results = {}
+    with override_settings(ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']):
+        client = Client()
+
+        def measure(name, send):
+            latencies, queries, errors = [], [], 0
+            started = time.perf_counter()
+            for i in range(requests):
+                with CaptureQueriesContext(connection) as context:
+                    request_started = time.perf_counter()
+                    response = send()
+                    latencies.append(time.perf_counter() - request_started)
+                queries.append(len(context.captured_queries))
+                errors += response.status_code >= 400
+            results[name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+
+        measure('login', lambda : client.post('/user/login/', login_data(username)))
+
+        token = client.post('/user/login/', login_data(username)).data['token']
+        for name, path in get_scenarios():
+            measure(name, lambda : client.get(path, HTTP_AUTHORIZATION = 'JWT ' + token))
+
+    return results
+
+
+def send_request(url, data = None, token = None):
+    ''' one request to a running server, returns its latency and whether it failed '''
+
+    headers = {'Content-Type' : 'application/json'}
+    if token:
+        headers['Authorization'] = 'JWT ' + token
+    request = urllib.request.Request(url, data = json.dumps(data).encode('utf-8') if data else None, headers = headers)
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout = 60) as response:
+            response.read()
+        failed = False
+    except HTTPError as error:
+        error.read()
+        failed = True
+    return time.perf_counter() - started, failed
+
+def run_load(base_url, username, requests = 1000, concurrency = 10):
+    ''' drive the scenarios and the jwt login of a running server from concurrent threads '''
+
+    base_url = base_url.rstrip('/')
+    login_url = base_url + '/user/login/'
+
+    def measure(url, data = None, token = None):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = concurrency) as pool:
+            outcomes = list(pool.map(lambda i : send_request(url, data, token), range(requests)))
+        elapsed = time.perf_counter() - started
+        return summarize([latency for latency, failed in outcomes], elapsed,
+                         errors = sum(failed for latency, failed in outcomes))
+
+    results = {'login' : measure(login_url, login_data(username))}
+
+    with urllib.request.urlopen(urllib.request.Request(login_url, data = json.dumps(login_data(username)).encode('utf-8'),
+                                                       headers = {'Content-Type' : 'application/json'})) as response:
+        token = json.loads(response.read().decode('utf-8'))['token']
+
+    for name, path in get_scenarios():
+        results[name] = measure(base_url + path, token = token)
+    return results
+
+
+def compare(results, baseline, tolerance = 0.2):
+    ''' the regressions of a run against a baseline, a slower p95 beyond the tolerance or more queries per request '''
+
+    regressions = []
+    for name, expected in baseline.get('scenarios', {}).items():
+        measured = results.get(name)
+        if measured is None:
+            regressions.append('%s: missing from the run' % name)
+            continue
+
+        if measured['errors'] > expected.get('errors', 0):
+            regressions.append('%s: %d errors, the baseline has %d' % (name, measured['errors'], expected.get('errors', 0)))
+
+        if expected.get('p95_ms') and measured['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.1fms, the baseline is %.1fms' % (name, measured['p95_ms'], expected['p95_ms']))
+
+        # the number of queries does not depend on the machine, any growth is a regression
+        if expected.get('queries_per_request') is not None and measured.get('queries_per_request') is not None:
+            if measured['queries_per_request'] > expected['queries_per_request']:
+                regressions.append('%s: %.1f queries per request, the baseline has %.1f'
+                                   % (name, measured['queries_per_request'], expected['queries_per_request']))
+    return regressions
@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+MISSING = object()
+
+
+class LRUCache:
+    ''' in-process cache bounded by max_entries, the least recently used key is dropped first '''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return MISSING
+
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return MISSING
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last = False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    ''' LRU bounded in-process tier in front of an optional shared django cache (memcached, redis, ...) '''
+
+    def __init__(self, timeout = 300, local_timeout = 30, max_entries = 10000, shared_cache = None, key_prefix = ''):
+        self.timeout = timeout
+        self.local_timeout = min(local_timeout, timeout)
+        self.key_prefix = key_prefix
+        self.local = LRUCache(max_entries)
+        self.shared = caches[shared_cache] if shared_cache else None
+
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def make_key(self, *parts):
+        return ':'.join([self.key_prefix] + [str(part) for part in parts])
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.local_hits += 1
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key, MISSING)
+            if value is not MISSING:
+                self.shared_hits += 1
+                self.local.set(key, value, self.local_timeout)
+                return value
+
+        self.misses += 1
+        return MISSING
+
+    def set(self, key, value, timeout = None):
+        ''' timeout can only shorten the configured one, e.g. for a subscription which expires soon '''
+
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if timeout <= 0:
+            return
+
+        self.local.set(key, value, min(timeout, self.local_timeout))
+        if self.shared is not None:
+            self.shared.set(key, value, timeout)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        self.local.delete_many(keys)
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        hits = self.local_hits + self.shared_hits
+        return {
+            'local_hits' : self.local_hits,
+            'shared_hits' : self.shared_hits,
+            'hits' : hits,
+            'misses' : self.misses,
+            'hit_ratio' : hits / (hits + self.misses) if hits + self.misses else 0.0,
+        }
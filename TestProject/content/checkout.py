@@ -0,0 +1,52 @@
+from django.db import transaction
+
+from .models import File, Product, Subscription, Purchase, SubscriptionPurchase
+from .entitlements import grant_files, grant_products, grant_subscriptions
+
+
+def unique(ids):
+    return list(dict.fromkeys(ids))
+
+def item_results(ids, found, baught, extra = None):
+    results = []
+    for item_id in ids:
+        if item_id not in found:
+            result = {'id' : item_id, 'status' : 'not found'}
+        elif item_id in baught:
+            result = {'id' : item_id, 'status' : 'baught'}
+            if extra:
+                result.update(extra(item_id))
+        else:
+            result = {'id' : item_id, 'status' : 'already baught'}
+        results.append(result)
+    return results
+
+def checkout(user, product_ids = (), file_ids = (), subscription_ids = ()):
+    ''' buy a basket of products, files and subscriptions in one transaction
+
+    the items are looked up with one query per kind and written with one statement per kind, so the
+    number of queries does not grow with the basket. returns the result of every requested item.
+    '''
+
+    product_ids, file_ids, subscription_ids = unique(product_ids), unique(file_ids), unique(subscription_ids)
+
+    products = Product.objects.only('pk').in_bulk(product_ids) if product_ids else {}
+    # the files the processing rejected are not sold, like they are not shown
+    files = File.objects.exclude(processing_status = 'rejected').only('pk').in_bulk(file_ids) if file_ids else {}
+    subscriptions = (Subscription.objects.only('pk', 'expiry_date_amount', 'expiry_date_unit', 'store_subscription')
+                     .in_bulk(subscription_ids) if subscription_ids else {})
+
+    with transaction.atomic():
+        baught_products, baught_files = Purchase.objects.record_many(user, products.values(), files.values())
+        expiries = SubscriptionPurchase.objects.buy_many(user, subscriptions.values())
+
+        grant_products(user, [products[product_id] for product_id in baught_products])
+        grant_files(user, [files[file_id] for file_id in baught_files])
+        grant_subscriptions(user, [(subscriptions[sub_id], expires_at) for sub_id, expires_at in expiries.items()])
+
+    return {
+        'products' : item_results(product_ids, products, baught_products),
+        'files' : item_results(file_ids, files, baught_files),
+        'subscriptions' : item_results(subscription_ids, subscriptions, expiries,
+                                       lambda sub_id : {'expires_at' : expiries[sub_id]}),
+    }
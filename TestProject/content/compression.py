@@ -0,0 +1,110 @@
+import gzip
+import zlib
+import struct
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# the suffix of the stored name of a file compressed with each Content-Encoding, see content.storage
+encoding_suffixes = {'gzip' : '.gz', 'zstd' : '.zst'}
+default_levels = {'gzip' : 6, 'zstd' : 3}
+
+
+class DecompressedFile(DjangoFile):
+    ''' a stored compressed file read decompressed, closing it closes the stored file too '''
+
+    def __init__(self, file, name, stored_file):
+        super().__init__(file, name)
+        self.stored_file = stored_file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.stored_file.close()
+
+
+def get_level(encoding):
+    return settings.COMPRESSION_LEVEL or default_levels[encoding]
+
+def check_encoding(encoding):
+    if encoding not in encoding_suffixes:
+        raise ImproperlyConfigured('STORAGE_COMPRESSION should be one of: ' + ', '.join(encoding_suffixes))
+    if encoding == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('zstd compression needs the zstandard package, pip install zstandard')
+
+def is_compressible(encoding, sample):
+    ''' whether a sample of the start of a file shrinks to COMPRESSION_MAX_RATIO of its size or less '''
+
+    if not sample:
+        return False
+    if encoding == 'zstd':
+        compressed = zstandard.ZstdCompressor(level = get_level(encoding)).compress(sample)
+    else:
+        compressed = zlib.compress(sample, get_level(encoding))
+    return len(compressed) <= len(sample) * settings.COMPRESSION_MAX_RATIO
+
+def compress(encoding, content, target):
+    ''' write a django File compressed into an open file, zstd frames record the size of the content '''
+
+    content.seek(0)
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level = get_level(encoding), write_content_size = True)
+        try:
+            size = content.size
+        except (AttributeError, OSError):
+            size = -1
+        compressor.copy_stream(content, target, size = size if size is not None else -1)
+    else:
+        # mtime 0 so the same content is always compressed to the same bytes
+        with gzip.GzipFile(fileobj = target, mode = 'wb', compresslevel = get_level(encoding), mtime = 0) as compressed:
+            for chunk in content.chunks():
+                compressed.write(chunk)
+
+def decompressed(encoding, stored_file, name):
+    ''' an open compressed file read decompressed, with the size of its content when it is recorded '''
+
+    size = decompressed_size(encoding, stored_file)
+    stored_file.seek(0)
+
+    if encoding == 'zstd':
+        decompressed_file = DecompressedFile(zstandard.ZstdDecompressor().stream_reader(stored_file), name, stored_file)
+    else:
+        decompressed_file = DecompressedFile(gzip.GzipFile(fileobj = stored_file, mode = 'rb'), name, stored_file)
+    if size is not None:
+        decompressed_file.size = size
+    return decompressed_file
+
+def decompressed_size(encoding, stored_file):
+    ''' the size of the content of a compressed file from its header or trailer, gzip only records it modulo 4GB '''
+
+    if encoding == 'zstd':
+        check_encoding(encoding)
+        size = zstandard.frame_content_size(stored_file.read(18))
+        return size if size >= 0 else None
+
+    stored_file.seek(-4, 2)
+    return struct.unpack('<I', stored_file.read(4))[0]
+
+def accepts_encoding(request, encoding):
+    ''' whether Accept-Encoding names the encoding without q=0 '''
+
+    for accepted in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        token, _, params = accepted.partition(';')
+        if token.strip().lower() != encoding:
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .cache import MISSING
+from .models import Entitlement, File, Product
+
+
+def get_entitlement_cache():
+    ''' build the cache configured by ENTITLEMENT_CACHE in settings '''
+
+    options = dict(getattr(settings, 'ENTITLEMENT_CACHE', {}))
+    backend = import_string(options.pop('BACKEND', 'content.cache.TieredCache'))
+    return backend(**{key.lower() : value for key, value in options.items()})
+
+entitlement_cache = get_entitlement_cache()
+
+
+def drop_decisions(keys):
+    ''' drop cached decisions now and again after the commit, a download between the two may have cached
+    the rows from before the change
+    '''
+
+    entitlement_cache.delete_many(keys)
+    transaction.on_commit(lambda : entitlement_cache.delete_many(keys))
+
+def invalidate(user, file_ids):
+    drop_decisions([entitlement_cache.make_key(user.id, file_id) for file_id in file_ids])
+
+def invalidate_moved_file(file_id, product_id):
+    ''' the file left the product, drop the decisions cached for the users who were allowed it through the product
+    or its store. only positive decisions are cached, so nobody else has one. the local tiers of the other processes
+    keep theirs for up to LOCAL_TIMEOUT.
+    '''
+
+    store_ids = Product.objects.filter(pk = product_id).values('product_store_id')
+    user_ids = (Entitlement.objects.filter(Q(product_id = product_id) | Q(store_id__in = store_ids))
+                .values_list('user_id', flat = True).distinct())
+    drop_decisions([entitlement_cache.make_key(user_id, file_id) for user_id in user_ids])
+
+def grant_files(user, file_objs):
+    ''' the user has baught these files '''
+
+    if file_objs:
+        Entitlement.objects.bulk_create([Entitlement(user = user, file = file_obj) for file_obj in file_objs], ignore_conflicts = True)
+        invalidate(user, [file_obj.id for file_obj in file_objs])
+
+def grant_products(user, product_objs):
+    ''' the user has baught these products, so every file of them '''
+
+    if product_objs:
+        Entitlement.objects.bulk_create([Entitlement(user = user, product = product_obj) for product_obj in product_objs], ignore_conflicts = True)
+        invalidate(user, File.objects.filter(file_product__in = product_objs).values_list('id', flat = True))
+
+def grant_subscriptions(user, valid_untils):
+    ''' the user has baught the subscriptions of some stores, so every file of them until the date paired with each subscription '''
+
+    store_valid_untils = {sub_obj.store_subscription_id : valid_until for sub_obj, valid_until in valid_untils}
+    if store_valid_untils:
+        Entitlement.objects.grant_stores(user, store_valid_untils)
+        invalidate(user, File.objects.filter(file_product__product_store_id__in = list(store_valid_untils)).values_list('id', flat = True))
+
+def grant_file(user, file_obj):
+    grant_files(user, [file_obj])
+
+def grant_product(user, product_obj):
+    grant_products(user, [product_obj])
+
+def grant_subscription(user, sub_obj, valid_until):
+    grant_subscriptions(user, [(sub_obj, valid_until)])
+
+def lookup_file_access(user, file_obj):
+    ''' one indexed lookup for the entitlements of the file, its product and its store, returns (allowed, valid_until) '''
+
+    targets = (Q(file_id = file_obj.id) |
+               Q(product_id = file_obj.file_product_id) |
+               Q(store_id = file_obj.file_product.product_store_id))
+    not_expired = Q(valid_until__isnull = True) | Q(valid_until__gt = timezone.now())
+
+    valid_untils = list(Entitlement.objects.filter(targets, not_expired, user = user).values_list('valid_until', flat = True))
+    if not valid_untils:
+        return False, None
+    if None in valid_untils:
+        return True, None
+    return True, max(valid_untils)
+
+def has_file_access(user, file_obj):
+    ''' check whether the user has baught the file, its product or its store, answered from the cache when possible '''
+
+    key = entitlement_cache.make_key(user.id, file_obj.id)
+    allowed = entitlement_cache.get(key)
+    if allowed is not MISSING:
+        return allowed
+
+    # only positive decisions are cached, a purchase drops the decisions of its own process only and the
+    # others would refuse the file until their local tier expired
+    allowed, valid_until = lookup_file_access(user, file_obj)
+    if allowed and valid_until:
+        entitlement_cache.set(key, allowed, (valid_until - timezone.now()).total_seconds())
+    elif allowed:
+        entitlement_cache.set(key, allowed)
+    return allowed
+
+def can_download(user, file_obj):
+    ''' owners download their own files, everybody downloads free files, the others must have baught it
+
+    the files the processing rejected are only downloaded by their owner.
+    '''
+
+    if user.id == file_obj.file_product.product_store.owner_id:
+        return True
+    if file_obj.processing_status == 'rejected':
+        return False
+    return file_obj.is_free or has_file_access(user, file_obj)
@@ -0,0 +1,74 @@
+import os
+import time
+import base64
+import hashlib
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from .models import stream_manifests
+
+
+download_salt = 'content.links.download'
+stream_salt = 'content.links.stream'
+
+
+class InvalidLink(Exception):
+    pass
+
+
+def get_expiry():
+    return int(time.time() + settings.SIGNED_URL_MAX_AGE.total_seconds())
+
+def make_token(payload, salt):
+    return signing.dumps(payload, key = settings.SIGNED_URL_SECRET, salt = salt, compress = True)
+
+def load_token(token, salt):
+    ''' check the signature and the expiry of a link, nothing is read from the database '''
+
+    try:
+        payload = signing.loads(token, key = settings.SIGNED_URL_SECRET, salt = salt)
+    except signing.BadSignature:
+        raise InvalidLink()
+    if payload.get('e', 0) < time.time():
+        raise InvalidLink()
+    return payload
+
+def secure_link_md5(uri, expires):
+    ''' the hash nginx checks with: secure_link_md5 "$secure_link_expires$uri <SIGNED_URL_SECRET>"; '''
+
+    digest = hashlib.md5(('%d%s %s' % (expires, uri, settings.SIGNED_URL_SECRET)).encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+def download_url(request, file_obj):
+    ''' the link get_file_data shows to a customer who can download the file, see DOWNLOAD_URL_SIGNING in settings '''
+
+    signing_backend = getattr(settings, 'DOWNLOAD_URL_SIGNING', None)
+    if signing_backend is None:
+        return request.build_absolute_uri(reverse('download_file', args = [file_obj.id]))
+
+    expires = get_expiry()
+    if signing_backend == 'secure_link':
+        uri = settings.SECURE_LINK_URL + quote(file_obj.file_data.name)
+        query = urlencode({'md5' : secure_link_md5(uri, expires), 'expires' : expires, 'filename' : file_obj.get_download_name()})
+        return request.build_absolute_uri(uri + '?' + query)
+
+    # everything the download needs is in the signed token, so serving it needs no query
+    token = make_token({'f' : file_obj.id, 'u' : request.user.id, 'e' : expires, 'n' : file_obj.file_data.name,
+                        'd' : file_obj.get_download_name(), 'h' : file_obj.content_hash, 's' : getattr(file_obj, 'blob_size', file_obj.file_size),
+                        't' : file_obj.mime_type, 'a' : bool(file_obj.blob_archived) if hasattr(file_obj, 'blob_archived') else None,
+                        'c' : getattr(file_obj, 'blob_encoding', None) or ''}, download_salt)
+    return request.build_absolute_uri(reverse('signed_download', args = [token]))
+
+def stream_url(request, file_obj, stream_format):
+    ''' the link of the manifest of a stream, a signed token covers the manifest and every segment next to it '''
+
+    manifest = stream_manifests[stream_format]
+    if getattr(settings, 'DOWNLOAD_URL_SIGNING', None) != 'signed':
+        return request.build_absolute_uri(reverse('stream_file', args = [file_obj.id, stream_format, manifest]))
+
+    token = make_token({'f' : file_obj.id, 'u' : request.user.id, 'e' : get_expiry(), 'h' : file_obj.content_hash,
+                        'p' : os.path.dirname(file_obj.get_stream_name(stream_format, manifest))}, stream_salt)
+    return request.build_absolute_uri(reverse('signed_stream', args = [token, manifest]))
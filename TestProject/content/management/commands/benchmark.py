@@ -0,0 +1,58 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from content.benchmark import run_client, run_load, compare
+
+
+class Command(BaseCommand):
+    help = ('benchmark the content endpoints and the jwt login of a seeded catalogue (see seed_catalogue), '
+            'in process with the test client or against a running server with --url')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help = 'the customer to log in as, the last seeded one by default')
+        parser.add_argument('--requests', type = int, default = 100, help = 'requests per endpoint')
+        parser.add_argument('--url', help = 'base url of a running server, e.g. http://localhost:8000')
+        parser.add_argument('--concurrency', type = int, default = 10, help = 'concurrent requests against --url')
+        parser.add_argument('--save', metavar = 'PATH', help = 'store the results as a json baseline')
+        parser.add_argument('--compare', metavar = 'PATH', help = 'fail when the results regress from a json baseline')
+        parser.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed p95 slowdown, 0.2 is 20%%')
+
+    def handle(self, *args, **options):
+        username = options['user']
+        if not username:
+            customer = User.objects.filter(username__startswith = 'bench-', username__contains = '-customer-').order_by('-id').first()
+            if customer is None:
+                raise CommandError('there is no seeded customer, run seed_catalogue first')
+            username = customer.username
+
+        if options['url']:
+            scenarios = run_load(options['url'], username, options['requests'], max(options['concurrency'], 1))
+            run = {'mode' : 'load', 'requests' : options['requests'], 'concurrency' : options['concurrency'], 'scenarios' : scenarios}
+        else:
+            scenarios = run_client(username, options['requests'])
+            run = {'mode' : 'client', 'requests' : options['requests'], 'scenarios' : scenarios}
+
+        self.stdout.write('%-26s %8s %8s %8s %10s %8s %7s' % ('endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+        for name, result in scenarios.items():
+            queries = result['queries_per_request']
+            self.stdout.write('%-26s %8.1f %8.1f %8.1f %10.1f %8s %7d' % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['throughput_rps'],
+                '-' if queries is None else '%.1f' % queries, result['errors']))
+
+        if options['save']:
+            with open(options['save'], 'w') as baseline_file:
+                json.dump(run, baseline_file, indent = 2, sort_keys = True)
+            self.stdout.write('saved the baseline to %s' % options['save'])
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('mode') != run['mode']:
+                raise CommandError('the baseline was measured in %s mode' % baseline.get('mode'))
+
+            regressions = compare(scenarios, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('regressions from %s:\n%s' % (options['compare'], '\n'.join(regressions)))
+            self.stdout.write('no regressions from %s' % options['compare'])
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from content.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'remove resumable uploads which have not been touched for UPLOAD_SESSION_EXPIRY and their staging files'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(updated_at__lt = timezone.now() - settings.UPLOAD_SESSION_EXPIRY)
+
+        count = 0
+        for session in expired.iterator():
+            session.delete_staged()
+            session.delete()
+            count += 1
+
+        self.stdout.write('removed %d expired uploads' % count)
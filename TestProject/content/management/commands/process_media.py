@@ -0,0 +1,51 @@
+import os
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from content.models import ProcessingJob
+from content.processing import run_job
+
+
+def run_in_thread(job):
+    try:
+        run_job(job)
+    finally:
+        # every thread has its own connection, it should not stay open after the job
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'run the queued media processing jobs, at most --concurrency of them at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type = int, default = settings.PROCESSING_CONCURRENCY)
+        parser.add_argument('--poll', type = float, default = 5, help = 'seconds to wait for new jobs when the queue is empty')
+        parser.add_argument('--once', action = 'store_true', help = 'exit when the queue is empty')
+        parser.add_argument('--worker', default = '%s-%d' % (socket.gethostname(), os.getpid()))
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        running = set()
+        done = 0
+
+        with ThreadPoolExecutor(max_workers = concurrency) as pool:
+            while True:
+                if len(running) < concurrency:
+                    jobs = ProcessingJob.objects.claim(options['worker'], concurrency - len(running))
+                    running.update(pool.submit(run_in_thread, job) for job in jobs)
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                finished, running = wait(running, timeout = options['poll'], return_when = FIRST_COMPLETED)
+                done += len(finished)
+
+        self.stdout.write('ran %d jobs' % done)
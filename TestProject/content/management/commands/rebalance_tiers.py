@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from content.tiering import rebalance_cache, rebalance_archive
+
+
+class Command(BaseCommand):
+    help = ('cache the hottest blobs on this host and archive the cold ones, see TIERING_* in settings. '
+            'run it periodically with --skip-archive on every web server and without it on one of them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-cache', action = 'store_true', help = 'leave the cache of this host as it is')
+        parser.add_argument('--skip-archive', action = 'store_true', help = 'do not move blobs between the main storage and the archive')
+
+    def handle(self, *args, **options):
+        if not options['skip_cache']:
+            cached = rebalance_cache()
+            if cached:
+                self.stdout.write('cached %(promoted)d blobs and evicted %(evicted)d' % cached)
+
+        if not options['skip_archive']:
+            moved = rebalance_archive()
+            if moved:
+                self.stdout.write('archived %(demoted)d blobs and restored %(restored)d' % moved)
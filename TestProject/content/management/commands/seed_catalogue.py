@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from content.benchmark import seed_catalogue, bench_password
+
+
+class Command(BaseCommand):
+    help = 'create a synthetic catalogue of stores, products, files, carts and subscriptions for the benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stores', type = int, default = 10)
+        parser.add_argument('--products', type = int, default = 200)
+        parser.add_argument('--files', type = int, default = 600)
+        parser.add_argument('--carts', type = int, default = 50, help = 'customers with a cart and a few baught items')
+        parser.add_argument('--subscriptions', type = int, default = 10)
+        parser.add_argument('--seed', type = int, default = 0)
+
+    def handle(self, *args, **options):
+        if options['stores'] < 1 and (options['products'] or options['subscriptions']):
+            raise CommandError('products and subscriptions need at least one store')
+        if options['products'] < 1 and options['files']:
+            raise CommandError('files need at least one product')
+        if options['subscriptions'] > options['stores']:
+            raise CommandError('a store has at most one subscription, so subscriptions can not be more than stores')
+
+        with transaction.atomic():
+            customers = seed_catalogue(options['stores'], options['products'], options['files'],
+                                       options['carts'], options['subscriptions'], options['seed'])
+
+        self.stdout.write('seeded %(stores)d stores, %(products)d products, %(files)d files, '
+                          '%(carts)d carts and %(subscriptions)d subscriptions' % options)
+        if customers:
+            self.stdout.write('customers log in as %s ... with password %s' % (customers[0], bench_password))
@@ -0,0 +1,85 @@
+import threading
+from collections import defaultdict
+
+
+# the upper bounds of the request duration histogram, in seconds
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name : (type, help) of every metric the middleware records, see content.middleware
+metric_descriptions = {
+    'http_requests_total' : ('counter', 'requests by view, method and status'),
+    'http_request_duration_seconds' : ('histogram', 'time until the response is returned, by view'),
+    'http_request_db_queries_total' : ('counter', 'sql statements run by the requests of each view'),
+    'http_request_db_duration_seconds_total' : ('counter', 'time spent in sql by the requests of each view'),
+    'http_request_render_seconds_total' : ('counter', 'time spent rendering the responses of each view'),
+    'http_response_bytes_total' : ('counter', 'body bytes sent by django for each view, not the front server'),
+    'http_slow_requests_total' : ('counter', 'requests slower than SLOW_REQUEST_THRESHOLD by view'),
+}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value)) for name, value in labels)
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    ''' the metrics of this process in the prometheus text format, every worker process has its own '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters = defaultdict(float)
+            self.histograms = {}
+
+    def inc(self, name, labels, amount = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {'buckets' : [0] * len(duration_buckets), 'sum' : 0.0, 'count' : 0})
+            for position, bound in enumerate(duration_buckets):
+                if value <= bound:
+                    histogram['buckets'][position] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def get(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets = list(value['buckets']))) for key, value in self.histograms.items())
+
+        series = defaultdict(list)
+        for (name, labels), value in counters:
+            series[name].append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+        for (name, labels), histogram in histograms:
+            for bound, count in zip(duration_buckets, histogram['buckets']):
+                series[name].append('%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)), count))
+            series[name].append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), histogram['count']))
+            series[name].append('%s_sum%s %s' % (name, format_labels(labels), format_value(histogram['sum'])))
+            series[name].append('%s_count%s %d' % (name, format_labels(labels), histogram['count']))
+
+        lines = []
+        for name, (metric_type, description) in metric_descriptions.items():
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.extend(series.get(name, []))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
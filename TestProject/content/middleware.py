@@ -0,0 +1,114 @@
+import time
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse
+
+from .metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+# the statements kept for the slow request log, the count and the time cover all of them
+MAX_LOGGED_QUERIES = 100
+
+
+class QueryRecorder:
+    ''' an execute_wrapper counting the sql of a request, its time and, for the slow request log, its text '''
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if self.keep_sql and len(self.statements) < MAX_LOGGED_QUERIES:
+                self.statements.append((duration, sql, params))
+
+
+def counted(streaming_content, on_finish):
+    ''' pass a streaming body through and report its size once it is sent or abandoned '''
+
+    sent = 0
+    try:
+        for chunk in streaming_content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        on_finish(sent)
+
+
+class InstrumentationMiddleware:
+    ''' time every request, its sql and its rendering, and count the bytes of its body
+
+    the numbers go to the metrics of content.metrics, to a Server-Timing header when SERVER_TIMING is on
+    and, for requests slower than SLOW_REQUEST_THRESHOLD, to a warning with their sql.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def process_template_response(self, request, response):
+        # drf responses are rendered after the view returns, the time of the renderer is measured around it
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._render_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def __call__(self, request):
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', None)
+        recorder = QueryRecorder(keep_sql = threshold is not None)
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        render_duration = getattr(request, '_render_duration', 0.0)
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match else 'unresolved'
+        labels = {'view' : view}
+
+        registry.inc('http_requests_total', {'view' : view, 'method' : request.method, 'status' : response.status_code})
+        registry.observe('http_request_duration_seconds', labels, duration)
+        registry.inc('http_request_db_queries_total', labels, recorder.count)
+        registry.inc('http_request_db_duration_seconds_total', labels, recorder.duration)
+        registry.inc('http_request_render_seconds_total', labels, render_duration)
+
+        if isinstance(response, FileResponse) and response.has_header('Content-Length'):
+            # wrapping the body would lose the wsgi.file_wrapper of the file, its length is counted instead
+            registry.inc('http_response_bytes_total', labels, int(response.get('Content-Length', 0)))
+        elif response.streaming:
+            response.streaming_content = counted(response.streaming_content,
+                                                 lambda sent : registry.inc('http_response_bytes_total', labels, sent))
+        else:
+            registry.inc('http_response_bytes_total', labels, len(response.content))
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = 'db;dur=%.3f;desc="%d queries", render;dur=%.3f, total;dur=%.3f' % (
+                recorder.duration * 1000, recorder.count, render_duration * 1000, duration * 1000)
+
+        if threshold is not None and duration >= threshold:
+            registry.inc('http_slow_requests_total', labels)
+            statements = '\n'.join('  %.1fms %s %r' % (statement_duration * 1000, sql, params)
+                                   for statement_duration, sql, params in recorder.statements)
+            logger.warning('slow request %s %s (%s): %.1fms, %d queries in %.1fms, rendering %.1fms\n%s',
+                           request.method, request.get_full_path(), view, duration * 1000, recorder.count,
+                           recorder.duration * 1000, render_duration * 1000, statements)
+
+        return response
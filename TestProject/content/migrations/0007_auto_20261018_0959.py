@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content', '0006_auto_20200329_1233'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Entitlement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', related_query_name='entitlement', to='content.File')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', related_query_name='entitlement', to='content.Product')),
+                ('store', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', related_query_name='entitlement', to='content.Store')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entitlements', related_query_name='entitlement', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='entitlement',
+            constraint=models.UniqueConstraint(fields=('user', 'file'), name='unique_file_entitlement'),
+        ),
+        migrations.AddConstraint(
+            model_name='entitlement',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_product_entitlement'),
+        ),
+        migrations.AddConstraint(
+            model_name='entitlement',
+            constraint=models.UniqueConstraint(fields=('user', 'store'), name='unique_store_entitlement'),
+        ),
+        migrations.AddConstraint(
+            model_name='entitlement',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('file__isnull', False), ('product__isnull', True), ('store__isnull', True)), models.Q(('file__isnull', True), ('product__isnull', False), ('store__isnull', True)), models.Q(('file__isnull', True), ('product__isnull', True), ('store__isnull', False)), _connector='OR'), name='entitlement_has_one_target'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:59
+
+from datetime import timedelta
+from django.db import migrations
+
+
+def fill_entitlements(apps, schema_editor):
+    ''' write the entitlements of everything already baught in the carts '''
+
+    Cart = apps.get_model('content', 'Cart')
+    File = apps.get_model('content', 'File')
+    Product = apps.get_model('content', 'Product')
+    Entitlement = apps.get_model('content', 'Entitlement')
+
+    entitlements = []
+    for cart_obj in Cart.objects.prefetch_related('baught_subscriptions'):
+        for product_id in Product.objects.filter(id__in = cart_obj.baught_products or []).values_list('id', flat = True):
+            entitlements.append(Entitlement(user_id = cart_obj.user_id, product_id = product_id))
+
+        for file_id in File.objects.filter(id__in = cart_obj.baught_files or []).values_list('id', flat = True):
+            entitlements.append(Entitlement(user_id = cart_obj.user_id, file_id = file_id))
+
+        if cart_obj.date_of_buying_subscription:
+            for sub_obj in cart_obj.baught_subscriptions.all():
+                if sub_obj.expiry_date_unit == 'day':
+                    delta = timedelta(days = sub_obj.expiry_date_amount)
+                else:
+                    delta = timedelta(hours = sub_obj.expiry_date_amount)
+                entitlements.append(Entitlement(user_id = cart_obj.user_id, store_id = sub_obj.store_subscription_id,
+                                                valid_until = cart_obj.date_of_buying_subscription + delta))
+
+    Entitlement.objects.bulk_create(entitlements, ignore_conflicts = True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0007_auto_20261018_0959'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_entitlements, migrations.RunPython.noop),
+    ]
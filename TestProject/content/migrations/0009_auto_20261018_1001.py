@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0008_auto_20261018_0959'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content', '0009_auto_20261018_1001'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_price', models.PositiveIntegerField(blank=True, null=True)),
+                ('is_free', models.BooleanField()),
+                ('upload_name', models.CharField(max_length=255)),
+                ('upload_size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', related_query_name='upload_session', to='content.Product')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', related_query_name='upload_session', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:07
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def count_existing_blobs(apps, schema_editor):
+    ''' files stored before content addressing keep their names, they are counted like the other blobs '''
+
+    File = apps.get_model('content', 'File')
+    Blob = apps.get_model('content', 'Blob')
+
+    references = File.objects.exclude(file_data = '').values('file_data').annotate(ref_count = Count('id'))
+    Blob.objects.bulk_create([Blob(name = reference['file_data'], ref_count = reference['ref_count']) for reference in references])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0012_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_existing_blobs, migrations.RunPython.noop),
+    ]
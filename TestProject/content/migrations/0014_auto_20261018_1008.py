@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0013_auto_20261018_1007'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dateclass',
+            index=models.Index(fields=['created_date', 'id'], name='dateclass_keyset_idx'),
+        ),
+    ]
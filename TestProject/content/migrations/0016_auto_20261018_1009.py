@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:09
+
+from django.db import migrations
+
+
+def move_carts_to_ledger(apps, schema_editor):
+    ''' every id in the baught_products and baught_files arrays becomes a Purchase, ids of deleted items are dropped '''
+
+    Cart = apps.get_model('content', 'Cart')
+    File = apps.get_model('content', 'File')
+    Product = apps.get_model('content', 'Product')
+    Purchase = apps.get_model('content', 'Purchase')
+
+    purchases = []
+    for cart_obj in Cart.objects.all():
+        for product_id in Product.objects.filter(id__in = cart_obj.baught_products or []).values_list('id', flat = True):
+            purchases.append(Purchase(user_id = cart_obj.user_id, product_id = product_id))
+
+        for file_id in File.objects.filter(id__in = cart_obj.baught_files or []).values_list('id', flat = True):
+            purchases.append(Purchase(user_id = cart_obj.user_id, file_id = file_id))
+
+    Purchase.objects.bulk_create(purchases, ignore_conflicts = True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0015_auto_20261018_1009'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_carts_to_ledger, migrations.RunPython.noop),
+    ]
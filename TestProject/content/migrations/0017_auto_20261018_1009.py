@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0016_auto_20261018_1009'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='cart',
+            name='baught_files',
+        ),
+        migrations.RemoveField(
+            model_name='cart',
+            name='baught_products',
+        ),
+    ]
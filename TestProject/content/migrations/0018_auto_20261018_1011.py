@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content', '0017_auto_20261018_1009'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionPurchase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('baught_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchases', related_query_name='purchase', to='content.Subscription')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscription_purchases', related_query_name='subscription_purchase', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='subscriptionpurchase',
+            index=models.Index(fields=['user', 'subscription', 'expires_at'], name='subscription_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscriptionpurchase',
+            constraint=models.UniqueConstraint(fields=('user', 'subscription'), name='unique_subscription_purchase'),
+        ),
+    ]
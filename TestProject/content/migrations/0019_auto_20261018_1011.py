@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:11
+
+from datetime import timedelta
+
+from django.db import migrations
+
+
+def move_subscriptions_to_purchases(apps, schema_editor):
+    ''' carts kept one date for all their subscriptions, it is the best known start of each of them '''
+
+    Cart = apps.get_model('content', 'Cart')
+    SubscriptionPurchase = apps.get_model('content', 'SubscriptionPurchase')
+
+    purchases = []
+    for cart_obj in Cart.objects.exclude(date_of_buying_subscription = None).prefetch_related('baught_subscriptions'):
+        baught_at = cart_obj.date_of_buying_subscription
+        for sub_obj in cart_obj.baught_subscriptions.all():
+            if sub_obj.expiry_date_unit == 'day':
+                delta = timedelta(days = sub_obj.expiry_date_amount)
+            else:
+                delta = timedelta(hours = sub_obj.expiry_date_amount)
+            purchases.append(SubscriptionPurchase(user_id = cart_obj.user_id, subscription_id = sub_obj.id,
+                                                  baught_at = baught_at, expires_at = baught_at + delta))
+
+    SubscriptionPurchase.objects.bulk_create(purchases, ignore_conflicts = True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0018_auto_20261018_1011'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_subscriptions_to_purchases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:11
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0019_auto_20261018_1011'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='cart',
+            name='baught_subscriptions',
+        ),
+        migrations.RemoveField(
+            model_name='cart',
+            name='date_of_buying_subscription',
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:17
+
+from django.db import migrations
+
+
+def queue_existing_files(apps, schema_editor):
+    ''' files uploaded before the processing pipeline are probed like new uploads '''
+
+    File = apps.get_model('content', 'File')
+    ProcessingJob = apps.get_model('content', 'ProcessingJob')
+
+    ProcessingJob.objects.bulk_create(
+        [ProcessingJob(file_id = file_id, kind = 'probe') for file_id in File.objects.values_list('pk', flat = True)],
+        batch_size = 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0021_auto_20261018_1017'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_existing_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0022_auto_20261018_1017'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='stream_formats',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='processingjob',
+            name='kind',
+            field=models.CharField(choices=[('probe', 'probe'), ('preview', 'preview'), ('transcode', 'transcode'), ('package', 'package')], max_length=20),
+        ),
+    ]
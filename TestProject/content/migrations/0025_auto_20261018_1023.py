@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:23
+
+from django.db import migrations
+
+
+# the vectors use the simple configuration, names are not always english so they are not stemmed
+search_triggers = [
+    ('content_product', 'product_name'),
+    ('content_file', 'file_name'),
+]
+
+create_triggers = ''.join('''
+CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE OF {column} ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', {column});
+UPDATE {table} SET search_vector = to_tsvector('pg_catalog.simple', coalesce({column}, ''));
+'''.format(table = table, column = column) for table, column in search_triggers)
+
+drop_triggers = ''.join('''
+DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table};
+'''.format(table = table) for table, column in search_triggers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0024_auto_20261018_1023'),
+    ]
+
+    operations = [
+        migrations.RunSQL(create_triggers, drop_triggers),
+    ]
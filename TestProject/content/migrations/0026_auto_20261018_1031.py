@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0025_auto_20261018_1023'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='download_count',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='last_accessed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='recent_downloads',
+            field=models.FloatField(default=0),
+        ),
+    ]
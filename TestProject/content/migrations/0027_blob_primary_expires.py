@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0026_auto_20261018_1031'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='primary_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,14 +1,62 @@
-from django.db import models
+import os
+import uuid
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction, connection, IntegrityError
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.contrib.postgres.fields import ArrayField
 from django.core.validators import FileExtensionValidator
 
 
+allowed_file_extensions = ['pdf', 'avi', 'flv', 'wmv', 'mov', 'mp4', 'wma', 'flac', 'aac', 'mp3']
+
+class ProductQuerySet(models.QuerySet):
+    def owned_by(self, user):
+        ''' products of the stores which belong to the user '''
+
+        return self.filter(product_store__owner = user)
+
+# the manifest of each stream format a File can be packaged to, see content.processing.package
+stream_manifests = {'hls' : 'index.m3u8', 'dash' : 'manifest.mpd'}
+
+processing_status_choices = (('pending' , 'pending'),
+                             ('ready' , 'ready'),
+                             ('failed' , 'failed'),
+                             ('rejected' , 'rejected'))
+
+class FileQuerySet(models.QuerySet):
+    def owned_by(self, user):
+        ''' files whose product belongs to one of the user's stores '''
+
+        return self.filter(file_product__product_store__owner = user)
+
+    def with_blob(self):
+        ''' with blob_archived, blob_encoding and blob_size from the Blob of file_data, so a download knows where
+        and how the content is stored, and its size once decompressed, without asking the storages
+        '''
+
+        blobs = Blob.objects.filter(name = models.OuterRef('file_data'))
+        return self.annotate(blob_archived = models.Subquery(blobs.values('archived')[:1]),
+                             blob_encoding = models.Subquery(blobs.values('encoding')[:1]),
+                             blob_size = models.Subquery(blobs.values('size')[:1]))
+
+class SubscriptionQuerySet(models.QuerySet):
+    def owned_by(self, user):
+        ''' subscriptions of the stores which belong to the user '''
+
+        return self.filter(store_subscription__owner = user)
 
 class DateClass(models.Model):
     created_date = models.DateField(auto_now_add=True)
     updated_date = models.DateField(auto_now=True)
 
+    class Meta:
+        # the keyset of the list endpoints, see content.pagination
+        indexes = [models.Index(fields = ['created_date', 'id'], name = 'dateclass_keyset_idx')]
+
 class Category(DateClass):
     category_choices = (
         ("athletic" , "athletic"),
@@ -39,6 +87,13 @@ class Product(DateClass):
     product_category = models.ManyToManyField(Category, related_name = 'products_category', related_query_name = 'product_category')
     product_store = models.ForeignKey(Store, on_delete = models.CASCADE, related_name = 'products_store', related_query_name = 'product_store')
     buy_confirmation = models.CharField(max_length = 20 , choices = status_choices , default = 'cancel')
+    # kept up to date from product_name by a database trigger
+    search_vector = SearchVectorField(null = True, editable = False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [GinIndex(fields = ['search_vector'], name = 'product_search_idx')]
 
     def __str__(self):
         return self.product_name
@@ -48,15 +103,76 @@ class File(DateClass):
                       ('cancel' , 'cancel'))
 
     file_name = models.CharField(max_length = 30, null = True, blank = True)
-    file_data = models.FileField(validators=[FileExtensionValidator(allowed_extensions=['pdf', 'avi', 'flv', 'wmv', 'mov', 'mp4', 'wma', 'flac', 'aac', 'mp3'])])
+    file_data = models.FileField(validators=[FileExtensionValidator(allowed_extensions=allowed_file_extensions)])
     file_product = models.ForeignKey(Product, on_delete = models.CASCADE, verbose_name = 'belonges_to_this_product', related_name = 'file_products', related_query_name = 'file_product')
     file_price = models.PositiveIntegerField(null = True, blank = True)
     is_free = models.BooleanField()
     buy_confirmation = models.CharField(max_length = 20 , choices = status_choices , default = 'cancel')
+    content_hash = models.CharField(max_length = 64, blank = True)
+    file_size = models.BigIntegerField(null = True, blank = True)
+    mime_type = models.CharField(max_length = 100, blank = True)
+    processing_status = models.CharField(max_length = 20, choices = processing_status_choices, default = 'pending')
+    duration = models.FloatField(null = True, blank = True)
+    bitrate = models.PositiveIntegerField(null = True, blank = True)
+    page_count = models.PositiveIntegerField(null = True, blank = True)
+    preview = models.FileField(null = True, blank = True)
+    stream_data = models.FileField(null = True, blank = True)
+    stream_formats = models.CharField(max_length = 20, blank = True)
+    # kept up to date from file_name by a database trigger
+    search_vector = SearchVectorField(null = True, editable = False)
+
+    objects = FileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [GinIndex(fields = ['search_vector'], name = 'file_search_idx')]
+
+    # the fields whose stored content is counted in Blob, see content.signals
+    blob_fields = ('file_data', 'preview', 'stream_data')
 
     def __str__(self):
         return self.file_name
 
+    def get_download_name(self):
+        ''' the name chosen by the owner with the format of the stored file '''
+
+        extension = os.path.splitext(self.file_data.name)[1]
+        file_name = self.file_name or 'file'
+        if file_name.lower().endswith(extension.lower()):
+            return file_name
+        return file_name + extension
+
+    def get_stream_formats(self):
+        return [stream_format for stream_format in self.stream_formats.split(',') if stream_format]
+
+    def get_stream_name(self, stream_format, name):
+        ''' storage name of a manifest or segment packaged from the content, next to the content itself '''
+
+        return '%s/%s/%s' % (os.path.splitext(self.file_data.name)[0], stream_format, name)
+
+    def set_upload_metadata(self, uploaded_file):
+        ''' take the hash, size and real type computed by the upload handler while the file was received '''
+
+        self.content_hash = getattr(uploaded_file, 'content_hash', '')
+        self.file_size = uploaded_file.size if self.content_hash else None
+        self.mime_type = getattr(uploaded_file, 'sniffed_type', '')
+
+    def update_content_hash(self, stored_file = None):
+        ''' read the stored file once to remember its sha256 and size, from the opened stored_file when given '''
+
+        if stored_file is None:
+            stored_file = self.file_data.open('rb')
+
+        digest = hashlib.sha256()
+        size = 0
+        with stored_file:
+            for chunk in stored_file.chunks():
+                digest.update(chunk)
+                size += len(chunk)
+
+        self.content_hash = digest.hexdigest()
+        self.file_size = size
+        File.objects.filter(pk = self.pk).update(content_hash = self.content_hash, file_size = self.file_size)
+
 class Subscription(DateClass):
     status_choices = (('buy' , 'buy') ,
                       ('cancel' , 'cancel'))
@@ -69,15 +185,355 @@ class Subscription(DateClass):
     expiry_date_unit = models.CharField(max_length = 20 , choices = expiry_date_unit_choices)
     store_subscription = models.OneToOneField(Store, on_delete = models.CASCADE, related_name = 'subscription')
     buy_confirmation = models.CharField(max_length = 20 , choices = status_choices , default = 'cancel')
+
+    objects = SubscriptionQuerySet.as_manager()
+
+    def get_expiry_delta(self):
+        ''' how long a subscription bought now stays valid '''
+
+        if self.expiry_date_unit == 'day':
+            return timedelta(days = self.expiry_date_amount)
+        return timedelta(hours = self.expiry_date_amount)
     
+class CartQuerySet(models.QuerySet):
+    def ensure(self, user):
+        ''' make the cart of the user with its first purchase, the unique user_id keeps two first purchases at the
+        same time from making two. the losing insert is rolled back with its DateClass row in its savepoint.
+        '''
+
+        try:
+            with transaction.atomic():
+                self.get_or_create(user = user)
+        except IntegrityError:
+            pass
+
 class Cart(DateClass):
     user = models.OneToOneField(User, on_delete = models.CASCADE, related_name = 'user_carts')
-    baught_subscriptions = models.ManyToManyField(Subscription, related_name = 'carts', related_query_name = 'cart')
-    date_of_buying_subscription = models.DateTimeField(null = True, blank = True)
-    baught_products = ArrayField(models.PositiveSmallIntegerField(), null = True, blank = True)
-    baught_files = ArrayField(models.PositiveSmallIntegerField(), null = True, blank = True)
+
+    objects = CartQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username+ '-' +'Cart'
-    
-    
+
+
+class PurchaseQuerySet(models.QuerySet):
+    def record_many(self, user, products = (), files = ()):
+        ''' insert the purchases with one idempotent statement, returns the ids of the products and files which were not baught before '''
+
+        rows = [(user.id, product.id, None) for product in products] + [(user.id, None, file.id) for file in files]
+        if not rows:
+            return set(), set()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (user_id, product_id, file_id, created_at) VALUES %s '
+                'ON CONFLICT DO NOTHING RETURNING product_id, file_id'
+                % (self.model._meta.db_table, ', '.join(['(%s, %s, %s, NOW())'] * len(rows))),
+                [value for row in rows for value in row])
+            inserted = cursor.fetchall()
+
+        if inserted:
+            Cart.objects.ensure(user)
+        return ({product_id for product_id, file_id in inserted if product_id is not None},
+                {file_id for product_id, file_id in inserted if file_id is not None})
+
+    def record(self, user, product = None, file = None):
+        ''' returns False when the product or file had already been baught '''
+
+        product_ids, file_ids = self.record_many(user, [product] if product else [], [file] if file else [])
+        return bool(product_ids or file_ids)
+
+class Purchase(models.Model):
+    ''' append-only ledger of the products and files the users have baught '''
+
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'purchases', related_query_name = 'purchase')
+    product = models.ForeignKey(Product, on_delete = models.CASCADE, null = True, blank = True, related_name = 'purchases', related_query_name = 'purchase')
+    file = models.ForeignKey(File, on_delete = models.CASCADE, null = True, blank = True, related_name = 'purchases', related_query_name = 'purchase')
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    objects = PurchaseQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['user', 'product'], name = 'unique_product_purchase'),
+            models.UniqueConstraint(fields = ['user', 'file'], name = 'unique_file_purchase'),
+            models.CheckConstraint(
+                check = (models.Q(product__isnull = False, file__isnull = True) |
+                         models.Q(product__isnull = True, file__isnull = False)),
+                name = 'purchase_has_one_item'),
+        ]
+
+    def __str__(self):
+        return self.user.username + '-' + 'Purchase'
+
+class SubscriptionPurchaseQuerySet(models.QuerySet):
+    def active(self, user, sub_obj, now = None):
+        return self.filter(user = user, subscription = sub_obj, expires_at__gt = now or timezone.now())
+
+    def buy_many(self, user, subscriptions):
+        ''' buy subscriptions or renew the expired ones, returns {subscription id : new expiry} of those which were not still valid
+
+        new rows are one INSERT ... ON CONFLICT DO NOTHING and renewals one UPDATE guarded by expires_at <= now,
+        so concurrent requests can not buy the same period twice.
+        '''
+
+        now = timezone.now()
+        expiries = {sub_obj.id : now + sub_obj.get_expiry_delta() for sub_obj in subscriptions}
+        if not expiries:
+            return {}
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (user_id, subscription_id, baught_at, expires_at) VALUES %s '
+                'ON CONFLICT DO NOTHING RETURNING subscription_id'
+                % (table, ', '.join(['(%s, %s, %s, %s)'] * len(expiries))),
+                [value for sub_id, expires_at in expiries.items() for value in (user.id, sub_id, now, expires_at)])
+            baught = {row[0] for row in cursor.fetchall()}
+
+            others = [sub_id for sub_id in expiries if sub_id not in baught]
+            if others:
+                cursor.execute(
+                    'UPDATE %s AS purchase SET baught_at = %%s, expires_at = renewal.expires_at '
+                    'FROM (VALUES %s) AS renewal (subscription_id, expires_at) '
+                    'WHERE purchase.user_id = %%s AND purchase.subscription_id = renewal.subscription_id '
+                    'AND purchase.expires_at <= %%s RETURNING purchase.subscription_id'
+                    % (table, ', '.join(['(%s, %s::timestamptz)'] * len(others))),
+                    [now] + [value for sub_id in others for value in (sub_id, expiries[sub_id])] + [user.id, now])
+                baught.update(row[0] for row in cursor.fetchall())
+
+        if baught:
+            Cart.objects.ensure(user)
+        return {sub_id : expiries[sub_id] for sub_id in baught}
+
+    def buy(self, user, sub_obj):
+        ''' buy a subscription or renew it once it has expired, returns the new expiry or None while it is still valid '''
+
+        return self.buy_many(user, [sub_obj]).get(sub_obj.id)
+
+class SubscriptionPurchase(models.Model):
+    ''' the current period of a subscription baught by a user, renewing it moves expires_at '''
+
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'subscription_purchases', related_query_name = 'subscription_purchase')
+    subscription = models.ForeignKey(Subscription, on_delete = models.CASCADE, related_name = 'purchases', related_query_name = 'purchase')
+    baught_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    objects = SubscriptionPurchaseQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['user', 'subscription'], name = 'unique_subscription_purchase'),
+        ]
+        indexes = [
+            models.Index(fields = ['user', 'subscription', 'expires_at'], name = 'subscription_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return self.user.username + '-' + 'SubscriptionPurchase'
+
+class BlobQuerySet(models.QuerySet):
+    def record_downloads(self, downloads):
+        ''' add the buffered downloads of the blobs with one statement, downloads maps names to (count, last access) '''
+
+        if not downloads:
+            return
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {table} SET download_count = {table}.download_count + v.count, '
+                'recent_downloads = {table}.recent_downloads + v.count, '
+                'last_accessed = GREATEST({table}.last_accessed, v.accessed) '
+                'FROM (VALUES {values}) AS v (name, count, accessed) WHERE {table}.name = v.name'
+                .format(table = table, values = ', '.join(['(%s, %s, %s::timestamptz)'] * len(downloads))),
+                [value for name, (count, accessed) in downloads.items() for value in (name, count, accessed)])
+
+class Blob(models.Model):
+    ''' a stored content shared by every File with the same sha256, removed with the last File using it '''
+
+    name = models.CharField(max_length = 255, primary_key = True)
+    # the size of the content, also of a blob stored compressed, recorded when it is stored
+    size = models.BigIntegerField(null = True, blank = True)
+    ref_count = models.PositiveIntegerField(default = 0)
+    # the downloads of the blob, recent_downloads decays on every rebalance, see content.tiering
+    download_count = models.BigIntegerField(default = 0)
+    recent_downloads = models.FloatField(default = 0)
+    last_accessed = models.DateTimeField(default = timezone.now)
+    archived = models.BooleanField(default = False)
+    # the main copy of an archived blob is removed after this, once the links issued before it was archived expired
+    primary_expires = models.DateTimeField(null = True, blank = True)
+    # the Content-Encoding the blob is stored with in the main storage, empty when it is stored as it is
+    encoding = models.CharField(max_length = 10, blank = True)
+
+    objects = BlobQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, size = None, encoding = ''):
+        with transaction.atomic():
+            blob, created = cls.objects.select_for_update().get_or_create(name = name, defaults = {'size' : size, 'encoding' : encoding})
+            blob.ref_count += 1
+            blob.save(update_fields = ['ref_count'])
+
+    @classmethod
+    def release(cls, name):
+        with transaction.atomic():
+            try:
+                blob = cls.objects.select_for_update().get(name = name)
+            except cls.DoesNotExist:
+                return
+
+            blob.ref_count -= 1
+            if blob.ref_count > 0:
+                blob.save(update_fields = ['ref_count'])
+                return
+
+            blob.delete()
+            storage = File._meta.get_field('file_data').storage
+            transaction.on_commit(lambda: storage.delete(name))
+
+class EntitlementQuerySet(models.QuerySet):
+    def grant_stores(self, user, valid_untils):
+        ''' insert or move the store entitlements of the user with one statement, valid_untils maps store ids to dates '''
+
+        if not valid_untils:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (user_id, store_id, valid_until) VALUES %s '
+                'ON CONFLICT (user_id, store_id) DO UPDATE SET valid_until = EXCLUDED.valid_until'
+                % (self.model._meta.db_table, ', '.join(['(%s, %s, %s)'] * len(valid_untils))),
+                [value for store_id, valid_until in valid_untils.items() for value in (user.id, store_id, valid_until)])
+
+class Entitlement(models.Model):
+    ''' download right of a user on exactly one file, product or store, written when the user buys it '''
+
+    user = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'entitlements', related_query_name = 'entitlement')
+    file = models.ForeignKey(File, on_delete = models.CASCADE, null = True, blank = True, related_name = 'entitlements', related_query_name = 'entitlement')
+    product = models.ForeignKey(Product, on_delete = models.CASCADE, null = True, blank = True, related_name = 'entitlements', related_query_name = 'entitlement')
+    store = models.ForeignKey(Store, on_delete = models.CASCADE, null = True, blank = True, related_name = 'entitlements', related_query_name = 'entitlement')
+    valid_until = models.DateTimeField(null = True, blank = True)
+
+    objects = EntitlementQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['user', 'file'], name = 'unique_file_entitlement'),
+            models.UniqueConstraint(fields = ['user', 'product'], name = 'unique_product_entitlement'),
+            models.UniqueConstraint(fields = ['user', 'store'], name = 'unique_store_entitlement'),
+            models.CheckConstraint(
+                check = (models.Q(file__isnull = False, product__isnull = True, store__isnull = True) |
+                         models.Q(file__isnull = True, product__isnull = False, store__isnull = True) |
+                         models.Q(file__isnull = True, product__isnull = True, store__isnull = False)),
+                name = 'entitlement_has_one_target'),
+        ]
+
+    def __str__(self):
+        return self.user.username + '-' + 'Entitlement'
+
+
+class ProcessingJobQuerySet(models.QuerySet):
+    def claim(self, worker, limit):
+        ''' lock up to limit runnable jobs for the worker, running jobs of a dead worker are taken again after PROCESSING_JOB_TIMEOUT '''
+
+        now = timezone.now()
+        runnable = (models.Q(status = 'queued', run_after__lte = now) |
+                    models.Q(status = 'running', locked_at__lt = now - settings.PROCESSING_JOB_TIMEOUT))
+
+        with transaction.atomic():
+            jobs = list(self.select_for_update(skip_locked = True).filter(runnable).order_by('run_after')[:limit])
+            self.filter(pk__in = [job.pk for job in jobs]).update(status = 'running', locked_by = worker, locked_at = now,
+                                                                 attempts = models.F('attempts') + 1)
+        for job in jobs:
+            job.status, job.locked_by, job.locked_at, job.attempts = 'running', worker, now, job.attempts + 1
+        return jobs
+
+    def pending(self):
+        return self.filter(status__in = ['queued', 'running'])
+
+class ProcessingJob(models.Model):
+    ''' a step of the background processing of a File, run by the process_media command '''
+
+    kind_choices = (('probe' , 'probe'),
+                    ('preview' , 'preview'),
+                    ('transcode' , 'transcode'),
+                    ('package' , 'package'))
+
+    status_choices = (('queued' , 'queued'),
+                      ('running' , 'running'),
+                      ('done' , 'done'),
+                      ('failed' , 'failed'))
+
+    file = models.ForeignKey(File, on_delete = models.CASCADE, related_name = 'processing_jobs', related_query_name = 'processing_job')
+    kind = models.CharField(max_length = 20, choices = kind_choices)
+    status = models.CharField(max_length = 20, choices = status_choices, default = 'queued')
+    attempts = models.PositiveIntegerField(default = 0)
+    run_after = models.DateTimeField(default = timezone.now)
+    locked_by = models.CharField(max_length = 100, blank = True)
+    locked_at = models.DateTimeField(null = True, blank = True)
+    last_error = models.TextField(blank = True)
+    created_at = models.DateTimeField(auto_now_add = True)
+    updated_at = models.DateTimeField(auto_now = True)
+
+    objects = ProcessingJobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields = ['status', 'run_after'], name = 'processing_job_queue_idx')]
+
+    def __str__(self):
+        return '%s-%s' % (self.kind, self.file_id)
+
+    def succeed(self):
+        self.status = 'done'
+        self.last_error = ''
+        self.save(update_fields = ['status', 'last_error', 'updated_at'])
+
+    def fail(self, error, retry = True):
+        ''' queue the job again after a growing delay, or give up after PROCESSING_MAX_ATTEMPTS '''
+
+        self.last_error = error
+        if retry and self.attempts < settings.PROCESSING_MAX_ATTEMPTS:
+            self.status = 'queued'
+            self.run_after = timezone.now() + settings.PROCESSING_RETRY_DELAY * 2 ** (self.attempts - 1)
+        else:
+            self.status = 'failed'
+        self.save(update_fields = ['status', 'run_after', 'last_error', 'updated_at'])
+
+
+class UploadSession(models.Model):
+    ''' a resumable upload of an owner, chunks are appended to a staging file until it is finalized into a File '''
+
+    id = models.UUIDField(primary_key = True, default = uuid.uuid4, editable = False)
+    owner = models.ForeignKey(User, on_delete = models.CASCADE, related_name = 'upload_sessions', related_query_name = 'upload_session')
+    file_name = models.CharField(max_length = 255)
+    file_price = models.PositiveIntegerField(null = True, blank = True)
+    file_product = models.ForeignKey(Product, on_delete = models.CASCADE, related_name = 'upload_sessions', related_query_name = 'upload_session')
+    is_free = models.BooleanField()
+    upload_name = models.CharField(max_length = 255)
+    upload_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default = 0)
+    created_at = models.DateTimeField(auto_now_add = True)
+    updated_at = models.DateTimeField(auto_now = True)
+
+    def __str__(self):
+        return self.owner.username + '-' + self.upload_name
+
+    def get_staging_path(self):
+        return os.path.join(settings.UPLOAD_STAGING_ROOT, str(self.id))
+
+    def get_stored_name(self):
+        ''' the name of the File, the chosen file_name with the extension of the uploaded file '''
+
+        if self.file_name == self.upload_name:
+            return self.upload_name
+        return self.file_name + os.path.splitext(self.upload_name)[1]
+
+    def delete_staged(self):
+        try:
+            os.remove(self.get_staging_path())
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,124 @@
+import json
+import base64
+import datetime
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    ''' newest first pages which continue after the last seen (created_date, id), so deep pages cost no OFFSET
+
+    views can set keyset_fields to page on other unique orderings, the last field must be unique.
+    a keyset field can also be an annotation of the queryset, like the rank of a search.
+    '''
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    keyset_fields = ('created_date', 'id')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for field in self.fields:
+            value = getattr(obj, field)
+            values.append(value.isoformat() if isinstance(value, datetime.date) else value)
+        cursor = json.dumps({'v' : values, 'r' : reverse}, separators = (',', ':'))
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    def to_python(self, queryset, field, value):
+        try:
+            return queryset.model._meta.get_field(field).to_python(value)
+        except FieldDoesNotExist:
+            # an annotation, json keeps its number as it was
+            if not isinstance(value, (int, float)):
+                raise ValueError(value)
+            return value
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            values = [self.to_python(queryset, field, value) for field, value in zip(self.fields, cursor['v'])]
+            reverse = bool(cursor['r'])
+        except Exception:
+            raise NotFound('Invalid cursor')
+        if len(values) != len(self.fields):
+            raise NotFound('Invalid cursor')
+        return values, reverse
+
+    def keyset_filter(self, values, lookup):
+        ''' rows after the cursor in lexicographic order of the keyset fields '''
+
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            equal = dict(zip(self.fields[:position], values[:position]))
+            equal[field + '__' + lookup] = values[position]
+            condition |= Q(**equal)
+        return condition
+
+    def paginate_queryset(self, queryset, request, view = None):
+        self.request = request
+        self.fields = getattr(view, 'keyset_fields', self.keyset_fields)
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        reverse = False
+        if cursor:
+            values, reverse = self.decode_cursor(queryset, cursor)
+            queryset = queryset.filter(self.keyset_filter(values, 'gt' if reverse else 'lt'))
+
+        if reverse:
+            queryset = queryset.order_by(*self.fields)
+        else:
+            queryset = queryset.order_by(*['-' + field for field in self.fields])
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+
+        self.next_cursor = None
+        self.previous_cursor = None
+        if page:
+            if has_more or reverse:
+                self.next_cursor = self.encode_cursor(page[-1], False)
+            if (has_more and reverse) or (cursor and not reverse):
+                self.previous_cursor = self.encode_cursor(page[0], True)
+        return page
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_cursor)),
+            ('previous', self.get_link(self.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type' : 'object',
+            'properties' : {
+                'next' : {'type' : 'string', 'nullable' : True},
+                'previous' : {'type' : 'string', 'nullable' : True},
+                'results' : schema,
+            },
+        }
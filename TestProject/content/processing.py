@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+
+from .models import File, ProcessingJob, stream_manifests
+from .responsecache import invalidate
+from .tiering import tiered_file
+
+
+logger = logging.getLogger(__name__)
+
+# ffprobe format names of the allowed extensions, pdf files are checked without ffprobe
+probe_formats = {
+    'mp4' : 'mp4', 'mov' : 'mov', 'avi' : 'avi', 'flv' : 'flv', 'wmv' : 'asf',
+    'wma' : 'asf', 'flac' : 'flac', 'aac' : 'aac', 'mp3' : 'mp3',
+}
+video_extensions = ('mp4', 'mov', 'avi', 'flv', 'wmv')
+pdf_page_re = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+# longer than any page marker, see probe_pdf
+PDF_PAGE_OVERLAP = 64
+encode_options = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-c:a', 'aac', '-b:a', '128k']
+
+
+class Rejected(Exception):
+    ''' the content is not what its format says, retrying will not help '''
+
+
+def start_processing(file_obj):
+    ''' forget what was found for the previous content of the file and queue its processing '''
+
+    if file_obj.preview or file_obj.stream_data:
+        file_obj.preview = None
+        file_obj.stream_data = None
+        file_obj.save(update_fields = ['preview', 'stream_data'])
+
+    File.objects.filter(pk = file_obj.pk).update(processing_status = 'pending', duration = None, bitrate = None,
+                                                 page_count = None, stream_formats = '')
+    file_obj.processing_status = 'pending'
+    file_obj.processing_jobs.pending().update(status = 'failed', last_error = 'the content of the file has changed')
+    ProcessingJob.objects.create(file = file_obj, kind = 'probe')
+
+def get_extension(file_obj):
+    return os.path.splitext(file_obj.file_data.name)[1][1:].lower()
+
+def stored_content(field_file):
+    ''' the copy of a stored blob in the tier which has it, a blob nobody downloaded may be archived before its jobs run '''
+
+    return tiered_file(field_file.name)
+
+@contextmanager
+def local_path(stored_file):
+    ''' a path of the stored content for the command line tools, copied to a temporary file when the storage is not local '''
+
+    # a streamed file is only read decompressed through its storage, its path holds the compressed content
+    try:
+        path = None if stored_file.streamed else stored_file.storage.path(stored_file.name)
+    except NotImplementedError:
+        path = None
+
+    # a blob stored compressed has no file at its path, it is decompressed into the copy
+    if path and os.path.exists(path):
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix = os.path.splitext(stored_file.name)[1]) as copy:
+        download = getattr(stored_file.storage, 'download', None)
+        if download is not None:
+            # an object store fetches big files in parallel parts
+            download(stored_file.name, copy)
+        else:
+            with stored_file.open('rb') as opened:
+                shutil.copyfileobj(opened, copy)
+        copy.flush()
+        yield copy.name
+
+def run_command(args):
+    try:
+        completed = subprocess.run(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                   timeout = settings.PROCESSING_COMMAND_TIMEOUT)
+    except FileNotFoundError:
+        raise RuntimeError('%s is not installed' % args[0])
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode('utf-8', 'replace').strip()[-1000:] or '%s failed' % args[0])
+    return completed.stdout
+
+def verify_checksum(file_obj):
+    ''' the stored content should still have the sha256 it was uploaded with '''
+
+    if not file_obj.content_hash:
+        file_obj.update_content_hash(stored_content(file_obj.file_data).open('rb'))
+        return
+
+    digest = hashlib.sha256()
+    with stored_content(file_obj.file_data).open('rb') as stored_file:
+        for chunk in stored_file.chunks():
+            digest.update(chunk)
+    if digest.hexdigest() != file_obj.content_hash:
+        raise RuntimeError('the stored content does not match its sha256')
+
+def probe_pdf(file_obj):
+    ''' count the pages of a pdf chunk by chunk, the end of each chunk is scanned again with the next one '''
+
+    page_count = 0
+    tail = b''
+    with stored_content(file_obj.file_data).open('rb') as stored_file:
+        for position, chunk in enumerate(stored_file.chunks()):
+            if position == 0 and not chunk.startswith(b'%PDF-'):
+                raise Rejected('the file is not a pdf')
+            scanned = tail + chunk
+            # the pages starting in the kept end are counted with the next chunk, once they are whole
+            cut = max(len(scanned) - PDF_PAGE_OVERLAP, 0)
+            page_count += sum(1 for match in pdf_page_re.finditer(scanned) if match.start() < cut)
+            tail = scanned[cut:]
+    if not tail and not page_count:
+        raise Rejected('the file is not a pdf')
+    page_count += len(pdf_page_re.findall(tail))
+    return {'page_count' : page_count or None}
+
+def probe_media(file_obj):
+    with local_path(stored_content(file_obj.file_data)) as path:
+        output = run_command([settings.FFPROBE_BINARY, '-v', 'error', '-print_format', 'json',
+                              '-show_format', '-show_streams', path])
+    info = json.loads(output.decode('utf-8'))
+
+    format_info = info.get('format', {})
+    if probe_formats[get_extension(file_obj)] not in format_info.get('format_name', '').split(','):
+        raise Rejected('the file is %s, not %s' % (format_info.get('format_name') or 'unknown', get_extension(file_obj)))
+
+    duration = format_info.get('duration')
+    bitrate = format_info.get('bit_rate')
+    return {
+        'duration' : float(duration) if duration else None,
+        'bitrate' : int(bitrate) if bitrate else None,
+        'has_video' : any(stream.get('codec_type') == 'video' for stream in info.get('streams', [])),
+    }
+
+def probe(file_obj):
+    ''' check the content really is of its format, remember its metadata and queue the next steps '''
+
+    verify_checksum(file_obj)
+
+    if get_extension(file_obj) == 'pdf':
+        metadata = probe_pdf(file_obj)
+    else:
+        metadata = probe_media(file_obj)
+
+    has_video = metadata.pop('has_video', False)
+    File.objects.filter(pk = file_obj.pk).update(**metadata)
+
+    if has_video:
+        ProcessingJob.objects.create(file = file_obj, kind = 'preview')
+
+    # packaging starts from the transcoded file when there is one
+    if settings.PROCESSING_TRANSCODE and get_extension(file_obj) in video_extensions:
+        ProcessingJob.objects.create(file = file_obj, kind = 'transcode')
+    elif settings.PACKAGING_FORMATS and get_extension(file_obj) in probe_formats:
+        ProcessingJob.objects.create(file = file_obj, kind = 'package')
+
+def save_output(file_obj, field, command, suffix):
+    ''' run an ffmpeg command writing into a temporary file and store the result in a field of the file '''
+
+    with local_path(stored_content(file_obj.file_data)) as path, tempfile.TemporaryDirectory() as output_dir:
+        output = os.path.join(output_dir, 'output' + suffix)
+        run_command([settings.FFMPEG_BINARY, '-v', 'error', '-y', '-i', path] + command + [output])
+
+        with open(output, 'rb') as output_file:
+            getattr(file_obj, field).save(os.path.basename(output), DjangoFile(output_file), save = False)
+        file_obj.save(update_fields = [field])
+
+def make_preview(file_obj):
+    ''' a small jpeg of a frame near the start, or of the cover of an audio file '''
+
+    seek = min(1.0, (file_obj.duration or 0) / 2)
+    save_output(file_obj, 'preview', ['-ss', str(seek), '-frames:v', '1', '-vf', 'scale=320:-2'], '.jpg')
+
+def transcode(file_obj):
+    ''' an h264/aac mp4 with its index at the start, which players can stream without the whole file '''
+
+    save_output(file_obj, 'stream_data', encode_options + ['-movflags', '+faststart'], '.mp4')
+
+    if settings.PACKAGING_FORMATS:
+        ProcessingJob.objects.create(file = file_obj, kind = 'package')
+
+def package_options(stream_format, output_dir):
+    segment_seconds = str(settings.PACKAGING_SEGMENT_SECONDS)
+    manifest = os.path.join(output_dir, stream_manifests[stream_format])
+
+    if stream_format == 'hls':
+        return ['-f', 'hls', '-hls_time', segment_seconds, '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.ts'), manifest]
+    return ['-f', 'dash', '-seg_duration', segment_seconds, '-init_seg_name', 'init_$RepresentationID$.m4s',
+            '-media_seg_name', 'segment_$RepresentationID$_$Number%05d$.m4s', manifest]
+
+def package(file_obj):
+    ''' segment the file into the PACKAGING_FORMATS streams and store them next to its content
+
+    the segments are stored before their manifest, so a manifest never names a missing segment. the packages
+    belong to the blob, which other Files may share and serve, so a format whose manifest is stored already
+    is not packaged again.
+    '''
+
+    storage = file_obj.file_data.storage
+    stream_formats = [stream_format for stream_format in settings.PACKAGING_FORMATS
+                      if not storage.exists(file_obj.get_stream_name(stream_format, stream_manifests[stream_format]))]
+
+    if file_obj.stream_data:
+        source, codec = file_obj.stream_data, ['-c', 'copy']
+    else:
+        source = file_obj.file_data
+        codec = encode_options + ['-force_key_frames', 'expr:gte(t,n_forced*%d)' % settings.PACKAGING_SEGMENT_SECONDS]
+
+    if stream_formats:
+        with local_path(stored_content(source)) as path, tempfile.TemporaryDirectory() as output_dir:
+            for stream_format in stream_formats:
+                format_dir = os.path.join(output_dir, stream_format)
+                os.makedirs(format_dir)
+                # the main video, not cover pictures, and the main audio, whichever of them exist
+                run_command([settings.FFMPEG_BINARY, '-v', 'error', '-y', '-i', path, '-map', '0:V:0?', '-map', '0:a:0?']
+                            + codec + package_options(stream_format, format_dir))
+
+                manifest = stream_manifests[stream_format]
+                for name in sorted(os.listdir(format_dir), key = lambda name : name == manifest):
+                    with open(os.path.join(format_dir, name), 'rb') as packaged:
+                        storage.save_as(file_obj.get_stream_name(stream_format, name), DjangoFile(packaged))
+
+    File.objects.filter(pk = file_obj.pk).update(stream_formats = ','.join(settings.PACKAGING_FORMATS))
+
+job_handlers = {
+    'probe' : probe,
+    'preview' : make_preview,
+    'transcode' : transcode,
+    'package' : package,
+}
+
+def run_job(job):
+    ''' run a claimed job and keep the processing_status of its file up to date '''
+
+    file_obj = File.objects.get(pk = job.file_id)
+
+    try:
+        job_handlers[job.kind](file_obj)
+    except Rejected as error:
+        job.fail(str(error), retry = False)
+        File.objects.filter(pk = file_obj.pk).update(processing_status = 'rejected')
+        # update() sends no post_save, the product pages listing the file are cached
+        invalidate('file')
+        return
+    except Exception as error:
+        logger.exception('%s of file %s failed', job.kind, file_obj.pk)
+        job.fail(str(error) or error.__class__.__name__)
+        if job.status == 'failed':
+            File.objects.filter(pk = file_obj.pk).update(processing_status = 'failed')
+        return
+
+    job.succeed()
+    if not file_obj.processing_jobs.pending().exists():
+        File.objects.filter(pk = file_obj.pk, processing_status = 'pending').update(processing_status = 'ready')
@@ -0,0 +1,77 @@
+import json
+import time
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+def get_response_cache():
+    return caches[settings.RESPONSE_CACHE]
+
+def version_key(namespace):
+    return 'response-version:%s' % namespace
+
+def new_version():
+    # a lost version starts again from the clock, so it can not match the keys cached before it was lost
+    return int(time.time() * 1000000)
+
+def get_versions(namespaces):
+    cache = get_response_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            version = new_version()
+            versions[key] = version if cache.add(key, version, None) else cache.get(key, version)
+    return [versions[key] for key in keys]
+
+def bump(namespace):
+    cache = get_response_cache()
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), new_version(), None)
+
+def invalidate(namespace):
+    ''' drop every cached response which read the namespace, in O(1)
+
+    the keys of the cached responses contain the versions of their namespaces, so moving a version orphans
+    them all and they expire by themselves. it is moved again after the commit, because a response cached
+    from the old rows before the commit would be stored under the new version.
+    '''
+
+    bump(namespace)
+    transaction.on_commit(lambda : bump(namespace))
+
+def cached_response(request, namespaces, get_response):
+    ''' answer from the cache, or with 304 when the client has it already, while no namespace has changed '''
+
+    versions = get_versions(namespaces)
+    fingerprint = hashlib.md5(repr((request.build_absolute_uri(), list(namespaces), versions)).encode('utf-8')).hexdigest()
+    headers = {'ETag' : '"%s"' % fingerprint, 'Cache-Control' : 'private, no-cache'}
+
+    if headers['ETag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return Response(status = 304, headers = headers)
+
+    cache = get_response_cache()
+    key = 'response:%s' % fingerprint
+    data = cache.get(key)
+
+    if data is None:
+        response = get_response()
+        if response.status_code != 200:
+            return response
+        # cached as plain json, pickling the hyperlinks would call __str__ on the deferred rows they point to
+        cache.set(key, json.loads(JSONRenderer().render(response.data)), settings.RESPONSE_CACHE_TIMEOUT)
+    else:
+        response = Response(data)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
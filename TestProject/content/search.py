@@ -0,0 +1,114 @@
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, F, FloatField, Q, Value
+from rest_framework.exceptions import ValidationError
+
+from .pagination import KeysetPagination
+
+
+# the text search configuration of the search_vector triggers, see migration 0025
+search_config = 'simple'
+
+# the price facet counts the matches in each [low, high) range, None is open
+price_ranges = ((0, 10), (10, 50), (50, 100), (100, None))
+
+
+class SearchPagination(KeysetPagination):
+    ''' the best ranked matches first, ties newest first '''
+
+    keyset_fields = ('rank', 'id')
+
+
+def parse_price(value, name):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name : 'should be a number'})
+
+def parse_bool(value, name):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValidationError({name : 'should be true or false'})
+
+def price_range_name(low, high):
+    return '%s-%s' % (low, '' if high is None else high)
+
+
+class CatalogueSearchMixin:
+    ''' ranked full text search over search_vector with facet filters and facet counts
+
+    views set the lookups of their model for each facet in facet_fields and the price in price_field:
+    ?q=<words>&category=<name>&is_free=true&store=<id>&min_price=<price>&max_price=<price>
+    category and store can be given more than once.
+    '''
+
+    pagination_class = SearchPagination
+    facet_fields = {}
+    price_field = None
+
+    def search(self, queryset):
+        words = self.request.query_params.get('q', '').strip()
+        if not words:
+            return queryset.annotate(rank = Value(0.0, output_field = FloatField()))
+
+        query = SearchQuery(words, config = search_config)
+        return queryset.filter(search_vector = query).annotate(rank = SearchRank(F('search_vector'), query))
+
+    def filter_facets(self, queryset):
+        params = self.request.query_params
+        model = queryset.model
+
+        # through the categories a row can join many times, so they are matched in a subquery
+        categories = params.getlist('category')
+        if categories:
+            lookup = self.facet_fields['category'] + '__in'
+            queryset = queryset.filter(pk__in = model.objects.filter(**{lookup : categories}).values('pk'))
+
+        stores = params.getlist('store')
+        if stores:
+            if not all(store.isdigit() for store in stores):
+                raise ValidationError({'store' : 'should be the id of a store'})
+            queryset = queryset.filter(**{self.facet_fields['store'] + '__in' : stores})
+
+        if 'is_free' in params:
+            queryset = queryset.filter(is_free = parse_bool(params['is_free'], 'is_free'))
+        if 'min_price' in params:
+            queryset = queryset.filter(**{self.price_field + '__gte' : parse_price(params['min_price'], 'min_price')})
+        if 'max_price' in params:
+            queryset = queryset.filter(**{self.price_field + '__lte' : parse_price(params['max_price'], 'max_price')})
+
+        return queryset
+
+    def filter_queryset(self, queryset):
+        return self.filter_facets(self.search(super().filter_queryset(queryset)))
+
+    def get_facets(self, queryset):
+        ''' how many of the matches have each value of the facets, one query per facet '''
+
+        matches = queryset.model.objects.filter(pk__in = queryset.values('pk'))
+
+        facets = {}
+        for facet, lookup in self.facet_fields.items():
+            counts = matches.order_by().values_list(lookup).annotate(count = Count('pk', distinct = True))
+            facets[facet] = {str(value).lower() if isinstance(value, bool) else value : count
+                             for value, count in counts if value is not None}
+
+        price_counts = {}
+        for low, high in price_ranges:
+            condition = Q(**{self.price_field + '__gte' : low})
+            if high is not None:
+                condition &= Q(**{self.price_field + '__lt' : high})
+            price_counts[price_range_name(low, high)] = Count('pk', filter = condition)
+        facets['price'] = matches.aggregate(**price_counts)
+
+        return facets
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(page, many = True).data)
+        response.data['facets'] = self.get_facets(queryset)
+        return response
@@ -0,0 +1,256 @@
+import re
+import uuid
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from .compression import encoding_suffixes, accepts_encoding, decompressed, decompressed_size
+
+
+MAX_RANGES = 16
+CHUNK_SIZE = 64 * 1024
+range_re = re.compile(r'^(\d*)-(\d*)$')
+
+
+class StoredFile:
+    ''' a file of the storage which is not in a FileField, like the segments of a stream
+
+    sendfile_url is the front server location of its storage, SENDFILE_URL by default, and streamed files
+    are always sent by django, like the decompressed files of an archive. encoding is Blob.encoding of a
+    blob stored compressed under stored_name, it is opened decompressed.
+    '''
+
+    def __init__(self, storage, name, sendfile_url = None, streamed = False, encoding = ''):
+        self.storage = storage
+        self.name = name
+        self.sendfile_url = sendfile_url
+        self.streamed = streamed
+        self.encoding = encoding
+
+    @property
+    def stored_name(self):
+        return self.name + encoding_suffixes[self.encoding] if self.encoding else self.name
+
+    @property
+    def size(self):
+        if not self.encoding:
+            return self.storage.size(self.name)
+        with self.storage.open(self.stored_name, 'rb') as stored_file:
+            return decompressed_size(self.encoding, stored_file)
+
+    def open(self, mode = 'rb'):
+        if not self.encoding:
+            return self.storage.open(self.name, mode)
+        return decompressed(self.encoding, self.storage.open(self.stored_name, 'rb'), self.name)
+
+
+def content_disposition(filename):
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return "attachment; filename*=utf-8''%s" % quote(filename)
+    else:
+        return 'attachment; filename="%s"' % filename.replace('\\', '\\\\').replace('"', '\\"')
+
+def parse_range(header, size):
+    ''' parse a "bytes=" Range header into sorted, coalesced (start, end) pairs
+
+    returns None when the header should be ignored and an empty list when no range is satisfiable.
+    '''
+
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        match = range_re.match(part.strip())
+        if not match or match.group(0) == '-':
+            return None
+
+        start, end = match.groups()
+        if not start:
+            length = int(end)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start)
+            if end and int(end) < start:
+                return None
+            if start >= size:
+                continue
+            end = min(int(end), size - 1) if end else size - 1
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    coalesced = []
+    for start, end in sorted(ranges):
+        if coalesced and start <= coalesced[-1][1] + 1:
+            coalesced[-1] = (coalesced[-1][0], max(end, coalesced[-1][1]))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+def if_range_matches(request, etag, last_modified):
+    ''' a Range is honoured only if If-Range still names the stored file, by strong etag or exact date '''
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag is not None and if_range == etag
+    return last_modified is not None and parse_http_date_safe(if_range) == last_modified
+
+def read_range(stored_file, start, end):
+    stored_file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = stored_file.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def single_range_body(stored_file, start, end):
+    try:
+        yield from read_range(stored_file, start, end)
+    finally:
+        stored_file.close()
+
+def multiple_ranges_body(stored_file, parts, boundary):
+    try:
+        for part_header, (start, end) in parts:
+            yield part_header
+            yield from read_range(stored_file, start, end)
+            yield b'\r\n'
+        yield b'--' + boundary + b'--\r\n'
+    finally:
+        stored_file.close()
+
+def ranged_response(file_field, size, ranges, content_type):
+    if not ranges:
+        response = HttpResponse(status = 416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+
+    stored_file = file_field.open('rb')
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(single_range_body(stored_file, start, end), status = 206, content_type = content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+    boundary = uuid.uuid4().hex.encode('ascii')
+    parts = []
+    length = len(b'--' + boundary + b'--\r\n')
+    for start, end in ranges:
+        part_header = (b'--' + boundary + b'\r\n' +
+                       ('Content-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (content_type, start, end, size)).encode('ascii'))
+        parts.append((part_header, (start, end)))
+        length += len(part_header) + (end - start + 1) + 2
+
+    response = StreamingHttpResponse(multiple_ranges_body(stored_file, parts, boundary), status = 206,
+                                     content_type = 'multipart/byteranges; boundary=' + boundary.decode('ascii'))
+    response['Content-Length'] = str(length)
+    return response
+
+def sendfile(request, file_field, filename, etag = None, size = None, content_type = None, as_attachment = True,
+             allow_redirect = True):
+    ''' hand the transfer of a stored file to the front server, or stream it from django when there is none
+
+    SENDFILE_BACKEND is 'nginx' for X-Accel-Redirect, 'xsendfile' for Apache/lighttpd X-Sendfile or None.
+    Conditional requests are answered here with 304/412, Range requests are answered by the front server
+    or, without one, with 206 single or multipart responses. as_attachment = False serves the file inline.
+    a storage with presigned urls, like an object store, serves the file itself after a redirect, unless
+    allow_redirect is False for files whose relative links should resolve here.
+    a file stored compressed is sent compressed with its Content-Encoding to the clients which accept it and
+    decompressed by django, without ranges, to the others.
+    '''
+
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    # a FieldFile proxies encoding to the open file, only the StoredFile of a Blob knows it
+    encoding = file_field.encoding if isinstance(file_field, StoredFile) else ''
+    decoded = False
+    varies = bool(encoding)
+    if encoding:
+        if accepts_encoding(request, encoding):
+            file_field = StoredFile(file_field.storage, file_field.stored_name, file_field.sendfile_url, file_field.streamed)
+            # the compressed blob is another representation, with its own etag and size
+            etag = '%s-%s' % (etag, encoding) if etag else None
+            size = None
+        else:
+            file_field = StoredFile(file_field.storage, file_field.name, streamed = True, encoding = encoding)
+            encoding, decoded, allow_redirect = '', True, False
+
+    backend = None if getattr(file_field, 'streamed', False) else getattr(settings, 'SENDFILE_BACKEND', None)
+
+    presigned_url = getattr(file_field.storage, 'presigned_url', None)
+    if presigned_url is not None and allow_redirect:
+        response = HttpResponseRedirect(presigned_url(file_field.name, filename, content_type, as_attachment,
+                                                      content_encoding = encoding or None))
+        response['Cache-Control'] = 'private, no-store'
+        if varies:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    etag = '"%s"' % etag if etag else None
+
+    try:
+        last_modified = int(file_field.storage.get_modified_time(getattr(file_field, 'stored_name', file_field.name)).timestamp())
+    except (NotImplementedError, OSError):
+        last_modified = None
+
+    response = get_conditional_response(request, etag = etag, last_modified = last_modified)
+
+    if response is None and backend is None:
+        # a decompressed blob has the size of Blob.size, its storage only knows the compressed one
+        if size is None and not decoded:
+            size = file_field.size
+        ranges = None
+        if not decoded and 'HTTP_RANGE' in request.META and if_range_matches(request, etag, last_modified):
+            ranges = parse_range(request.META['HTTP_RANGE'], size)
+
+        if ranges is None:
+            response = FileResponse(file_field.open('rb'), as_attachment = as_attachment, filename = filename, content_type = content_type)
+            # without a size the response ends with the file, without Content-Length
+            if size is not None and not response.has_header('Content-Length'):
+                response['Content-Length'] = str(size)
+        else:
+            response = ranged_response(file_field, size, ranges, content_type)
+        if not decoded:
+            response['Accept-Ranges'] = 'bytes'
+
+    elif response is None:
+        response = HttpResponse(content_type = content_type)
+
+        if backend == 'nginx':
+            response['X-Accel-Redirect'] = quote((getattr(file_field, 'sendfile_url', None) or settings.SENDFILE_URL) + file_field.name)
+        elif backend == 'xsendfile':
+            # X-Sendfile only works with files on the local disk
+            response['X-Sendfile'] = file_field.storage.path(file_field.name)
+        else:
+            raise ValueError('unknown SENDFILE_BACKEND %r' % backend)
+
+    if as_attachment and response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition(filename)
+    if encoding and response.status_code in (200, 206):
+        # nginx drops the Content-Encoding of an X-Accel-Redirect, its location sets it again, see the README
+        response['Content-Encoding'] = encoding
+    if varies:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+    return response
@@ -1,11 +1,16 @@
 import os
-import pytz
-from datetime import datetime, timedelta
+import tarfile
+import zipfile
 from django.conf import settings
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import FileExtensionValidator
 from rest_framework import serializers
-from .models import File, Product, Subscription, Cart, Store
+from .models import File, Product, Subscription, Cart, Store, UploadSession, allowed_file_extensions
+from .entitlements import can_download
+from .links import download_url, stream_url
+from .uploadhandlers import stage_stream
+from .uploads import iter_archive
 
 class ProductFilteredPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
     ''' Show products of the owner's store '''
@@ -13,31 +18,31 @@ class ProductFilteredPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
     def get_queryset(self):
         request = self.context.get('request', None)
         queryset = super(ProductFilteredPrimaryKeyRelatedField , self).get_queryset()
-        if not request or not queryset:
+        if not request or queryset is None:
             return None
-        for q in queryset:
-            if q.product_store.owner != request.user:
-                queryset = queryset.exclude(id = q.id)
-        return queryset
+        return queryset.owned_by(request.user)
 
 class FileUploadSerializer(serializers.Serializer):
     file_name = serializers.CharField(max_length = 30, style = {'placeholder' : 'please write your artibrary file name without its format'}, required = False)
-    file_data = serializers.FileField(validators=[FileExtensionValidator(allowed_extensions=['pdf', 'avi', 'flv', 'wmv', 'mov', 'mp4', 'wma', 'flac', 'aac', 'mp3'])], required = True)
+    file_data = serializers.FileField(validators=[FileExtensionValidator(allowed_extensions=allowed_file_extensions)], required = True)
     file_price = serializers.IntegerField(style = {'placeholder' : 'if your file or your product which this file belongs to it, will be free you should not fill this field otherwise it will be ignored'}, required = False) 
     file_product = ProductFilteredPrimaryKeyRelatedField(queryset = Product.objects.all())
     is_free = serializers.BooleanField(required = True)
     file_id = serializers.SerializerMethodField('file_id_func')
+    processing_status = serializers.CharField(read_only = True)
 
     def file_id_func(self, obj):
         return obj.id
     
-    def get_file(self, validated_data, should_rename, instance = None):
-        file_data = self.context['request'].data.get('file_data')
+    def get_file_fields(self, validated_data, upload_name):
+        ''' apply the naming and pricing rules of files, returns the fields of the File and whether it should be renamed '''
+
+        should_rename = False
 
         try:
             file_name = validated_data['file_name']
         except:
-            file_name = str(file_data.name)
+            file_name = str(upload_name)
         else:
             if '.' in file_name:
                 raise serializers.ValidationError(_('you should not have write file format in the name field'))
@@ -59,60 +64,166 @@ class FileUploadSerializer(serializers.Serializer):
             if not file_price:
                 raise serializers.ValidationError(_('you should fill price or is_free field'))
 
-        if not instance:
-            file_obj = File(file_name = file_name, file_data = file_data, file_price = file_price, file_product = file_product, is_free = is_free)
-            file_obj.save()
+        fields = {'file_name' : file_name, 'file_price' : file_price, 'file_product' : file_product, 'is_free' : is_free}
+        return fields, should_rename
+
+    def get_file(self, validated_data, instance = None):
+        file_data = self.context['request'].data.get('file_data')
 
-        if instance:
-            File.objects.filter(pk=instance.id).update(file_name = file_name, file_data = file_data, file_price = file_price, file_product = file_product, is_free = is_free)
+        if file_data:
+            upload_name = file_data.name
+        else:
+            upload_name = instance.file_name
+
+        fields, should_rename = self.get_file_fields(validated_data, upload_name)
 
+        if not instance:
+            file_obj = File(**fields)
+        else:
             file_obj = File.objects.get(pk = instance.id)
+            for field, value in fields.items():
+                setattr(file_obj, field, value)
 
-            if file_obj.file_data.path != instance.file_data.path:
-                os.remove(instance.file_data.path)
-                file_obj.file_data = file_data
-                file_obj.save()
+        # the stored content is named by its hash, a new name is only a new file_name
+        if file_data:
+            file_obj.file_data = file_data
+            file_obj.set_upload_metadata(file_data)
+        file_obj.save()
+
+        if not file_obj.content_hash:
+            file_obj.update_content_hash()
 
-        return file_obj, should_rename
-    
-    def file_rename(self, file_obj, should_rename):
-        ''' renaming a File if the owner gets a name ''' 
-
-        if should_rename:
-            initial_path = file_obj.file_data.path
-            extension = os.path.splitext(file_obj.file_data.name)[1]
-            file_obj.file_data.name = file_obj.file_name + extension
-            new_path = settings.MEDIA_ROOT + '/' + file_obj.file_data.name
-            os.rename(initial_path, new_path)
-            file_obj.save()
-        
         return file_obj
     
     def create(self , validated_data):
         ''' Create a new File ''' 
 
-        should_rename = False
-        returned_tuple = self.get_file(validated_data, should_rename)
+        return self.get_file(validated_data)
 
-        file_obj = self.file_rename(returned_tuple[0], returned_tuple[1])
+    def update(self, instance, validated_data):
+        ''' Update File, without file_data only its fields change '''
+
+        for field in ('file_price', 'file_product', 'is_free'):
+            validated_data.setdefault(field, getattr(instance, field))
+
+        return self.get_file(validated_data, instance)
+
+class ResumableUploadSerializer(FileUploadSerializer):
+    ''' start a resumable upload, the file itself is sent afterwards in chunks '''
+
+    id = serializers.UUIDField(read_only = True)
+    file_data = None
+    file_id = None
+    processing_status = None
+    upload_name = serializers.CharField(max_length = 255, style = {'placeholder' : 'name of the uploaded file with its format'})
+    upload_size = serializers.IntegerField(min_value = 1)
+    offset = serializers.IntegerField(read_only = True)
+
+    def validate_upload_name(self, upload_name):
+        extension = os.path.splitext(upload_name)[1][1:].lower()
+        if extension not in allowed_file_extensions:
+            raise serializers.ValidationError(_('file format should be one of: ') + ', '.join(allowed_file_extensions))
+        return upload_name
+
+    def validate(self, data):
+        # the name is checked before the upload, not when its File is made after the whole content was sent
+        max_length = File._meta.get_field('file_name').max_length
+        if len(data.get('file_name') or data['upload_name']) > max_length:
+            raise serializers.ValidationError(_('the name of the file should not be longer than %d characters, send a shorter file_name') % max_length)
+        return data
+
+    def create(self, validated_data):
+        ''' Create a new upload session '''
+
+        fields, should_rename = self.get_file_fields(validated_data, validated_data['upload_name'])
+
+        return UploadSession.objects.create(owner = self.context['request'].user, upload_name = validated_data['upload_name'],
+                                            upload_size = validated_data['upload_size'], **fields)
+
+class BulkFileUploadSerializer(FileUploadSerializer):
+    ''' upload many files, or one zip/tar archive of them, to one product with the same price rules '''
+
+    file_name = None
+    file_id = None
+    file_data = serializers.ListField(child = serializers.FileField(), required = False)
+    archive = serializers.FileField(required = False)
+
+    def validate(self, data):
+        if bool(data.get('file_data')) == bool(data.get('archive')):
+            raise serializers.ValidationError(_('you should send either some file_data files or one archive'))
+
+        # the price rules are the same for every file of the batch, so they are checked once
+        self.get_file_fields(data, '')
+        return data
+
+    def get_uploads(self, validated_data):
+        for uploaded_file in validated_data.get('file_data', []):
+            yield uploaded_file.name, uploaded_file
+
+        if 'archive' in validated_data:
+            for name, stream in iter_archive(validated_data['archive']):
+                staged = stage_stream(name, stream)
+                try:
+                    yield name, staged
+                finally:
+                    staged.close()
+
+    def create_file(self, validated_data, upload_name, uploaded_file):
+        extension = os.path.splitext(upload_name)[1][1:].lower()
+        if extension not in allowed_file_extensions:
+            raise serializers.ValidationError(_('file format should be one of: ') + ', '.join(allowed_file_extensions))
+
+        file_name = os.path.splitext(os.path.basename(upload_name))[0][:File._meta.get_field('file_name').max_length]
+        fields, should_rename = self.get_file_fields(validated_data, file_name)
+
+        # File inherits DateClass, so it can not be bulk_create'd, every file gets its own savepoint instead
+        with transaction.atomic():
+            file_obj = File(**fields)
+            file_obj.file_data = uploaded_file
+            file_obj.set_upload_metadata(uploaded_file)
+            file_obj.save()
+
+            if not file_obj.content_hash:
+                file_obj.update_content_hash()
 
         return file_obj
 
-    def update(self, instance, validated_data):
-        ''' Update File'''
+    def create(self, validated_data):
+        ''' Create the Files, returns the result of every uploaded file '''
 
-        should_rename = False
-        returned_tuple = self.get_file(validated_data, should_rename, instance)
-        
-        file_obj = self.file_rename(returned_tuple[0], returned_tuple[1])
+        results = []
+        try:
+            for upload_name, uploaded_file in self.get_uploads(validated_data):
+                if len(results) == settings.BULK_MAX_ITEMS:
+                    results.append({'name' : upload_name, 'errors' : [_('only %d files can be uploaded at once') % settings.BULK_MAX_ITEMS]})
+                    break
+
+                try:
+                    file_obj = self.create_file(validated_data, upload_name, uploaded_file)
+                except serializers.ValidationError as error:
+                    results.append({'name' : upload_name, 'errors' : error.detail})
+                else:
+                    results.append({'name' : upload_name, 'file_id' : file_obj.id})
 
-        return file_obj
+        except (zipfile.BadZipFile, tarfile.TarError):
+            results.append({'name' : validated_data['archive'].name, 'errors' : [_('the archive is damaged or is not a zip or tar file')]})
+
+        return results
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         exclude = ('buy_confirmation', )
 
+class BulkProductSerializer(serializers.ModelSerializer):
+    ''' one item of a bulk product update, only the fields which need no query to validate '''
+
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'product_name', 'product_price', 'is_free']
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
@@ -136,6 +247,18 @@ class BuySubscription(serializers.Serializer):
 
     buy_confirmation = serializers.ChoiceField(choices = buy_choices)
 
+class CheckoutSerializer(serializers.Serializer):
+    max_items = 100
+
+    products = serializers.ListField(child = serializers.IntegerField(min_value = 1), required = False, max_length = max_items)
+    files = serializers.ListField(child = serializers.IntegerField(min_value = 1), required = False, max_length = max_items)
+    subscriptions = serializers.ListField(child = serializers.IntegerField(min_value = 1), required = False, max_length = max_items)
+
+    def validate(self, data):
+        if not any(data.get(kind) for kind in ('products', 'files', 'subscriptions')):
+            raise serializers.ValidationError(_('Please select at least one product, file or subscription to buy'))
+        return data
+
 class Go_To_Buy_Step(serializers.Serializer):
     buy_choices = (('action' , 'I want to buy something'),)
 
@@ -150,6 +273,12 @@ class ShowProductSerializer(serializers.HyperlinkedModelSerializer):
         model = Product
         fields = ['url', 'product_name', 'is_free']
 
+class SearchProductSerializer(ShowProductSerializer):
+    rank = serializers.FloatField(read_only = True)
+
+    class Meta(ShowProductSerializer.Meta):
+        fields = ['url', 'product_name', 'product_price', 'is_free', 'rank']
+
 class ShowProductDetailSerializer(serializers.ModelSerializer):
     file_products = serializers.HyperlinkedRelatedField(
         many=True,
@@ -170,78 +299,57 @@ class ShowFileSerializer(serializers.HyperlinkedModelSerializer):
         model = File
         fields = ['url', 'file_name', 'is_free']
 
+class SearchFileSerializer(ShowFileSerializer):
+    rank = serializers.FloatField(read_only = True)
+
+    class Meta(ShowFileSerializer.Meta):
+        fields = ['url', 'file_name', 'file_price', 'is_free', 'rank']
+
 class ShowFileDetailSerializer(serializers.ModelSerializer):
     file_data = serializers.SerializerMethodField()
+    streams = serializers.SerializerMethodField()
+
+    def get_file_data(self, file_obj):
+        ''' show the link of file to download it if the customer has the specific requirements ''' 
 
-    def check_subscription(self, cart_obj, file_obj):
-        ''' check the validation of baught subscription ''' 
+        request = self.context.get("request")
 
-        utc=pytz.UTC
+        if can_download(request.user, file_obj):
+            return download_url(request, file_obj)
 
-        try:
-            sub_obj = cart_obj.baught_subscriptions.get(store_subscription = file_obj.file_product.product_store)
-        except:
-            return False
-        else:
-            now_datetime = datetime.now().replace(tzinfo=utc)
-            unit = sub_obj.expiry_date_unit
-            amount = sub_obj.expiry_date_amount
-
-            if unit == 'day':
-                expiry_date = cart_obj.date_of_buying_subscription + timedelta(days = amount)
-                expiry_date = expiry_date.replace(tzinfo=utc)
-            else:
-                expiry_date = cart_obj.date_of_buying_subscription + timedelta(hours = amount)
-                expiry_date = expiry_date.replace(tzinfo=utc)
-            
-            if now_datetime < expiry_date:
-                return True
-            else:
-                return False
+        return "to download this file, you should first pay for this file or buy its product"
 
-    def get_file_data(self, file_obj):
-        ''' show the link of file to download it if the customer has the specific requirements ''' 
+    def get_streams(self, file_obj):
+        ''' the manifests of the streams of the file, for the same customers who can download it '''
 
         request = self.context.get("request")
+        stream_formats = file_obj.get_stream_formats()
 
-        if request.user != file_obj.file_product.product_store.owner and not file_obj.is_free:
-
-            try:
-                cart_obj = Cart.objects.get(user = request.user)
-            except:
-                return "to download this file, you should first pay for this file or buy its product"
-            else:
-                has_subscription = self.check_subscription(cart_obj, file_obj)
-
-                ids_of_baught_products = cart_obj.baught_products
-                ids_of_baught_products = cart_obj.baught_products
-
-                if not ids_of_baught_products:
-                    if file_obj.id not in ids_of_baught_files and not has_subscription:
-                        return "to download this file, you should first pay for this file or buy its product"
-                    else:
-                        return request.build_absolute_uri(file_obj.file_data.url)
-                   
-                elif not ids_of_baught_files: 
-                    if file_obj.file_product.id not in ids_of_baught_products and not has_subscription:
-                        return "to download this file, you should first pay for this file or buy its product"
-                    else:
-                        return request.build_absolute_uri(file_obj.file_data.url)
-                
-                else:
-                    if (file_obj.file_product.id not in ids_of_baught_products and file_obj.id not in ids_of_baught_files) and not has_subscription:
-                        return "to download this file, you should first pay for this file or buy its product"
-                    else:
-                        return request.build_absolute_uri(file_obj.file_data.url)
-        else:
-            return request.build_absolute_uri(file_obj.file_data.url)
+        if not stream_formats or not can_download(request.user, file_obj):
+            return {}
 
+        return {stream_format : stream_url(request, file_obj, stream_format) for stream_format in stream_formats}
 
     class Meta:
         model = File
-        fields = ['file_name', 'file_data', 'file_price']
+        fields = ['file_name', 'file_data', 'file_price', 'duration', 'page_count', 'streams']
 
 class ShowMyCartSerializer(serializers.ModelSerializer):
+    baught_products = serializers.SerializerMethodField()
+    baught_files = serializers.SerializerMethodField()
+    baught_subscriptions = serializers.SerializerMethodField()
+
+    # the purchases of the user are prefetched by the viewset, see ShowMyCartViewSet
+    def get_baught_products(self, cart_obj):
+        return [purchase.product_id for purchase in cart_obj.user.purchases.all() if purchase.product_id is not None]
+
+    def get_baught_files(self, cart_obj):
+        return [purchase.file_id for purchase in cart_obj.user.purchases.all() if purchase.file_id is not None]
+
+    def get_baught_subscriptions(self, cart_obj):
+        return [{'subscription' : purchase.subscription_id, 'expires_at' : purchase.expires_at}
+                for purchase in cart_obj.user.subscription_purchases.all()]
+
     class Meta:
         model = Cart
         exclude = ('user', 'id')
@@ -0,0 +1,94 @@
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Category, Product, Store, File, Subscription, Blob
+from .processing import start_processing
+from .entitlements import invalidate_moved_file
+from .responsecache import invalidate
+from .tiering import delete_tiered_copies
+
+
+def stored_names(instance):
+    return {field : getattr(instance, field).name or '' for field in File.blob_fields}
+
+def stored_encoding(field_file):
+    ''' asked once when a content is stored, the downloads read it from the Blob '''
+
+    get_encoding = getattr(field_file.storage, 'stored_encoding', None)
+    return (get_encoding(field_file.name) or '') if get_encoding is not None else ''
+
+@receiver(pre_save, sender = File)
+def remember_previous_blobs(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        previous = File.objects.filter(pk = instance.pk).values('file_product', *File.blob_fields).first()
+    instance._previous_blobs = {field : (previous or {}).get(field) or '' for field in File.blob_fields}
+    instance._previous_product = (previous or {}).get('file_product')
+
+@receiver(post_save, sender = File)
+def count_blob_references(sender, instance, **kwargs):
+    ''' a File holds a reference on each of its blobs, changing a content moves the reference '''
+
+    previous = getattr(instance, '_previous_blobs', {})
+    current = stored_names(instance)
+
+    for field in File.blob_fields:
+        if current[field] != previous.get(field, ''):
+            if current[field]:
+                field_file = getattr(instance, field)
+                encoding = stored_encoding(field_file)
+                size = instance.file_size if field == 'file_data' else None
+                # the downloads which decompress a blob can not ask the storage for its size
+                if size is None and encoding:
+                    size = field_file.size
+                Blob.acquire(current[field], size, encoding)
+            if previous.get(field):
+                Blob.release(previous[field])
+    instance._previous_blobs = current
+
+    # a new content is processed again from the start
+    if current['file_data'] and current['file_data'] != previous.get('file_data', ''):
+        start_processing(instance)
+
+@receiver(post_save, sender = File)
+def invalidate_moved_file_decisions(sender, instance, **kwargs):
+    ''' the access to a file moved to another product is decided again '''
+
+    previous_product = getattr(instance, '_previous_product', None)
+    if previous_product is not None and previous_product != instance.file_product_id:
+        invalidate_moved_file(instance.id, previous_product)
+    instance._previous_product = instance.file_product_id
+
+@receiver(post_delete, sender = File)
+def release_blobs(sender, instance, **kwargs):
+    for name in stored_names(instance).values():
+        if name:
+            Blob.release(name)
+
+@receiver(post_delete, sender = Blob)
+def delete_blob_copies(sender, instance, **kwargs):
+    name = instance.name
+    transaction.on_commit(lambda: delete_tiered_copies(name))
+
+
+# the namespace of the cached responses which read each model, see content.responsecache
+response_namespaces = {
+    Category : 'category',
+    Product : 'product',
+    Store : 'store',
+    File : 'file',
+    Subscription : 'subscription',
+}
+
+def invalidate_cached_responses(sender, **kwargs):
+    invalidate(response_namespaces[sender])
+
+for model in response_namespaces:
+    post_save.connect(invalidate_cached_responses, sender = model)
+    post_delete.connect(invalidate_cached_responses, sender = model)
+
+@receiver(m2m_changed, sender = Product.product_category.through)
+def invalidate_product_categories(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate('product')
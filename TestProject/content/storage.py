@@ -0,0 +1,371 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import Storage, FileSystemStorage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from .sendfile import content_disposition
+from .compression import encoding_suffixes, check_encoding, is_compressible, compress, decompressed, decompressed_size
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+class BlobExists(Exception):
+    pass
+
+
+def is_missing(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+class ContentAddressedMixin:
+    ''' keep every content once, under its sha256 in a sharded tree: ab/cd/abcd...<extension>
+
+    the name chosen by the owner lives only in File.file_name, so renaming a file never touches the storage
+    and uploading the same content again stores nothing. the stream packages of a blob are stored under its
+    name without the extension and the backends remove them with delete_package.
+
+    with STORAGE_COMPRESSION the blobs of COMPRESSIBLE_MIME_TYPES which shrink are stored compressed as
+    <name>.gz or <name>.zst, the name, the hash and the size stay the ones of the content and opening
+    a blob decompresses it. content.sendfile sends the compressed blob to the clients which accept it.
+    '''
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        return '%s/%s/%s%s' % (digest[:2], digest[2:4], digest, extension)
+
+    def hash_content(self, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def encoded_name(self, name, encoding):
+        return name + encoding_suffixes[encoding]
+
+    def stored_names(self, name):
+        return [name] + [self.encoded_name(name, encoding) for encoding in encoding_suffixes]
+
+    def compressed_blob(self, name):
+        ''' (encoding, stored name) of a blob which is not stored as it is, FileNotFoundError when there is none '''
+
+        # the names of the compressed blobs themselves are never looked for again
+        if not name.endswith(tuple(encoding_suffixes.values())):
+            for encoding in encoding_suffixes:
+                if super().exists(self.encoded_name(name, encoding)):
+                    return encoding, self.encoded_name(name, encoding)
+        raise FileNotFoundError(name)
+
+    def stored_encoding(self, name):
+        ''' the Content-Encoding a blob is stored with, None when it is stored as it is
+
+        asked once when the blob is stored, see Blob.encoding, the encodings are looked for even when compression
+        was turned off since the blobs stored compressed stay so.
+        '''
+
+        if super().exists(name):
+            return None
+        try:
+            return self.compressed_blob(name)[0]
+        except FileNotFoundError:
+            return None
+
+    def choose_encoding(self, name, content):
+        ''' the encoding to store new content with: STORAGE_COMPRESSION if its type compresses and a sample of it shrinks '''
+
+        encoding = settings.STORAGE_COMPRESSION
+        if not encoding or mimetypes.guess_type(name)[0] not in settings.COMPRESSIBLE_MIME_TYPES:
+            return None
+        check_encoding(encoding)
+
+        content.seek(0)
+        sample = content.read(settings.COMPRESSION_SAMPLE_SIZE)
+        content.seek(0)
+        return encoding if is_compressible(encoding, sample) else None
+
+    def store(self, name, content):
+        encoding = self.choose_encoding(name, content)
+        if encoding is None:
+            return self._save(name, content)
+
+        with tempfile.NamedTemporaryFile(suffix = encoding_suffixes[encoding]) as staged:
+            compress(encoding, content, staged)
+            staged.seek(0)
+            self._save(self.encoded_name(name, encoding), DjangoFile(staged, name))
+        return name
+
+    def save(self, name, content, max_length = None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = DjangoFile(content, name)
+
+        # the upload handler has already hashed the uploads, other content is read once here
+        if not getattr(content, 'content_hash', ''):
+            content.content_hash = self.hash_content(content)
+
+        name = self.blob_name(content.content_hash, name)
+        if self.exists(name):
+            return name
+
+        try:
+            return self.store(name, content)
+        except BlobExists:
+            # the same content was stored by a concurrent upload
+            return name
+
+    def get_available_name(self, name, max_length = None):
+        if super().exists(name):
+            raise BlobExists(name)
+        return name
+
+    def save_as(self, name, content):
+        ''' store content under exactly this name, for the files made from a blob like the segments of its streams '''
+
+        self.delete(name, with_package = False)
+        return self.store(name, content)
+
+    # the blobs stored as they are are read with one call, the compressed ones are looked for only when
+    # a blob is missing, the downloads name them directly from Blob.encoding
+    def exists(self, name):
+        if super().exists(name):
+            return True
+        try:
+            self.compressed_blob(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _open(self, name, mode = 'rb'):
+        try:
+            return super()._open(name, mode)
+        except FileNotFoundError:
+            if 'w' in mode or 'a' in mode:
+                raise
+            encoding, encoded_name = self.compressed_blob(name)
+        return decompressed(encoding, super()._open(encoded_name, 'rb'), name)
+
+    def size(self, name):
+        try:
+            return super().size(name)
+        except FileNotFoundError:
+            encoding, encoded_name = self.compressed_blob(name)
+        with super()._open(encoded_name, 'rb') as stored_file:
+            size = decompressed_size(encoding, stored_file)
+        if size is None:
+            # not recorded in the compressed blob, it is counted once when the blob is stored, see Blob.size
+            with self._open(name) as content:
+                size = sum(len(chunk) for chunk in content.chunks())
+        return size
+
+    def get_modified_time(self, name):
+        try:
+            return super().get_modified_time(name)
+        except FileNotFoundError:
+            return super().get_modified_time(self.compressed_blob(name)[1])
+
+    def delete(self, name, with_package = True):
+        ''' remove a blob together with the stream packages made from it, unless the blob only moves to another tier '''
+
+        for stored_name in self.stored_names(name):
+            if super().exists(stored_name):
+                super().delete(stored_name)
+        if with_package:
+            self.delete_package(os.path.splitext(name)[0])
+
+
+@deconstructible
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    ''' the blobs on the local disk under MEDIA_ROOT '''
+
+    def delete_package(self, package_dir):
+        package_dir = self.path(package_dir)
+        if os.path.isdir(package_dir):
+            shutil.rmtree(package_dir, ignore_errors = True)
+
+
+@deconstructible
+class GzipStorage(FileSystemStorage):
+    ''' files kept gzipped on a cheaper disk, the archive tier of content.tiering
+
+    every name is stored as <name>.gz and opened decompressed. the size is the one gzip records, so it is only
+    right below 4GB, the downloads pass the size of the File instead.
+    '''
+
+    def path(self, name):
+        return super().path(name + '.gz')
+
+    def _save(self, name, content):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        # written next to its place and renamed, so a half written file is never opened
+        with tempfile.NamedTemporaryFile(dir = os.path.dirname(path), suffix = '.part', delete = False) as staged:
+            try:
+                compress('gzip', content, staged)
+            except BaseException:
+                os.remove(staged.name)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(staged.name, self.file_permissions_mode)
+        os.replace(staged.name, path)
+        return name
+
+    def _open(self, name, mode = 'rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError('archived files are written with save, not opened for writing')
+        return decompressed('gzip', open(self.path(name), 'rb'), name)
+
+    def size(self, name):
+        with open(self.path(name), 'rb') as compressed:
+            return decompressed_size('gzip', compressed)
+
+
+@deconstructible
+class S3Storage(Storage):
+    ''' objects in an s3 compatible bucket (aws, minio, ceph...), configured by S3_* in settings, needs boto3
+
+    big files are sent and fetched in S3_MULTIPART_CHUNKSIZE parts, S3_MAX_CONCURRENCY of them at a time,
+    and downloads are presigned GETs the client fetches from the bucket itself, see content.sendfile.
+    '''
+
+    def __init__(self, bucket = None, location = None, endpoint_url = None):
+        if boto3 is None:
+            raise ImproperlyConfigured('S3Storage needs boto3, pip install boto3')
+
+        self.bucket = bucket or settings.S3_BUCKET
+        self.location = (location if location is not None else settings.S3_LOCATION).strip('/')
+        self.endpoint_url = endpoint_url or settings.S3_ENDPOINT_URL
+        if not self.bucket:
+            raise ImproperlyConfigured('S3_BUCKET is not set')
+
+        self.transfer_config = TransferConfig(multipart_threshold = settings.S3_MULTIPART_THRESHOLD,
+                                              multipart_chunksize = settings.S3_MULTIPART_CHUNKSIZE,
+                                              max_concurrency = settings.S3_MAX_CONCURRENCY, use_threads = True)
+        self._client = None
+
+    @property
+    def client(self):
+        # boto3 clients are thread safe, one is made per storage on first use
+        if self._client is None:
+            self._client = boto3.session.Session().client(
+                's3', endpoint_url = self.endpoint_url, region_name = settings.S3_REGION,
+                aws_access_key_id = settings.S3_ACCESS_KEY_ID, aws_secret_access_key = settings.S3_SECRET_ACCESS_KEY,
+                config = Config(signature_version = 's3v4', max_pool_connections = max(settings.S3_MAX_CONCURRENCY, 10)))
+        return self._client
+
+    def key(self, name):
+        name = name.replace('\\', '/').lstrip('/')
+        return self.location + '/' + name if self.location else name
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket = self.bucket, Key = self.key(name))
+        except ClientError as error:
+            if is_missing(error):
+                raise FileNotFoundError(name)
+            raise
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        content_type = getattr(content, 'content_type', None) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(content, self.bucket, self.key(name), ExtraArgs = {'ContentType' : content_type},
+                                   Config = self.transfer_config)
+        return name
+
+    def download(self, name, fileobj):
+        ''' write an object into an open file, in parallel parts for big objects '''
+
+        try:
+            self.client.download_fileobj(self.bucket, self.key(name), fileobj, Config = self.transfer_config)
+        except ClientError as error:
+            if is_missing(error):
+                raise FileNotFoundError(name)
+            raise
+
+    def _open(self, name, mode = 'rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError('objects are written with save, not opened for writing')
+
+        spooled = tempfile.SpooledTemporaryFile(max_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        self.download(name, spooled)
+        spooled.seek(0)
+        return DjangoFile(spooled, name)
+
+    def exists(self, name):
+        try:
+            self.head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket = self.bucket, Key = self.key(name))
+
+    def delete_package(self, package_dir):
+        ''' remove every object under a prefix, a thousand per request '''
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket = self.bucket, Prefix = self.key(package_dir) + '/'):
+            objects = [{'Key' : item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket = self.bucket, Delete = {'Objects' : objects, 'Quiet' : True})
+
+    def listdir(self, path):
+        prefix = self.key(path).rstrip('/') + '/' if path else (self.location + '/' if self.location else '')
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket = self.bucket, Prefix = prefix, Delimiter = '/'):
+            directories.extend(item['Prefix'][len(prefix):].rstrip('/') for item in page.get('CommonPrefixes', []))
+            files.extend(item['Key'][len(prefix):] for item in page.get('Contents', []))
+        return directories, files
+
+    def size(self, name):
+        return self.head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        modified = self.head(name)['LastModified']
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def presigned_url(self, name, filename = None, content_type = None, as_attachment = True, content_encoding = None):
+        ''' a GET of the object valid for SIGNED_URL_MAX_AGE, which the bucket answers with these headers '''
+        params = {'Bucket' : self.bucket, 'Key' : self.key(name)}
+        if content_type:
+            params['ResponseContentType'] = content_type
+        if content_encoding:
+            params['ResponseContentEncoding'] = content_encoding
+        if filename and as_attachment:
+            params['ResponseContentDisposition'] = content_disposition(filename)
+        return self.client.generate_presigned_url('get_object', Params = params,
+                                                  ExpiresIn = int(settings.SIGNED_URL_MAX_AGE.total_seconds()))
+
+    def url(self, name):
+        return self.presigned_url(name)
+
+
+@deconstructible
+class S3ContentAddressedStorage(ContentAddressedMixin, S3Storage):
+    ''' the blobs in an s3 compatible bucket, so the web servers and workers need no shared disk '''
+
+    def download(self, name, fileobj):
+        try:
+            return super().download(name, fileobj)
+        except FileNotFoundError:
+            encoding, encoded_name = self.compressed_blob(name)
+        with decompressed(encoding, self.open(encoded_name, 'rb'), name) as content:
+            shutil.copyfileobj(content, fileobj)
@@ -1,3 +1,1116 @@
-from django.test import TestCase
+import os
+import gzip
+import base64
+import hashlib
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from user.models import Profile
+from .models import DateClass, Store, Product, File, Subscription, Category, Cart, Purchase, SubscriptionPurchase, Entitlement, Blob, ProcessingJob
+from .entitlements import entitlement_cache, grant_file, has_file_access
+from .processing import run_job, verify_checksum, probe_pdf
+from .benchmark import seed_catalogue, run_client, compare, percentile
+from .metrics import registry
+from .storage import S3ContentAddressedStorage
+from .tiering import access_tracker, rebalance_cache, rebalance_archive
+from .compression import accepts_encoding
+
+
+class QueryCountTestCase(APITestCase):
+    ''' harness for endpoints which must cost the same number of queries however big the catalogue is,
+    grow(size) adds size more rows of every kind the endpoint reads
+    '''
+
+    def assert_constant_queries(self, grow, url, expected):
+        grow(1)
+        with self.assertNumQueries(expected):
+            small = self.client.get(url)
+
+        grow(5)
+        with self.assertNumQueries(expected):
+            large = self.client.get(url)
+
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(large.status_code, 200)
+        return large
+
+class OwnerListQueryCountTests(QueryCountTestCase):
+    ''' owner list endpoints only read the rows of the owner's stores '''
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        Profile.objects.create(user = self.owner, is_owner = True)
+        self.other = User.objects.create_user(username = 'other', password = 'other-pass')
+        Profile.objects.create(user = self.other, is_owner = True)
+
+        # creating the profile caches it on the user, so IsOwnerUser reads it without a query
+        self.client.force_authenticate(user = self.owner)
+
+    def add_catalogue(self, owner, size):
+        store = Store.objects.create(owner = owner)
+        Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = store)
+        for i in range(size):
+            product = Product.objects.create(product_name = 'product %d' % i, is_free = True, product_store = store)
+            File.objects.create(file_name = 'file %d' % i, file_data = 'file_%d.pdf' % i, file_product = product, is_free = True)
+
+    def grow(self, size):
+        self.add_catalogue(self.owner, size)
+        self.add_catalogue(self.other, size)
+
+    def test_upload_file_list(self):
+        response = self.assert_constant_queries(self.grow, '/content/upload_file/', 1)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_add_product_list(self):
+        response = self.assert_constant_queries(self.grow, '/content/add_product/', 2)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_add_subscription_list(self):
+        response = self.assert_constant_queries(self.grow, '/content/add_subscription/', 1)
+        self.assertEqual(len(response.data['results']), 2)
+
+class ReadEndpointQueryCountTests(QueryCountTestCase):
+    ''' the read viewsets load the relations their serializers need in a constant number of queries '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        self.store = Store.objects.create(owner = owner)
+        self.subscription = Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = self.store)
+        self.product = Product.objects.create(product_name = 'product', is_free = True, product_store = self.store)
+        self.file = File.objects.create(file_name = 'file', file_data = 'file.pdf', file_product = self.product, is_free = True)
+        self.cart = Cart.objects.create(user = self.customer)
+
+        self.client.force_authenticate(user = self.customer)
+
+    def grow(self, size):
+        for i in range(size):
+            store = Store.objects.create(owner = self.store.owner)
+            subscription = Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = store)
+            Product.objects.create(product_name = 'other %d' % i, is_free = True, product_store = store)
+            Product.objects.create(product_name = 'more %d' % i, is_free = True, product_store = self.store)
+            self.product.product_category.add(Category.objects.create(category_name = 'educational'))
+            File.objects.create(file_name = 'file %d' % i, file_data = 'file_%d.pdf' % i, file_product = self.product, is_free = True)
+            SubscriptionPurchase.objects.buy(self.customer, subscription)
+
+    def test_store_list(self):
+        self.assert_constant_queries(self.grow, '/content/show_store/', 2)
+
+    def test_store_detail(self):
+        self.assert_constant_queries(self.grow, '/content/show_store/%d/' % self.store.id, 2)
+
+    def test_product_list(self):
+        self.assert_constant_queries(self.grow, '/content/show_products/', 1)
+
+    def test_product_detail(self):
+        response = self.assert_constant_queries(self.grow, '/content/show_products/%d/' % self.product.id, 3)
+        self.assertEqual(len(response.data['file_products']), 7)
+
+    def test_file_list(self):
+        self.assert_constant_queries(self.grow, '/content/show_files/', 1)
+
+    def test_file_detail(self):
+        self.assert_constant_queries(self.grow, '/content/show_files/%d/' % self.file.id, 1)
+
+    def test_subscription_list(self):
+        self.assert_constant_queries(self.grow, '/content/show_subscription/', 1)
+
+    def test_my_cart(self):
+        self.assert_constant_queries(self.grow, '/content/show_my_cart/', 3)
+
+class FileDownloadEntitlementTests(APITestCase):
+    ''' download links are shown only after the file, its product or its store subscription is baught '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        store = Store.objects.create(owner = owner)
+        self.subscription = Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = store)
+        self.product = Product.objects.create(product_name = 'product', is_free = False, product_price = 10, product_store = store)
+        self.file = File.objects.create(file_name = 'file', file_data = 'file.pdf', file_product = self.product, is_free = False, file_price = 5)
+
+        entitlement_cache.clear()
+        self.client.force_authenticate(user = self.customer)
+
+    def file_data(self):
+        return self.client.get('/content/show_files/%d/' % self.file.id).data['file_data']
+
+    def test_not_baught(self):
+        self.assertEqual(self.file_data(), "to download this file, you should first pay for this file or buy its product")
+
+    def test_baught_file(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        self.assertTrue(self.file_data().endswith('/content/download/%d/' % self.file.id))
+
+    def test_baught_product(self):
+        self.client.put('/content/show_products/%d/' % self.product.id, {'buy_confirmation' : 'buy'})
+        self.assertTrue(self.file_data().endswith('/content/download/%d/' % self.file.id))
+
+    def test_baught_subscription(self):
+        self.client.put('/content/show_subscription/%d/' % self.subscription.id, {'buy_confirmation' : 'buy'})
+        self.assertTrue(self.file_data().endswith('/content/download/%d/' % self.file.id))
+
+    def test_expired_subscription(self):
+        self.client.put('/content/show_subscription/%d/' % self.subscription.id, {'buy_confirmation' : 'buy'})
+        Entitlement.objects.filter(user = self.customer).update(valid_until = timezone.now())
+        self.assertEqual(self.file_data(), "to download this file, you should first pay for this file or buy its product")
+
+class EntitlementCacheTests(FileDownloadEntitlementTests):
+    ''' repeated downloads are answered from the cache and purchases invalidate it '''
+
+    def test_cached_decision(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        self.file_data()
+        misses = entitlement_cache.stats()['misses']
+        with self.assertNumQueries(1):
+            self.file_data()
+        self.assertEqual(entitlement_cache.stats()['misses'], misses)
+
+    def test_refusal_not_cached(self):
+        # the other processes must not keep refusing a file their process did not see baught
+        self.file_data()
+        misses = entitlement_cache.stats()['misses']
+        self.file_data()
+        self.assertEqual(entitlement_cache.stats()['misses'], misses + 1)
+
+    def test_moved_file_invalidates(self):
+        self.client.put('/content/show_products/%d/' % self.product.id, {'buy_confirmation' : 'buy'})
+        self.assertTrue(self.file_data().endswith('/content/download/%d/' % self.file.id))
+
+        self.file.file_product = Product.objects.create(product_name = 'other', is_free = False, product_price = 10,
+                                                        product_store = Store.objects.create(owner = self.product.product_store.owner))
+        self.file.save()
+        self.assertEqual(self.file_data(), "to download this file, you should first pay for this file or buy its product")
+
+    def test_purchase_invalidates(self):
+        self.assertEqual(self.file_data(), "to download this file, you should first pay for this file or buy its product")
+        self.client.put('/content/show_products/%d/' % self.product.id, {'buy_confirmation' : 'buy'})
+        self.assertTrue(self.file_data().endswith('/content/download/%d/' % self.file.id))
+
+class EntitlementCommitTests(APITransactionTestCase):
+    ''' a decision cached while the purchase is not committed yet is dropped by the commit '''
+
+    def test_access_after_commit(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        product = Product.objects.create(product_name = 'product', is_free = False, product_price = 10, product_store = Store.objects.create(owner = owner))
+        file_obj = File.objects.create(file_name = 'file', file_data = 'file.pdf', file_product = product, is_free = False, file_price = 5)
+        entitlement_cache.clear()
+
+        with transaction.atomic():
+            grant_file(customer, file_obj)
+            # a download running before the commit reads the old rows
+            entitlement_cache.set(entitlement_cache.make_key(customer.id, file_obj.id), False)
+        self.assertTrue(has_file_access(customer, file_obj))
+
+class DownloadTestCase(APITestCase):
+    ''' a customer and a stored file in a temporary MEDIA_ROOT '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT = self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        store = Store.objects.create(owner = owner)
+        product = Product.objects.create(product_name = 'product', is_free = False, product_price = 10, product_store = store)
+        self.file = File(file_name = 'lecture', file_product = product, is_free = False, file_price = 5)
+        content = ContentFile(b'%PDF-1.4 lecture')
+        self.file.file_data.save('lecture.pdf', content, save = False)
+        # the storage hashes the content to name it, like the upload handler does for uploads
+        self.file.set_upload_metadata(content)
+        self.file.save()
+
+        entitlement_cache.clear()
+        access_tracker.clear()
+        self.client.force_authenticate(user = self.customer)
+        self.url = '/content/download/%d/' % self.file.id
+
+class DownloadFileViewTests(DownloadTestCase):
+    ''' the download endpoint checks the entitlements and then hands the file to the front server '''
+
+    def test_not_baught(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_streamed_without_front_server(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 lecture')
+        self.assertIn('lecture.pdf', response['Content-Disposition'])
+
+    def test_file_sent_by_the_server(self):
+        registry.clear()
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        response = self.client.get(self.url)
+        # the middleware does not wrap the file for wsgi.file_wrapper, it counts the bytes from Content-Length
+        self.assertEqual(response['Content-Length'], str(len(b'%PDF-1.4 lecture')))
+        self.assertEqual(registry.get('http_response_bytes_total', view = 'download_file'), len(b'%PDF-1.4 lecture'))
+
+    @override_settings(SENDFILE_BACKEND = 'nginx')
+    def test_x_accel_redirect(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.file_data.name)
+        self.assertEqual(response.content, b'')
+
+class DownloadRangeTests(DownloadTestCase):
+    ''' players seek with Range requests and revalidate with the stored content hash '''
+
+    def setUp(self):
+        super().setUp()
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE = 'bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/16')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE = 'bytes=0-3,-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'Content-Range: bytes 0-3/16\r\n\r\n%PDF\r\n', body)
+        self.assertIn(b'Content-Range: bytes 9-15/16\r\n\r\nlecture\r\n', body)
+        self.assertEqual(len(body), int(response['Content-Length']))
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE = 'bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */16')
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        self.file.refresh_from_db()
+        self.assertEqual(etag, '"%s"' % self.file.content_hash)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH = etag).status_code, 304)
+
+    def test_not_hashed_yet(self):
+        File.objects.filter(pk = self.file.pk).update(content_hash = '')
+        response = self.client.get(self.url)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(File.objects.get(pk = self.file.pk).content_hash, '')
+
+    def test_stale_if_range(self):
+        response = self.client.get(self.url, HTTP_RANGE = 'bytes=0-3', HTTP_IF_RANGE = '"stale"')
+        self.assertEqual(response.status_code, 200)
+
+class TieringTests(DownloadTestCase):
+    ''' downloads are counted and read through the hot cache and the archive '''
+
+    def setUp(self):
+        super().setUp()
+        cache_root, archive_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root)
+        self.addCleanup(shutil.rmtree, archive_root)
+        tiers = override_settings(TIERING_CACHE_ROOT = cache_root, TIERING_ARCHIVE_STORAGE = 'content.storage.GzipStorage',
+                                  TIERING_ARCHIVE_OPTIONS = {'location' : archive_root}, TIERING_HOT_MIN_DOWNLOADS = 1,
+                                  TIERING_ACCESS_FLUSH_INTERVAL = 0)
+        tiers.enable()
+        self.addCleanup(tiers.disable)
+
+        self.cached_path = os.path.join(cache_root, self.file.file_data.name)
+        self.archived_path = os.path.join(archive_root, self.file.file_data.name + '.gz')
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+    def download(self, **headers):
+        return b''.join(self.client.get(self.url, **headers).streaming_content)
+
+    def test_downloads_counted(self):
+        self.download()
+        self.download(HTTP_RANGE = 'bytes=5-')
+        self.download()
+        self.assertEqual(Blob.objects.get(name = self.file.file_data.name).download_count, 2)
+
+    def test_hot_blob_cached(self):
+        self.download()
+        self.assertEqual(rebalance_cache(), {'promoted' : 1, 'evicted' : 0})
+        self.assertTrue(os.path.exists(self.cached_path))
+
+        with override_settings(SENDFILE_BACKEND = 'nginx'):
+            self.assertEqual(self.client.get(self.url)['X-Accel-Redirect'], '/cached/' + self.file.file_data.name)
+
+        rebalance_archive()
+        rebalance_archive()
+        self.assertEqual(rebalance_cache(), {'promoted' : 0, 'evicted' : 1})
+        self.assertFalse(os.path.exists(self.cached_path))
+
+    def test_cold_blob_archived(self):
+        Blob.objects.filter(name = self.file.file_data.name).update(last_accessed = timezone.now() - timedelta(days = 365))
+        self.assertEqual(rebalance_archive(), {'demoted' : 1, 'restored' : 0})
+        self.assertTrue(os.path.exists(self.archived_path))
+        # the main copy stays until the links issued before the move have expired
+        self.assertTrue(self.file.file_data.storage.exists(self.file.file_data.name))
+        rebalance_archive(now = timezone.now() + settings.SIGNED_URL_MAX_AGE)
+        self.assertFalse(self.file.file_data.storage.exists(self.file.file_data.name))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Length'], str(len(b'%PDF-1.4 lecture')))
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 lecture')
+
+        self.assertEqual(rebalance_archive(), {'demoted' : 0, 'restored' : 1})
+        self.assertFalse(os.path.exists(self.archived_path))
+        self.assertEqual(self.download(), b'%PDF-1.4 lecture')
+
+    def test_cold_blob_processed(self):
+        # the jobs of a blob archived before they ran read it from the archive
+        Blob.objects.filter(name = self.file.file_data.name).update(last_accessed = timezone.now() - timedelta(days = 365))
+        rebalance_archive()
+        rebalance_archive(now = timezone.now() + settings.SIGNED_URL_MAX_AGE)
+        File.objects.filter(pk = self.file.pk).update(content_hash = '')
+
+        file_obj = File.objects.get(pk = self.file.pk)
+        verify_checksum(file_obj)
+        self.assertEqual(File.objects.get(pk = self.file.pk).content_hash, hashlib.sha256(b'%PDF-1.4 lecture').hexdigest())
+        self.assertEqual(probe_pdf(file_obj), {'page_count' : None})
+
+@override_settings(STORAGE_COMPRESSION = 'gzip')
+class CompressionTests(DownloadTestCase):
+    ''' compressible uploads are stored gzipped and sent gzipped to the clients which accept it '''
+
+    content = b'%PDF-1.4 ' + b'lecture notes ' * 1000
+
+    def setUp(self):
+        super().setUp()
+        content = ContentFile(self.content)
+        self.file.file_data.save('notes.pdf', content, save = False)
+        self.file.set_upload_metadata(content)
+        self.file.save()
+        self.storage = self.file.file_data.storage
+        self.name = self.file.file_data.name
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+    def test_stored_compressed(self):
+        self.assertEqual(self.storage.stored_encoding(self.name), 'gzip')
+        self.assertEqual(Blob.objects.get(name = self.name).encoding, 'gzip')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, self.name)))
+        self.assertTrue(self.storage.exists(self.name))
+        self.assertEqual(self.storage.size(self.name), len(self.content))
+        with self.storage.open(self.name) as stored_file:
+            self.assertEqual(stored_file.read(), self.content)
+
+    def test_incompressible_stored_as_is(self):
+        self.file.file_data.save('scan.pdf', ContentFile(b'%PDF-1.4 ' + os.urandom(10000)))
+        self.assertIsNone(self.storage.stored_encoding(self.file.file_data.name))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, self.file.file_data.name)))
+
+    def test_sent_compressed(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING = 'gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+
+    def test_decompressed_for_other_clients(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING = 'gzip;q=0', HTTP_RANGE = 'bytes=0-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_size_recorded_when_stored(self):
+        self.assertEqual(Blob.objects.get(name = self.name).size, len(self.content))
+
+    def test_decompressed_without_size(self):
+        Blob.objects.filter(name = self.name).update(size = None)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING = 'identity')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_accepts_encoding(self):
+        request = type('Request', (), {'META' : {'HTTP_ACCEPT_ENCODING' : 'br, GZIP;q=0.5, zstd;q=0'}})
+        self.assertTrue(accepts_encoding(request, 'gzip'))
+        self.assertFalse(accepts_encoding(request, 'zstd'))
+        self.assertFalse(accepts_encoding(request, 'deflate'))
+
+class StreamTestCase(DownloadTestCase):
+    ''' the stored file is packaged to hls '''
+
+    def setUp(self):
+        super().setUp()
+        storage = self.file.file_data.storage
+        storage.save_as(self.file.get_stream_name('hls', 'index.m3u8'), ContentFile(b'#EXTM3U\nsegment_00000.ts\n'))
+        storage.save_as(self.file.get_stream_name('hls', 'segment_00000.ts'), ContentFile(b'segment'))
+        File.objects.filter(pk = self.file.pk).update(stream_formats = 'hls')
+        self.stream_url = '/content/stream/%d/hls/' % self.file.id
+
+class StreamFileTests(StreamTestCase):
+    ''' the segments of a packaged file are served to the customers who can download it '''
+
+    def test_not_baught(self):
+        self.assertEqual(self.client.get(self.stream_url + 'segment_00000.ts').status_code, 403)
+        self.assertEqual(self.client.get('/content/show_files/%d/' % self.file.id).data['streams'], {})
+
+    def test_segments(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+        streams = self.client.get('/content/show_files/%d/' % self.file.id).data['streams']
+        self.assertTrue(streams['hls'].endswith(self.stream_url + 'index.m3u8'))
+
+        response = self.client.get(self.stream_url + 'segment_00000.ts')
+        self.assertEqual(response['Content-Type'], 'video/mp2t')
+        self.assertNotIn('Content-Disposition', response)
+        self.assertEqual(b''.join(response.streaming_content), b'segment')
+
+        self.assertEqual(self.client.get(self.stream_url + 'segment_00001.ts').status_code, 404)
+        self.assertEqual(self.client.get('/content/stream/%d/dash/manifest.mpd' % self.file.id).status_code, 404)
+        self.assertEqual(self.client.get(self.stream_url + '..').status_code, 404)
+
+    def test_removed_with_the_blob(self):
+        package_dir = os.path.join(self.media_root, os.path.dirname(self.file.get_stream_name('hls', 'index.m3u8')))
+        self.file.file_data.storage.delete(self.file.file_data.name)
+        self.assertFalse(os.path.exists(package_dir))
+
+class PresignedRedirectTests(StreamTestCase):
+    ''' a storage with presigned urls serves the downloads and segments itself, the manifests stay here '''
+
+    def setUp(self):
+        super().setUp()
+        storage = self.file.file_data.storage
+        storage.presigned_url = lambda name, filename, content_type, as_attachment, content_encoding = None : 'https://bucket.example/' + name
+        self.addCleanup(delattr, storage, 'presigned_url')
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+    def test_redirected(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'https://bucket.example/' + self.file.file_data.name)
+
+        response = self.client.get(self.stream_url + 'segment_00000.ts')
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('max-age', response['Cache-Control'])
+
+        response = self.client.get(self.stream_url + 'index.m3u8')
+        self.assertEqual(b''.join(response.streaming_content), b'#EXTM3U\nsegment_00000.ts\n')
+
+@skipUnless(os.environ.get('S3_TEST_BUCKET'), 'set S3_TEST_BUCKET and S3_* to run against an s3 compatible store like minio')
+class S3StorageTests(TestCase):
+    ''' the object store backend against a real bucket, the credentials come from S3_* in settings '''
+
+    @override_settings(S3_MULTIPART_THRESHOLD = 5 * 1024 * 1024, S3_MULTIPART_CHUNKSIZE = 5 * 1024 * 1024)
+    def test_blob(self):
+        storage = S3ContentAddressedStorage(bucket = os.environ['S3_TEST_BUCKET'], location = 'tests')
+        content = os.urandom(11 * 1024 * 1024)
+        name = storage.save('big.mp4', ContentFile(content))
+        self.assertEqual(name, storage.blob_name(hashlib.sha256(content).hexdigest(), 'big.mp4'))
+        self.assertEqual(storage.save('again.mp4', ContentFile(content)), name)
+        self.assertEqual(storage.size(name), len(content))
+        with storage.open(name) as stored:
+            self.assertEqual(stored.read(), content)
+
+        segment = os.path.splitext(name)[0] + '/hls/segment_00000.ts'
+        storage.save_as(segment, ContentFile(b'segment'))
+        self.assertIn('X-Amz-Signature', storage.presigned_url(segment, 'segment.ts', 'video/mp2t', False))
+
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(segment))
+
+@override_settings(DOWNLOAD_URL_SIGNING = 'signed')
+class SignedDownloadTests(DownloadTestCase):
+    ''' signed links are checked without authentication and without queries '''
+
+    def download_link(self):
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        url = self.client.get('/content/show_files/%d/' % self.file.id).data['file_data']
+        self.client.force_authenticate(user = None)
+        return url
+
+    def signed_url(self):
+        url = self.download_link()
+        self.assertIn('/content/signed_download/', url)
+        return url
+
+    def test_download(self):
+        url = self.signed_url()
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 lecture')
+        self.assertIn('lecture.pdf', response['Content-Disposition'])
+
+    def test_tampered(self):
+        url = self.signed_url()
+        self.assertEqual(self.client.get(url.replace('/signed_download/', '/signed_download/x')).status_code, 403)
+
+    @override_settings(SIGNED_URL_MAX_AGE = timedelta(seconds = -1))
+    def test_expired(self):
+        self.assertEqual(self.client.get(self.signed_url()).status_code, 403)
+
+    @override_settings(DOWNLOAD_URL_SIGNING = 'secure_link', SIGNED_URL_SECRET = 'secret')
+    def test_secure_link(self):
+        # the front server checks these links, they do not point to the signed_download endpoint
+        url = self.download_link()
+        self.assertNotIn('/content/signed_download/', url)
+        path, query = url.split('?')
+        params = dict(parameter.split('=') for parameter in query.split('&'))
+
+        uri = '/signed/' + self.file.file_data.name
+        self.assertTrue(path.endswith(uri))
+        digest = hashlib.md5(('%s%s secret' % (params['expires'], uri)).encode('utf-8')).digest()
+        self.assertEqual(params['md5'], base64.urlsafe_b64encode(digest).decode('ascii').rstrip('='))
+
+class ResumableUploadTests(APITestCase):
+    ''' big files are uploaded in chunks and finalized into a File '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT = self.media_root, UPLOAD_STAGING_ROOT = self.media_root + '/.staging')
+        media.enable()
+        self.addCleanup(media.disable)
+
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        Profile.objects.create(user = owner, is_owner = True)
+        store = Store.objects.create(owner = owner)
+        self.product = Product.objects.create(product_name = 'product', is_free = True, product_store = store)
+
+        self.client.force_authenticate(user = owner)
+        response = self.client.post('/content/resumable_upload/', {'file_name' : 'lecture', 'upload_name' : 'video.mp4',
+                                                                   'upload_size' : 10, 'file_product' : self.product.id, 'is_free' : True})
+        self.assertEqual(response.status_code, 201)
+        self.url = '/content/resumable_upload/%s/' % response.data['id']
+
+    def send(self, chunk, offset, **headers):
+        return self.client.generic('PATCH', self.url, chunk, content_type = 'application/offset+octet-stream',
+                                   HTTP_UPLOAD_OFFSET = str(offset), **headers)
+
+    def test_upload_in_chunks(self):
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'01234').digest()).decode()
+        self.assertEqual(self.send(b'01234', 0, HTTP_UPLOAD_CHECKSUM = checksum)['Upload-Offset'], '5')
+        self.assertEqual(self.client.head(self.url)['Upload-Offset'], '5')
+        self.assertEqual(self.send(b'56789', 5).status_code, 204)
+
+        response = self.client.post(self.url + 'finalize/')
+        self.assertEqual(response.status_code, 201)
+        file_obj = File.objects.get(pk = response.data['file_id'])
+        self.assertEqual(file_obj.file_name, 'lecture')
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(file_obj.file_data.name, '%s/%s/%s.mp4' % (digest[:2], digest[2:4], digest))
+        self.assertEqual(file_obj.content_hash, digest)
+        self.assertEqual(file_obj.get_download_name(), 'lecture.mp4')
+
+    def test_wrong_offset(self):
+        self.send(b'01234', 0)
+        self.assertEqual(self.send(b'01234', 0).status_code, 409)
+
+    def test_checksum_mismatch(self):
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+        self.assertEqual(self.send(b'01234', 0, HTTP_UPLOAD_CHECKSUM = checksum).status_code, 460)
+        self.assertEqual(self.client.get(self.url).data['offset'], 0)
+
+    def test_malformed_checksum(self):
+        self.assertEqual(self.send(b'01234', 0, HTTP_UPLOAD_CHECKSUM = 'sha256 not-base64!').status_code, 400)
+        self.assertEqual(self.send(b'01234', 0, HTTP_UPLOAD_CHECKSUM = 'crc32 AAAA').status_code, 400)
+        self.assertEqual(self.client.get(self.url).data['offset'], 0)
+
+    def test_finalize_incomplete(self):
+        self.send(b'01234', 0)
+        self.assertEqual(self.client.post(self.url + 'finalize/').status_code, 400)
+
+    def test_long_name_rejected_at_start(self):
+        response = self.client.post('/content/resumable_upload/', {'upload_name' : 'a' * 40 + '.mp4', 'upload_size' : 10,
+                                                                   'file_product' : self.product.id, 'is_free' : True})
+        self.assertEqual(response.status_code, 400)
+
+class UploadTestCase(APITestCase):
+    ''' an owner with a product, uploading into a temporary MEDIA_ROOT '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT = self.media_root, UPLOAD_STAGING_ROOT = self.media_root + '/.staging')
+        media.enable()
+        self.addCleanup(media.disable)
+
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        Profile.objects.create(user = owner, is_owner = True)
+        store = Store.objects.create(owner = owner)
+        self.product = Product.objects.create(product_name = 'product', is_free = True, product_store = store)
+        self.client.force_authenticate(user = owner)
+
+class StreamingUploadTests(UploadTestCase):
+    ''' uploads are written once under their final name, hashed and sniffed while they are received '''
+
+    def test_upload(self):
+        content = b'%PDF-1.4 lecture notes'
+        response = self.client.post('/content/upload_file/', {'file_name' : 'notes', 'is_free' : True, 'file_product' : self.product.id,
+                                                              'file_data' : SimpleUploadedFile('upload.pdf', content)})
+        self.assertEqual(response.status_code, 201)
+
+        file_obj = File.objects.get(pk = response.data['file_id'])
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(file_obj.file_data.name, '%s/%s/%s.pdf' % (digest[:2], digest[2:4], digest))
+        self.assertEqual(file_obj.get_download_name(), 'notes.pdf')
+        self.assertEqual(file_obj.content_hash, digest)
+        self.assertEqual(file_obj.file_size, len(content))
+        self.assertEqual(file_obj.mime_type, 'application/pdf')
+        self.assertEqual(os.listdir(self.media_root + '/.staging'), [])
+
+    def upload(self, file_name, content):
+        response = self.client.post('/content/upload_file/', {'file_name' : file_name, 'is_free' : True, 'file_product' : self.product.id,
+                                                              'file_data' : SimpleUploadedFile('upload.mp3', content)})
+        return File.objects.get(pk = response.data['file_id'])
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload('first', b'ID3 track')
+        second = self.upload('second', b'ID3 track')
+        self.assertEqual(first.file_data.name, second.file_data.name)
+        self.assertEqual(Blob.objects.get(name = first.file_data.name).ref_count, 2)
+
+        self.client.delete('/content/upload_file/%d/' % first.id)
+        self.assertEqual(Blob.objects.get(name = first.file_data.name).ref_count, 1)
+        self.assertTrue(second.file_data.storage.exists(second.file_data.name))
+
+    def test_last_reference_removes_the_blob(self):
+        file_obj = self.upload('track', b'ID3 track')
+        self.client.delete('/content/upload_file/%d/' % file_obj.id)
+        self.assertFalse(Blob.objects.filter(name = file_obj.file_data.name).exists())
+
+    def test_rename_keeps_the_blob(self):
+        file_obj = self.upload('track', b'ID3 track')
+        response = self.client.patch('/content/upload_file/%d/' % file_obj.id, {'file_name' : 'renamed'})
+        self.assertEqual(response.status_code, 200)
+
+        renamed = File.objects.get(pk = file_obj.id)
+        self.assertEqual(renamed.file_name, 'renamed')
+        self.assertEqual(renamed.file_data.name, file_obj.file_data.name)
+        self.assertEqual(Blob.objects.get(name = file_obj.file_data.name).ref_count, 1)
+
+    def test_readable_by_the_front_server(self):
+        file_obj = self.upload('track', b'ID3 track')
+        self.assertEqual(os.stat(file_obj.file_data.path).st_mode & 0o777, 0o644)
+
+class KeysetPaginationTests(APITestCase):
+    ''' list endpoints page on (created_date, id) '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        store = Store.objects.create(owner = owner)
+        self.products = [Product.objects.create(product_name = 'product %d' % i, is_free = True, product_store = store) for i in range(7)]
+        self.client.force_authenticate(user = owner)
+
+    def names(self, response):
+        return [product['product_name'] for product in response.data['results']]
+
+    def test_pages(self):
+        first = self.client.get('/content/show_products/', {'page_size' : 3})
+        self.assertEqual(self.names(first), ['product 6', 'product 5', 'product 4'])
+        self.assertIsNone(first.data['previous'])
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.names(second), ['product 3', 'product 2', 'product 1'])
+
+        last = self.client.get(second.data['next'])
+        self.assertEqual(self.names(last), ['product 0'])
+        self.assertIsNone(last.data['next'])
+
+        back = self.client.get(last.data['previous'])
+        self.assertEqual(self.names(back), ['product 3', 'product 2', 'product 1'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/content/show_products/', {'cursor' : 'broken'}).status_code, 404)
+
+class PurchaseLedgerTests(APITestCase):
+    ''' buying is one idempotent insert into the ledger '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        store = Store.objects.create(owner = owner)
+        self.product = Product.objects.create(product_name = 'product', is_free = False, product_price = 10, product_store = store)
+        self.file = File.objects.create(file_name = 'file', file_data = 'file.pdf', file_product = self.product, is_free = False, file_price = 5)
+        self.client.force_authenticate(user = self.customer)
+
+    def test_buy_twice(self):
+        url = '/content/show_products/%d/' % self.product.id
+        self.assertEqual(self.client.put(url, {'buy_confirmation' : 'buy'}).data, "You baught this product successfully")
+        self.assertEqual(self.client.put(url, {'buy_confirmation' : 'buy'}).data, "You have already baught this product")
+        self.assertEqual(Purchase.objects.filter(user = self.customer, product = self.product).count(), 1)
+
+    def test_cart_made_with_the_first_purchase(self):
+        self.assertEqual(self.client.get('/content/show_my_cart/').data['results'][0]['baught_products'], [])
+        self.assertFalse(Cart.objects.filter(user = self.customer).exists())
+
+        self.client.put('/content/show_products/%d/' % self.product.id, {'buy_confirmation' : 'buy'})
+        parents = DateClass.objects.count()
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+        self.assertEqual(Cart.objects.filter(user = self.customer).count(), 1)
+        self.assertEqual(DateClass.objects.count(), parents)
+
+    def test_cart_shows_the_ledger(self):
+        self.client.put('/content/show_products/%d/' % self.product.id, {'buy_confirmation' : 'buy'})
+        self.client.put('/content/show_files/%d/' % self.file.id, {'buy_confirmation' : 'buy'})
+
+        cart = self.client.get('/content/show_my_cart/').data['results'][0]
+        self.assertEqual(cart['baught_products'], [self.product.id])
+        self.assertEqual(cart['baught_files'], [self.file.id])
+
+class SubscriptionPurchaseTests(APITestCase):
+    ''' a subscription is baught once per period and renewed only after it expires '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        store = Store.objects.create(owner = owner)
+        self.subscription = Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = store)
+        self.url = '/content/show_subscription/%d/' % self.subscription.id
+        self.client.force_authenticate(user = self.customer)
+
+    def test_buy_twice(self):
+        self.assertEqual(self.client.put(self.url, {'buy_confirmation' : 'buy'}).data, "You baught this file successfully")
+        self.assertEqual(self.client.put(self.url, {'buy_confirmation' : 'buy'}).data, "You have already baught this file")
+        self.assertEqual(SubscriptionPurchase.objects.filter(user = self.customer).count(), 1)
+
+    def test_renew_expired(self):
+        self.client.put(self.url, {'buy_confirmation' : 'buy'})
+        SubscriptionPurchase.objects.update(expires_at = timezone.now())
+
+        self.assertEqual(self.client.put(self.url, {'buy_confirmation' : 'cancel'}).data, "You canceled buying this file")
+        self.assertEqual(self.client.put(self.url, {'buy_confirmation' : 'buy'}).data, "You baught this file successfully")
+        purchase = SubscriptionPurchase.objects.get(user = self.customer)
+        self.assertGreater(purchase.expires_at, timezone.now())
+        self.assertEqual(Entitlement.objects.get(user = self.customer).valid_until, purchase.expires_at)
+
+    def test_cart_shows_expiry(self):
+        self.client.put(self.url, {'buy_confirmation' : 'buy'})
+        cart = self.client.get('/content/show_my_cart/').data['results'][0]
+        self.assertEqual([sub['subscription'] for sub in cart['baught_subscriptions']], [self.subscription.id])
+
+class CheckoutTests(APITestCase):
+    ''' a basket is baught with one request whose cost does not grow with the basket '''
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        self.client.force_authenticate(user = self.customer)
+
+    def basket(self, size):
+        basket = {'products' : [], 'files' : [], 'subscriptions' : []}
+        for i in range(size):
+            store = Store.objects.create(owner = self.owner)
+            subscription = Subscription.objects.create(amount = 10, expiry_date_amount = 1, expiry_date_unit = 'day', store_subscription = store)
+            product = Product.objects.create(product_name = 'product %d' % i, is_free = False, product_price = 10, product_store = store)
+            file_obj = File.objects.create(file_name = 'file %d' % i, file_data = 'file_%d.pdf' % i, file_product = product, is_free = False, file_price = 5)
+            basket['products'].append(product.id)
+            basket['files'].append(file_obj.id)
+            basket['subscriptions'].append(subscription.id)
+        return basket
+
+    def test_results(self):
+        basket = self.basket(2)
+        self.client.put('/content/show_products/%d/' % basket['products'][0], {'buy_confirmation' : 'buy'})
+        basket['files'].append(999999)
+
+        response = self.client.post('/content/checkout/', basket, format = 'json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.data['products']], ['already baught', 'baught'])
+        self.assertEqual([item['status'] for item in response.data['files']], ['baught', 'baught', 'not found'])
+        self.assertEqual([item['status'] for item in response.data['subscriptions']], ['baught', 'baught'])
+        self.assertEqual(Purchase.objects.filter(user = self.customer).count(), 4)
+        self.assertEqual(Entitlement.objects.filter(user = self.customer, store__isnull = False).count(), 2)
+
+        response = self.client.post('/content/checkout/', basket, format = 'json')
+        self.assertEqual([item['status'] for item in response.data['subscriptions']], ['already baught', 'already baught'])
+
+    def test_empty_basket(self):
+        self.assertEqual(self.client.post('/content/checkout/', {}, format = 'json').status_code, 400)
+
+    def test_constant_queries(self):
+        counts = []
+        for size in (1, 10):
+            basket = self.basket(size)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post('/content/checkout/', basket, format = 'json').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+class BulkTests(UploadTestCase):
+    ''' owners upload and edit many files and products per request, failures are reported per item '''
+
+    def test_bulk_upload(self):
+        response = self.client.post('/content/upload_file/bulk/', {'is_free' : True, 'file_product' : self.product.id, 'file_data' : [
+            SimpleUploadedFile('first.mp3', b'ID3 first'), SimpleUploadedFile('second.exe', b'MZ'), SimpleUploadedFile('third.pdf', b'%PDF-1.4')]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['name'] for result in response.data], ['first.mp3', 'second.exe', 'third.pdf'])
+        self.assertIn('errors', response.data[1])
+
+        file_obj = File.objects.get(pk = response.data[2]['file_id'])
+        self.assertEqual(file_obj.file_name, 'third')
+        self.assertEqual(file_obj.mime_type, 'application/pdf')
+
+    def test_bulk_upload_archive(self):
+        archive = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('album/one.mp3', b'ID3 one')
+            zipped.writestr('album/two.mp3', b'ID3 two')
+        archive.seek(0)
+
+        response = self.client.post('/content/upload_file/bulk/', {'is_free' : True, 'file_product' : self.product.id,
+                                                                   'archive' : SimpleUploadedFile('album.zip', archive.read())})
+        self.assertEqual(sorted(File.objects.values_list('file_name', flat = True)), ['one', 'two'])
+        self.assertEqual(File.objects.get(pk = response.data[0]['file_id']).content_hash, hashlib.sha256(b'ID3 one').hexdigest())
+        self.assertEqual(os.listdir(self.media_root + '/.staging'), [])
+
+    def test_bulk_update_products(self):
+        other_store = Store.objects.create(owner = User.objects.create_user(username = 'other', password = 'other-pass'))
+        other_product = Product.objects.create(product_name = 'other', is_free = True, product_store = other_store)
+
+        response = self.client.patch('/content/add_product/bulk/', [
+            {'id' : self.product.id, 'product_name' : 'renamed', 'is_free' : False, 'product_price' : 20},
+            {'id' : other_product.id, 'product_name' : 'stolen'},
+            {'id' : self.product.id, 'product_price' : -1},
+        ], format = 'json')
+
+        self.assertEqual(response.data[0]['status'], 'updated')
+        self.assertIn('errors', response.data[1])
+        self.assertIn('errors', response.data[2])
+        self.product.refresh_from_db()
+        other_product.refresh_from_db()
+        self.assertEqual((self.product.product_name, self.product.product_price), ('renamed', 20))
+        self.assertEqual(other_product.product_name, 'other')
+
+class ProcessingTests(UploadTestCase):
+    ''' uploads are answered at once and probed afterwards by the worker '''
+
+    def upload(self, name, content):
+        response = self.client.post('/content/upload_file/', {'is_free' : True, 'file_product' : self.product.id,
+                                                              'file_data' : SimpleUploadedFile(name, content)})
+        self.assertEqual(response.data['processing_status'], 'pending')
+        return File.objects.get(pk = response.data['file_id'])
+
+    def run_jobs(self):
+        for job in ProcessingJob.objects.claim('test', 10):
+            run_job(job)
+
+    def test_pdf(self):
+        file_obj = self.upload('notes.pdf', b'%PDF-1.4 /Type /Pages /Type /Page /Type /Page')
+        self.run_jobs()
+
+        file_obj.refresh_from_db()
+        self.assertEqual((file_obj.processing_status, file_obj.page_count), ('ready', 2))
+
+    def test_rejected(self):
+        file_obj = self.upload('notes.pdf', b'not a pdf at all')
+        self.run_jobs()
+
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.processing_status, 'rejected')
+        self.assertEqual(self.client.get('/content/show_files/%d/' % file_obj.id).status_code, 404)
+
+        # not sold nor downloaded, even free
+        self.client.force_authenticate(user = User.objects.create_user(username = 'customer', password = 'customer-pass'))
+        self.assertEqual(self.client.get('/content/download/%d/' % file_obj.id).status_code, 403)
+        response = self.client.post('/content/checkout/', {'files' : [file_obj.id]}, format = 'json')
+        self.assertEqual(response.data['files'], [{'id' : file_obj.id, 'status' : 'not found'}])
+        response = self.client.put('/content/show_files/%d/' % file_obj.id, {'buy_confirmation' : 'buy'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Purchase.objects.filter(file = file_obj).exists())
+
+        file_products = self.client.get('/content/show_products/%d/' % self.product.id).data['file_products']
+        self.assertFalse([url for url in file_products if url.endswith('/show_files/%d/' % file_obj.id)])
+
+    @override_settings(FFPROBE_BINARY = '/nonexistent/ffprobe', PROCESSING_MAX_ATTEMPTS = 2)
+    def test_retries(self):
+        file_obj = self.upload('song.mp3', b'ID3 song')
+        self.run_jobs()
+
+        job = ProcessingJob.objects.get(file = file_obj)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('not installed', job.last_error)
+
+        ProcessingJob.objects.update(run_after = timezone.now())
+        self.run_jobs()
+        job.refresh_from_db()
+        file_obj.refresh_from_db()
+        self.assertEqual((job.status, file_obj.processing_status), ('failed', 'failed'))
+
+class ResponseCacheTests(APITestCase):
+    ''' catalogue reads are cached until a model they read changes '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        self.store = Store.objects.create(owner = owner)
+        self.product = Product.objects.create(product_name = 'product', is_free = True, product_store = self.store)
+        self.client.force_authenticate(user = customer)
+        self.url = '/content/show_products/%d/' % self.product.id
+
+    def test_cached(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidated_by_signals(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.product.product_name = 'renamed'
+        self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['product_name'], 'renamed')
+
+        category = Category.objects.create(category_name = 'educational')
+        self.product.product_category.add(category)
+        self.assertEqual(self.client.get(self.url).data['product_category'], [category.id])
+
+        File.objects.create(file_name = 'file', file_data = 'file.pdf', file_product = self.product, is_free = True)
+        self.assertEqual(len(self.client.get(self.url).data['file_products']), 1)
+
+
+class SearchTests(APITestCase):
+    ''' ranked full text search with facet filters and counts '''
+
+    def setUp(self):
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        self.store = Store.objects.create(owner = owner)
+        other_store = Store.objects.create(owner = owner)
+        educational = Category.objects.create(category_name = 'educational')
+
+        self.python = Product.objects.create(product_name = 'python course', is_free = False, product_price = 20, product_store = self.store)
+        self.python.product_category.add(educational)
+        self.python_basics = Product.objects.create(product_name = 'python python basics', is_free = True, product_store = other_store)
+        Product.objects.create(product_name = 'cooking course', is_free = False, product_price = 120, product_store = self.store)
+        File.objects.create(file_name = 'python lecture', file_data = 'lecture.pdf', file_product = self.python, is_free = False, file_price = 5)
+        self.client.force_authenticate(user = customer)
+
+    def test_ranked(self):
+        response = self.client.get('/content/search_products/', {'q' : 'python'})
+        self.assertEqual([result['product_name'] for result in response.data['results']], ['python python basics', 'python course'])
+
+    def test_renamed_product_is_found(self):
+        self.python.product_name = 'django course'
+        self.python.save()
+        response = self.client.get('/content/search_products/', {'q' : 'django'})
+        self.assertEqual([result['product_name'] for result in response.data['results']], ['django course'])
+
+    def test_facet_filters(self):
+        def names(params):
+            return [result['product_name'] for result in self.client.get('/content/search_products/', params).data['results']]
+
+        self.assertEqual(names({'q' : 'python', 'category' : 'educational'}), ['python course'])
+        self.assertEqual(names({'q' : 'python', 'is_free' : 'true'}), ['python python basics'])
+        self.assertEqual(names({'q' : 'course', 'min_price' : '100'}), ['cooking course'])
+        self.assertEqual(names({'q' : 'course', 'store' : self.store.id, 'max_price' : '50'}), ['python course'])
+        self.assertEqual(self.client.get('/content/search_products/', {'min_price' : 'cheap'}).status_code, 400)
+
+    def test_facet_counts(self):
+        facets = self.client.get('/content/search_products/', {'q' : 'python'}).data['facets']
+        self.assertEqual(facets['category'], {'educational' : 1})
+        self.assertEqual(facets['is_free'], {'true' : 1, 'false' : 1})
+        self.assertEqual(facets['store'], {self.store.id : 1, self.python_basics.product_store_id : 1})
+        self.assertEqual(facets['price']['10-50'], 1)
+
+    def test_pages(self):
+        first = self.client.get('/content/search_products/', {'q' : 'python', 'page_size' : 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(first.data['results'][0]['product_name'], 'python python basics')
+        self.assertEqual(second.data['results'][0]['product_name'], 'python course')
+        self.assertIsNone(second.data['next'])
+
+    def test_files(self):
+        response = self.client.get('/content/search_files/', {'q' : 'lecture', 'category' : 'educational'})
+        self.assertEqual([result['file_name'] for result in response.data['results']], ['python lecture'])
+        self.assertEqual(response.data['facets']['store'], {self.store.id : 1})
+
+
+class BenchmarkTests(APITestCase):
+    ''' a tiny seeded catalogue goes through every benchmark scenario '''
+
+    def test_run(self):
+        customers = seed_catalogue(stores = 2, products = 4, files = 4, carts = 1, subscriptions = 2)
+        results = run_client(customers[0], requests = 2)
+
+        self.assertIn('login', results)
+        self.assertIn('show_product', results)
+        for name, result in results.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 2)
+        self.assertEqual(compare(results, {'scenarios' : results}), [])
+        self.assertEqual(set(Subscription.objects.values_list('expiry_date_unit', flat = True)), {'day'})
+
+    def test_one_subscription_per_store(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_catalogue', stores = 1, products = 1, files = 1, carts = 0, subscriptions = 2)
+
+    def test_compare(self):
+        baseline = {'scenarios' : {'show_products' : {'p95_ms' : 10, 'queries_per_request' : 3, 'errors' : 0}}}
+        results = {'show_products' : {'p95_ms' : 11, 'queries_per_request' : 4, 'errors' : 0}}
+        self.assertEqual(len(compare(results, baseline)), 1)
+        results['show_products']['p95_ms'] = 13
+        self.assertEqual(len(compare(results, baseline)), 2)
+        self.assertEqual(len(compare({}, baseline)), 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+
+
+class InstrumentationTests(APITestCase):
+    ''' every request is counted with its sql, and slow ones are logged with it '''
+
+    def setUp(self):
+        registry.clear()
+        owner = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        customer = User.objects.create_user(username = 'customer', password = 'customer-pass')
+        self.product = Product.objects.create(product_name = 'product', is_free = True, product_store = Store.objects.create(owner = owner))
+        self.client.force_authenticate(user = customer)
+        self.url = '/content/show_files/'
+
+    @override_settings(SERVER_TIMING = True)
+    def test_metrics(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+
+        self.assertIn('desc="%d queries"' % len(context.captured_queries), response['Server-Timing'])
+        self.assertEqual(registry.get('http_requests_total', view = 'show_file-list', method = 'GET', status = 200), 1)
+        self.assertEqual(registry.get('http_request_db_queries_total', view = 'show_file-list'), len(context.captured_queries))
+        self.assertEqual(registry.get('http_response_bytes_total', view = 'show_file-list'), len(response.content))
+
+        with override_settings(METRICS_TOKEN = 'metrics-token'):
+            metrics = self.client.get('/content/metrics/', HTTP_AUTHORIZATION = 'Bearer metrics-token').content.decode('utf-8')
+        self.assertIn('http_request_duration_seconds_count{view="show_file-list"} 1', metrics)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD = 0)
+    def test_slow_request_log(self):
+        with self.assertLogs('content.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('content_file', logs.output[0])
+        self.assertEqual(registry.get('http_slow_requests_total', view = 'show_file-list'), 1)
+
+    @override_settings(METRICS_TOKEN = 'metrics-token')
+    def test_metrics_need_token(self):
+        self.assertEqual(self.client.get('/content/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/content/metrics/', HTTP_AUTHORIZATION = 'Bearer other').status_code, 403)
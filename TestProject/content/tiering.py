@@ -0,0 +1,252 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Blob, File
+from .sendfile import StoredFile
+
+
+logger = logging.getLogger(__name__)
+
+# the archive storages by their settings, an object store keeps its client between downloads
+archive_storages = {}
+
+
+def get_primary_storage():
+    return File._meta.get_field('file_data').storage
+
+def get_cache_storage():
+    ''' the fast local directory of this host with copies of the most downloaded blobs, None without one '''
+
+    if not settings.TIERING_CACHE_ROOT:
+        return None
+    return FileSystemStorage(location = settings.TIERING_CACHE_ROOT)
+
+def get_archive_storage():
+    ''' the cheaper storage the blobs nobody downloads are moved to, None without one '''
+
+    if not settings.TIERING_ARCHIVE_STORAGE:
+        return None
+
+    key = (settings.TIERING_ARCHIVE_STORAGE, repr(sorted(settings.TIERING_ARCHIVE_OPTIONS.items())))
+    if key not in archive_storages:
+        archive_storages[key] = get_storage_class(settings.TIERING_ARCHIVE_STORAGE)(**settings.TIERING_ARCHIVE_OPTIONS)
+    return archive_storages[key]
+
+def tiered_file(name, archived = None, encoding = ''):
+    ''' the copy of a blob a download reads: the hot cache, then the archive, then the main storage
+
+    archived is Blob.archived, read with the File or carried by a signed link, so the archive is only asked
+    for the blobs moved to it, None asks it anyway. the archive is asked before the main storage because a
+    blob being restored is complete in the archive until the restore has finished, while the main storage
+    may hold part of it. encoding is Blob.encoding, only the main storage keeps blobs compressed.
+    '''
+
+    cache = get_cache_storage()
+    if cache is not None and cache.exists(name):
+        return StoredFile(cache, name, sendfile_url = settings.TIERING_CACHE_URL)
+
+    archive = get_archive_storage()
+    if archived is not False and archive is not None and archive.exists(name):
+        # an archive which can not presign its files may keep them compressed, django decompresses them
+        return StoredFile(archive, name, streamed = not hasattr(archive, 'presigned_url'))
+
+    return StoredFile(get_primary_storage(), name, encoding = encoding)
+
+def is_new_download(request):
+    ''' a download from the start, the Range requests of players seeking in a file are not counted again '''
+
+    requested_range = request.META.get('HTTP_RANGE', '')
+    return not requested_range or requested_range.replace(' ', '').startswith('bytes=0-')
+
+
+class AccessTracker:
+    ''' the downloads of each blob, buffered in the process and written with one statement every TIERING_ACCESS_FLUSH_INTERVAL
+
+    the downloads of a process which stops before its next write are lost, they only rank the blobs.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.downloads = {}
+            self.started = None
+
+    def record(self, name):
+        now = timezone.now()
+        with self.lock:
+            count, accessed = self.downloads.get(name, (0, now))
+            self.downloads[name] = (count + 1, now)
+            if self.started is None:
+                self.started = time.monotonic()
+            due = time.monotonic() - self.started >= settings.TIERING_ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            downloads, self.downloads, self.started = self.downloads, {}, None
+        try:
+            Blob.objects.record_downloads(downloads)
+        except DatabaseError:
+            logger.exception('could not record the downloads of %d blobs', len(downloads))
+
+access_tracker = AccessTracker()
+
+
+def copy_blob(source, target, name):
+    with source.open(name, 'rb') as content:
+        if hasattr(target, 'save_as'):
+            return target.save_as(name, content)
+        if target.exists(name):
+            target.delete(name)
+        return target.save(name, content)
+
+def fill_cache(cache, source, name):
+    ''' copy a blob into the cache next to its place and rename it, so a download never reads half of it '''
+
+    path = cache.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with source.open(name, 'rb') as content, \
+            tempfile.NamedTemporaryFile(dir = os.path.dirname(path), suffix = '.part', delete = False) as staged:
+        try:
+            shutil.copyfileobj(content, staged)
+        except BaseException:
+            os.remove(staged.name)
+            raise
+    # the front server sends the cached copies, the temporary file is only readable by this user
+    if cache.file_permissions_mode is not None:
+        os.chmod(staged.name, cache.file_permissions_mode)
+    os.replace(staged.name, path)
+
+def cached_blobs(cache):
+    ''' name : size of every file in the cache directory of this host '''
+
+    blobs = {}
+    for root, directories, filenames in os.walk(cache.location):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            blobs[os.path.relpath(path, cache.location).replace(os.sep, '/')] = os.path.getsize(path)
+    return blobs
+
+def blob_source(name):
+    archive = get_archive_storage()
+    if archive is not None and archive.exists(name):
+        return archive
+    return get_primary_storage()
+
+def hot_blobs(budget):
+    ''' the blobs which should be cached, the best of TIERING_EVICTION first until TIERING_CACHE_SIZE is full
+
+    'lfu' ranks them by their recent downloads and 'lru' by their last download, both only among the blobs
+    with at least TIERING_HOT_MIN_DOWNLOADS recent downloads.
+    '''
+
+    if settings.TIERING_EVICTION == 'lru':
+        ordering = ['-last_accessed']
+    else:
+        ordering = ['-recent_downloads', '-last_accessed']
+
+    candidates = (Blob.objects.filter(ref_count__gt = 0, recent_downloads__gte = settings.TIERING_HOT_MIN_DOWNLOADS)
+                  .order_by(*ordering).values_list('name', 'size'))
+
+    hot, used = [], 0
+    for name, size in candidates.iterator():
+        if size is None:
+            try:
+                size = blob_source(name).size(name)
+            except (OSError, NotImplementedError):
+                continue
+        if used + size > budget:
+            continue
+        hot.append(name)
+        used += size
+    return hot
+
+def rebalance_cache():
+    ''' evict the cached blobs which are not hot anymore, then cache the hot ones which are not cached yet '''
+
+    cache = get_cache_storage()
+    if cache is None:
+        return {}
+
+    hot = hot_blobs(settings.TIERING_CACHE_SIZE)
+    cached = cached_blobs(cache)
+
+    hot_names = set(hot)
+    evicted = [name for name in cached if name not in hot_names]
+    for name in evicted:
+        cache.delete(name)
+
+    promoted = 0
+    for name in hot:
+        if name not in cached:
+            fill_cache(cache, blob_source(name), name)
+            promoted += 1
+
+    return {'promoted' : promoted, 'evicted' : len(evicted)}
+
+def rebalance_archive(now = None):
+    ''' move the blobs nobody downloaded for TIERING_COLD_AFTER to the archive and bring back the ones downloaded again
+
+    a blob is copied before its other copy is removed, so tiered_file always finds a whole one. the main copy
+    of an archived blob stays for SIGNED_URL_MAX_AGE, the signed links and presigned redirects issued before
+    still point at it, and is removed by a later run. the recent downloads decay afterwards, so the hot blobs
+    of the next run are the ones downloaded since.
+    '''
+
+    archive = get_archive_storage()
+    moved = {}
+    if archive is not None:
+        storage = get_primary_storage()
+        now = now or timezone.now()
+        cold_before = now - settings.TIERING_COLD_AFTER
+
+        cold = Blob.objects.filter(archived = False, ref_count__gt = 0, last_accessed__lt = cold_before)
+        demoted = 0
+        for name in cold.values_list('name', flat = True).iterator():
+            copy_blob(storage, archive, name)
+            Blob.objects.filter(name = name).update(archived = True, primary_expires = now + settings.SIGNED_URL_MAX_AGE)
+            demoted += 1
+
+        expired = Blob.objects.filter(archived = True, primary_expires__lte = now)
+        for name in expired.values_list('name', flat = True).iterator():
+            # the stream packages of the blob stay in the main storage
+            storage.delete(name, with_package = False)
+            Blob.objects.filter(name = name).update(primary_expires = None)
+
+        warm = Blob.objects.filter(archived = True, last_accessed__gte = cold_before)
+        restored = 0
+        for name, primary_expires in warm.values_list('name', 'primary_expires').iterator():
+            # a main copy which was not removed yet is still whole
+            updates = {'archived' : False, 'primary_expires' : None}
+            if primary_expires is None:
+                copy_blob(archive, storage, name)
+                updates['encoding'] = storage.stored_encoding(name) or '' if hasattr(storage, 'stored_encoding') else ''
+            Blob.objects.filter(name = name).update(**updates)
+            archive.delete(name)
+            restored += 1
+
+        moved = {'demoted' : demoted, 'restored' : restored}
+
+    Blob.objects.update(recent_downloads = F('recent_downloads') * settings.TIERING_DECAY)
+    return moved
+
+def delete_tiered_copies(name):
+    ''' remove the cached and archived copies of a blob which is not used anymore '''
+
+    for storage in (get_cache_storage(), get_archive_storage()):
+        if storage is not None and storage.exists(name):
+            storage.delete(name)
@@ -0,0 +1,110 @@
+import os
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+SNIFF_SIZE = 64
+
+asf_guid = b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'
+
+
+def sniff_mime_type(head):
+    ''' find the real type of a media file from its first bytes, empty when it is not a known format '''
+
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:12] == b'qt  ' else 'video/mp4'
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free'):
+        return 'video/quicktime'
+    if head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    if head.startswith(b'FLV'):
+        return 'video/x-flv'
+    if head.startswith(asf_guid):
+        return 'video/x-ms-asf'
+    if head.startswith(b'fLaC'):
+        return 'audio/flac'
+    if head.startswith(b'ID3'):
+        return 'audio/mpeg'
+    if head.startswith(b'ADIF'):
+        return 'audio/aac'
+    if len(head) > 1 and head[0] == 0xff:
+        if head[1] & 0xf6 == 0xf0:
+            return 'audio/aac'
+        if head[1] & 0xe0 == 0xe0 and head[1] & 0x06:
+            return 'audio/mpeg'
+    return ''
+
+
+class StagedUploadedFile(UploadedFile):
+    ''' an upload written to UPLOAD_STAGING_ROOT, next to MEDIA_ROOT, so the storage moves it into place '''
+
+    def __init__(self, name, content_type, charset, content_type_extra = None):
+        os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok = True)
+        file = tempfile.NamedTemporaryFile(suffix = '.upload', dir = settings.UPLOAD_STAGING_ROOT)
+        # the file keeps its mode when it is renamed into MEDIA_ROOT
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(file.name, settings.FILE_UPLOAD_PERMISSIONS)
+        super().__init__(file, name, content_type, 0, charset, content_type_extra)
+        self.content_hash = ''
+        self.sniffed_type = ''
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # the storage has already moved the file to its final place
+            pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    ''' write uploaded files once, hashing and sniffing them on the way, so the storage never reads them again '''
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = StagedUploadedFile(self.file_name, self.content_type, self.charset, self.content_type_extra)
+        self.digest = hashlib.sha256()
+        self.head = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.digest.update(raw_data)
+        if len(self.head) < SNIFF_SIZE:
+            self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.content_hash = self.digest.hexdigest()
+        self.file.sniffed_type = sniff_mime_type(self.head)
+        return self.file
+
+
+def stage_stream(name, stream):
+    ''' copy a stream, like an archive member, into the staging dir the same way StreamingUploadHandler writes uploads '''
+
+    staged = StagedUploadedFile(name, None, None)
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        staged.write(chunk)
+        digest.update(chunk)
+        if len(head) < SNIFF_SIZE:
+            head += chunk[:SNIFF_SIZE - len(head)]
+        size += len(chunk)
+
+    staged.seek(0)
+    staged.size = size
+    staged.content_hash = digest.hexdigest()
+    staged.sniffed_type = sniff_mime_type(head)
+    return staged
@@ -0,0 +1,141 @@
+import os
+import base64
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+
+from django.core.files import File as DjangoFile
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+
+from .models import File
+from .uploadhandlers import SNIFF_SIZE, sniff_mime_type
+
+
+CHUNK_SIZE = 64 * 1024
+checksum_algorithms = ('md5', 'sha1', 'sha256')
+
+
+class OffsetConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Upload-Offset does not match the offset of the upload'
+
+class ChecksumMismatch(APIException):
+    status_code = 460
+    default_detail = 'the checksum of the chunk does not match Upload-Checksum'
+
+class IncompleteChunk(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'the connection was closed before the whole chunk was received'
+
+
+class StagedFile(DjangoFile):
+    ''' a finished staging file, the storage moves it into place instead of copying it '''
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def parse_checksum(header):
+    ''' parse a tus style "Upload-Checksum: <algorithm> <base64 digest>" header, a header which can not be
+    checked is a bad request, 460 only answers a chunk which does not match it
+    '''
+
+    try:
+        algorithm, digest = header.split()
+        digest = base64.b64decode(digest, validate = True)
+    except ValueError:
+        raise ParseError('Upload-Checksum should be "<algorithm> <base64 digest>"')
+    if algorithm not in checksum_algorithms:
+        raise ParseError('supported checksum algorithms are ' + ', '.join(checksum_algorithms))
+    return algorithm, digest
+
+def start_upload(session):
+    os.makedirs(os.path.dirname(session.get_staging_path()), exist_ok = True)
+    open(session.get_staging_path(), 'wb').close()
+
+def receive_chunk(session, stream, length, checksum = None):
+    ''' read a chunk from the request stream into a temporary file next to the staging file, before any lock is taken
+
+    a chunk is all or nothing, if it is cut off or its checksum does not match nothing is appended and the
+    client sends it again.
+    '''
+
+    if checksum:
+        algorithm, expected = parse_checksum(checksum)
+        digest = hashlib.new(algorithm)
+
+    chunk_file = tempfile.NamedTemporaryFile(dir = os.path.dirname(session.get_staging_path()), suffix = '.chunk')
+    written = 0
+    try:
+        while written < length:
+            chunk = stream.read(min(CHUNK_SIZE, length - written)) if stream else b''
+            if not chunk:
+                break
+            chunk_file.write(chunk)
+            if checksum:
+                digest.update(chunk)
+            written += len(chunk)
+
+        if written < length:
+            raise IncompleteChunk()
+        if checksum and digest.digest() != expected:
+            raise ChecksumMismatch()
+    except BaseException:
+        chunk_file.close()
+        raise
+
+    chunk_file.seek(0)
+    return chunk_file
+
+def append_chunk(session, chunk_file):
+    ''' append a received chunk at the offset of the session, under the lock of the session row '''
+
+    with open(session.get_staging_path(), 'r+b') as staged:
+        staged.seek(session.offset)
+        staged.truncate()
+        shutil.copyfileobj(chunk_file, staged, CHUNK_SIZE)
+        session.offset = staged.tell()
+
+    session.save(update_fields = ['offset', 'updated_at'])
+    return session.offset
+
+def finish_upload(session):
+    ''' move the complete staging file into the storage as a new File '''
+
+    file_obj = File(file_name = session.file_name, file_price = session.file_price,
+                    file_product_id = session.file_product_id, is_free = session.is_free)
+
+    with open(session.get_staging_path(), 'rb') as staged:
+        file_obj.mime_type = sniff_mime_type(staged.read(SNIFF_SIZE))
+        staged_file = StagedFile(staged)
+        file_obj.file_data.save(session.get_stored_name(), staged_file, save = False)
+
+    # the storage has hashed the staging file to name the blob
+    file_obj.content_hash = staged_file.content_hash
+    file_obj.file_size = session.upload_size
+    file_obj.save()
+
+    session.delete_staged()
+    session.delete()
+    return file_obj
+
+def iter_archive(archive):
+    ''' yield (name, stream) for the regular files of a zip or tar archive, tar archives are read as one stream '''
+
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zipped:
+            for member in zipped.infolist():
+                if not member.is_dir():
+                    with zipped.open(member) as stream:
+                        yield member.filename, stream
+        return
+
+    archive.seek(0)
+    with tarfile.open(fileobj = archive, mode = 'r|*') as tarred:
+        for member in tarred:
+            if member.isfile():
+                yield member.name, tarred.extractfile(member)
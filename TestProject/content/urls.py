@@ -3,11 +3,14 @@ from django.conf.urls import url
 from rest_framework.routers import DefaultRouter
 from .views import (FileUploadViewSet, ProductViewSet, SubscriptionViewSet, 
                    ShowProductViewSet, ShowFileViewSet, ShowMyCartViewSet,
-                   ShowSubscriptionViewSet, ShowStoreViewSet)
+                   ShowSubscriptionViewSet, ShowStoreViewSet, DownloadFileView, StreamFileView,
+                   SignedDownloadView, SignedStreamView,
+                   ResumableUploadViewSet, CheckoutViewSet, SearchProductViewSet, SearchFileViewSet, MetricsView)
 
 
 router = DefaultRouter()
 router.register('upload_file', FileUploadViewSet, basename='upload_file')
+router.register('resumable_upload', ResumableUploadViewSet, basename='resumable_upload')
 router.register('add_product', ProductViewSet, basename='add_product')
 router.register('add_subscription', SubscriptionViewSet, basename='subscription')
 router.register('show_products', ShowProductViewSet, basename='show_product')
@@ -15,7 +18,15 @@ router.register('show_files', ShowFileViewSet, basename='show_file')
 router.register('show_my_cart', ShowMyCartViewSet, basename='cart')
 router.register('show_subscription', ShowSubscriptionViewSet, basename='show_subscription')
 router.register('show_store', ShowStoreViewSet, basename='show_store')
+router.register('checkout', CheckoutViewSet, basename='checkout')
+router.register('search_products', SearchProductViewSet, basename='search_product')
+router.register('search_files', SearchFileViewSet, basename='search_file')
 
 urlpatterns = [
    path('', include(router.urls)),
+   path('download/<int:pk>/', DownloadFileView.as_view(), name='download_file'),
+   path('stream/<int:pk>/<str:stream_format>/<str:name>', StreamFileView.as_view(), name='stream_file'),
+   path('signed_download/<str:token>/', SignedDownloadView.as_view(), name='signed_download'),
+   path('signed_stream/<str:token>/<str:name>', SignedStreamView.as_view(), name='signed_stream'),
+   path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
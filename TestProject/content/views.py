@@ -1,35 +1,88 @@
-from os import remove
-import pytz
-from datetime import datetime, timedelta
-from django.shortcuts import render
+import os
+import re
+from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
 from rest_framework.parsers import FormParser, MultiPartParser, FileUploadParser
 from rest_framework.renderers import MultiPartRenderer
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.decorators import action
+from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin, DestroyModelMixin
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, GenericViewSet
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_204_NO_CONTENT
+from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST, HTTP_413_REQUEST_ENTITY_TOO_LARGE
+from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework import permissions
 
-from .models import File, Product, Subscription, Cart, Store
+from user.models import Profile
+from .models import stream_manifests, DateClass, File, Product, Subscription, Cart, Purchase, SubscriptionPurchase, Store, Category, UploadSession
 from .serializers import (FileUploadSerializer, ProductSerializer, SubscriptionSerializer,
                          ShowProductSerializer, ShowFileSerializer, ShowProductDetailSerializer,
                          ShowFileDetailSerializer, ShowMyCartSerializer, ShowSubscriptionSerializer,
                          ShowSubscriptionDetailSerializer, Go_To_Buy_Step, BuyProduct, BuyFile, 
-                         BuySubscription, ShowStoreSerializer,)
+                         BuySubscription, ShowStoreSerializer, ResumableUploadSerializer,
+                         CheckoutSerializer, BulkFileUploadSerializer, BulkProductSerializer,
+                         SearchProductSerializer, SearchFileSerializer,)
+from .entitlements import grant_file, grant_product, grant_subscription, can_download
+from .sendfile import sendfile, StoredFile
+from .responsecache import cached_response, invalidate
+from .links import load_token, download_salt, stream_salt, InvalidLink
+from .checkout import checkout
+from .search import CatalogueSearchMixin
+from .metrics import registry
+from .tiering import tiered_file, access_tracker, is_new_download
+from .uploads import start_upload, receive_chunk, append_chunk, finish_upload, OffsetConflict
 
 
+class RelatedFieldsMixin:
+    ''' load the relations the serializer of each action reads, declared per action like the serializers '''
+
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        select_related = self.select_related_fields.get(self.action)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+
+        prefetch_related = self.prefetch_related_fields.get(self.action)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        return queryset
+
+class CachedResponseMixin:
+    ''' answer list and retrieve from the response cache, declared per action with the namespaces they read '''
+
+    cache_dependencies = {}
+
+    def cached(self, request, get_response):
+        namespaces = self.cache_dependencies.get(self.action)
+        if not namespaces:
+            return get_response()
+        return cached_response(request, namespaces, get_response)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, lambda : super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, lambda : super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
 class IsOwnerUser(permissions.BasePermission):
-    ''' check the user is owner or not ''' 
+    ''' check the user is owner or not, the profile is cached with the user by user.authentication ''' 
 
     def has_permission(self, request, view):
         try:
-            if request.user.profiles.is_owner:
-                return True
-            else:
-                return False
-        except:
+            return request.user.profiles.is_owner
+        except Profile.DoesNotExist:
             return False
 
 class FileUploadViewSet(ModelViewSet):
@@ -39,59 +92,185 @@ class FileUploadViewSet(ModelViewSet):
     parser_classes = (MultiPartParser, FormParser)
 
     def get_queryset(self):
-        query = File.objects.all()
-    
-        for q in query:
-            if q.file_product.product_store.owner != self.request.user:
-                query = query.exclude(id = q.id)
-        return query
+        return File.objects.owned_by(self.request.user)
 
     serializer_class = FileUploadSerializer
 
     def destroy(self, request, *args, **kwargs):
+        ''' the stored content is removed with the last File using it, see content.signals '''
+
         instance = self.get_object()
 
-        remove(instance.file_data.path)
         self.perform_destroy(instance)
         return Response(status = HTTP_204_NO_CONTENT)
 
-class ProductViewSet(ModelViewSet):
+    @action(detail = False, methods = ['post'], serializer_class = BulkFileUploadSerializer)
+    def bulk(self, request):
+        ''' upload many files, or a zip/tar archive of them, to one product and get the result of each file '''
+
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+        return Response(serializer.save())
+
+class ResumableUploadViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    ''' owner can upload big files in chunks and resume them after a dropped connection
+
+    POST creates the upload with the same fields as upload_file plus upload_name and upload_size,
+    PATCH appends the request body at Upload-Offset (optionally checked by Upload-Checksum),
+    HEAD or GET returns the current Upload-Offset and POST finalize/ creates the File.
+    ''' 
+
+    permission_classes = [IsAuthenticated , IsOwnerUser]
+    serializer_class = ResumableUploadSerializer
+    lookup_value_regex = '[0-9a-f-]{36}'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner = self.request.user)
+
+    def offset_headers(self, session):
+        return {'Upload-Offset' : str(session.offset), 'Upload-Length' : str(session.upload_size), 'Cache-Control' : 'no-store'}
+
+    def perform_create(self, serializer):
+        start_upload(serializer.save())
+
+    def retrieve(self, request, *args, **kwargs):
+        session = self.get_object()
+        return Response(self.get_serializer(session).data, headers = self.offset_headers(session))
+
+    def partial_update(self, request, *args, **kwargs):
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return Response("Upload-Offset and Content-Length headers are required", status = HTTP_400_BAD_REQUEST)
+
+        if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+            return Response("chunks should not be bigger than %d bytes" % settings.UPLOAD_MAX_CHUNK_SIZE,
+                            status = HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        session = get_object_or_404(self.get_queryset(), pk = kwargs['pk'])
+        if offset != session.offset:
+            raise OffsetConflict()
+        if offset + length > session.upload_size:
+            return Response("the chunk goes beyond upload_size", status = HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # the body is read without holding the row, the offset is checked again under the lock before appending it
+        with receive_chunk(session, request.stream, length, request.META.get('HTTP_UPLOAD_CHECKSUM')) as chunk_file:
+            with transaction.atomic():
+                session = get_object_or_404(self.get_queryset().select_for_update(), pk = kwargs['pk'])
+                if offset != session.offset:
+                    raise OffsetConflict()
+                append_chunk(session, chunk_file)
+
+        return Response(status = HTTP_204_NO_CONTENT, headers = self.offset_headers(session))
+
+    def perform_destroy(self, instance):
+        instance.delete_staged()
+        instance.delete()
+
+    @action(detail = True, methods = ['post'])
+    def finalize(self, request, *args, **kwargs):
+        with transaction.atomic():
+            session = get_object_or_404(self.get_queryset().select_for_update(), pk = kwargs['pk'])
+
+            if session.offset != session.upload_size:
+                return Response("the upload is not complete yet", status = HTTP_400_BAD_REQUEST,
+                                headers = self.offset_headers(session))
+
+            file_obj = finish_upload(session)
+
+        serializer = FileUploadSerializer(file_obj, context = self.get_serializer_context())
+        return Response(serializer.data, status = HTTP_201_CREATED)
+
+class ProductViewSet(RelatedFieldsMixin, ModelViewSet):
     ''' owner can add product to his/her store ''' 
 
     permission_classes = [IsAuthenticated , IsOwnerUser]
 
+    prefetch_related_fields = {
+        'list' : [Prefetch('product_category', queryset = Category.objects.only('pk'))],
+        'retrieve' : [Prefetch('product_category', queryset = Category.objects.only('pk'))],
+    }
+
     def get_queryset(self):
-        query = Product.objects.all()
-    
-        for q in query:
-            if q.product_store.owner != self.request.user:
-                query = query.exclude(id = q.id)
-        return query
+        return Product.objects.owned_by(self.request.user)
 
     serializer_class = ProductSerializer
 
+    @action(detail = False, methods = ['patch'], serializer_class = BulkProductSerializer)
+    def bulk(self, request):
+        ''' update many products at once, the body is a list of {"id" : ..., "product_name" : ..., ...} '''
+
+        if not isinstance(request.data, list):
+            return Response("the body should be a list of products", status = HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.BULK_MAX_ITEMS:
+            return Response("only %d products can be updated at once" % settings.BULK_MAX_ITEMS, status = HTTP_400_BAD_REQUEST)
+
+        results = []
+        changes = {}
+        for item in request.data:
+            serializer = self.get_serializer(data = item, partial = True)
+            if not serializer.is_valid():
+                results.append({'id' : item.get('id') if isinstance(item, dict) else None, 'errors' : serializer.errors})
+            elif 'id' not in serializer.validated_data:
+                results.append({'id' : None, 'errors' : {'id' : ['This field is required.']}})
+            else:
+                data = dict(serializer.validated_data)
+                results.append({'id' : data['id']})
+                changes.setdefault(data.pop('id'), {}).update(data)
+
+        # the ownership of the whole batch is one query
+        products = self.get_queryset().in_bulk(list(changes))
+        for result in results:
+            if 'errors' in result:
+                continue
+            if result['id'] not in products:
+                result['errors'] = {'id' : ['Not found.']}
+            else:
+                result['status'] = 'updated'
+
+        fields = set()
+        for product_id, product_obj in products.items():
+            for field, value in changes[product_id].items():
+                setattr(product_obj, field, value)
+                fields.add(field)
+
+        if fields:
+            with transaction.atomic():
+                Product.objects.bulk_update(products.values(), fields)
+                DateClass.objects.filter(pk__in = list(products)).update(updated_date = timezone.localdate())
+                # bulk_update sends no signals
+                invalidate('product')
+
+        return Response(results)
+
 class SubscriptionViewSet(ModelViewSet):
     ''' owner can add subscription to his/her store ''' 
 
     permission_classes = [IsAuthenticated , IsOwnerUser]
 
     def get_queryset(self):
-        query = Subscription.objects.all()
-    
-        for q in query:
-            if q.store_subscription.owner != self.request.user:
-                query = query.exclude(id = q.id)
-        return query
+        return Subscription.objects.owned_by(self.request.user)
 
     serializer_class = SubscriptionSerializer
 
-class ShowProductViewSet(ModelViewSet):
+class ShowProductViewSet(CachedResponseMixin, RelatedFieldsMixin, ModelViewSet):
     ''' users can see products and buy them ''' 
 
     permission_classes = [IsAuthenticated]
 
     queryset = Product.objects.all()
 
+    prefetch_related_fields = {
+        'retrieve' : [Prefetch('product_category', queryset = Category.objects.only('pk')),
+                      Prefetch('file_products', queryset = File.objects.exclude(processing_status = 'rejected').only('pk', 'file_product'))],
+    }
+
+    cache_dependencies = {
+        'list' : ['product'],
+        'retrieve' : ['product', 'category', 'file'],
+    }
+
     serializers = {
         'list' : ShowProductSerializer,
         'retrieve' : ShowProductDetailSerializer,
@@ -107,24 +286,18 @@ class ShowProductViewSet(ModelViewSet):
         return Response("Please select an exact product to buy")
 
     def update(self, request, *args, **kwargs):
-            product_obj = Product.objects.get(pk = int(kwargs['pk']))
-            cart_tuple = Cart.objects.get_or_create(user = request.user)
-            cart_obj = cart_tuple[0]
+            product_obj = get_object_or_404(Product, pk = int(kwargs['pk']))
 
             if request.data['buy_confirmation'] == 'buy':
-                if not cart_obj.baught_products:
-                    cart_obj.baught_products = []
-                
-                if product_obj.id not in cart_obj.baught_products:
-                    cart_obj.baught_products.append(product_obj.id)
-                    cart_obj.save()
-                else:
-                    return Response("You have already baught this product")
+                with transaction.atomic():
+                    if not Purchase.objects.record(request.user, product = product_obj):
+                        return Response("You have already baught this product")
+                    grant_product(request.user, product_obj)
 
                 return Response("You baught this product successfully")
 
             else:
-                if product_obj.id not in cart_obj.baught_products:
+                if not Purchase.objects.filter(user = request.user, product = product_obj).exists():
                     return Response("You canceled buying this product")
                 else:
                     return Response("You have already baught this product")
@@ -135,13 +308,17 @@ class ShowProductViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return Response("You do not have the permission to delete this product")
 
-class ShowFileViewSet(ModelViewSet):
+class ShowFileViewSet(RelatedFieldsMixin, ModelViewSet):
     ''' users can see files and buy or download them ''' 
 
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)
 
-    queryset = File.objects.all()
+    queryset = File.objects.exclude(processing_status = 'rejected')
+
+    select_related_fields = {
+        'retrieve' : ['file_product__product_store'],
+    }
 
     serializers = {
         'list' : ShowFileSerializer,
@@ -153,29 +330,31 @@ class ShowFileViewSet(ModelViewSet):
 
     def get_serializer_class(self):
         return self.serializers.get(self.action)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # the signed download links carry where the content is stored
+        if self.action == 'retrieve':
+            queryset = queryset.with_blob()
+        return queryset
     
     def create(self , request):
         return Response("Please select an exact file to buy")
 
     def update(self, request, *args, **kwargs):
-            file_obj = File.objects.get(pk = int(kwargs['pk']))
-            cart_tuple = Cart.objects.get_or_create(user = request.user)
-            cart_obj = cart_tuple[0]
+            # the files the processing rejected are not sold, like they are not shown
+            file_obj = get_object_or_404(self.get_queryset(), pk = int(kwargs['pk']))
 
             if request.data['buy_confirmation'] == 'buy':
-                if not cart_obj.baught_files:
-                    cart_obj.baught_files = []
-                
-                if file_obj.id not in cart_obj.baught_files:
-                    cart_obj.baught_files.append(file_obj.id)
-                    cart_obj.save()
-                else:
-                    return Response("You have already baught this file")
+                with transaction.atomic():
+                    if not Purchase.objects.record(request.user, file = file_obj):
+                        return Response("You have already baught this file")
+                    grant_file(request.user, file_obj)
 
                 return Response("You baught this file successfully")
 
             else:
-                if file_obj.id not in cart_obj.baught_files:
+                if not Purchase.objects.filter(user = request.user, file = file_obj).exists():
                     return Response("You canceled buying this file")
                 else:
                     return Response("You have already baught this file")
@@ -186,24 +365,76 @@ class ShowFileViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return Response("You do not have the permission to delete this file")
 
-class ShowMyCartViewSet(ReadOnlyModelViewSet):
+class SearchProductViewSet(CatalogueSearchMixin, ListModelMixin, GenericViewSet):
+    ''' users can search products by name and narrow them by category, price, is_free and store '''
+
+    permission_classes = [IsAuthenticated]
+
+    queryset = Product.objects.all()
+    serializer_class = SearchProductSerializer
+
+    facet_fields = {
+        'category' : 'product_category__category_name',
+        'is_free' : 'is_free',
+        'store' : 'product_store',
+    }
+    price_field = 'product_price'
+
+class SearchFileViewSet(CatalogueSearchMixin, ListModelMixin, GenericViewSet):
+    ''' users can search files by name and narrow them by the category and store of their product, price and is_free '''
+
+    permission_classes = [IsAuthenticated]
+
+    queryset = File.objects.exclude(processing_status = 'rejected')
+    serializer_class = SearchFileSerializer
+
+    facet_fields = {
+        'category' : 'file_product__product_category__category_name',
+        'is_free' : 'is_free',
+        'store' : 'file_product__product_store',
+    }
+    price_field = 'file_price'
+
+class ShowMyCartViewSet(RelatedFieldsMixin, ReadOnlyModelViewSet):
     ''' users can see their carts ''' 
 
     permission_classes = [IsAuthenticated]
 
+    select_related_fields = {
+        'list' : ['user'],
+        'retrieve' : ['user'],
+    }
+
+    prefetch_related_fields = {
+        'list' : ['user__purchases', 'user__subscription_purchases'],
+        'retrieve' : ['user__purchases', 'user__subscription_purchases'],
+    }
+
     def get_queryset(self):
         query = Cart.objects.filter(user = self.request.user)
         return query
 
+    def list(self, request, *args, **kwargs):
+        # the cart is made with the first purchase, before it the user sees an empty one and nothing is written
+        response = super().list(request, *args, **kwargs)
+        if not response.data['results']:
+            response.data['results'] = [self.get_serializer(Cart(user = request.user)).data]
+        return response
+
     serializer_class = ShowMyCartSerializer
 
-class ShowSubscriptionViewSet(ModelViewSet):
+class ShowSubscriptionViewSet(CachedResponseMixin, ModelViewSet):
     ''' users can see subscriptions and buy them ''' 
 
     permission_classes = [IsAuthenticated]
 
     queryset = Subscription.objects.all()
 
+    cache_dependencies = {
+        'list' : ['subscription'],
+        'retrieve' : ['subscription'],
+    }
+
     serializers = {
         'list' : ShowSubscriptionSerializer,
         'retrieve' : ShowSubscriptionDetailSerializer,
@@ -215,29 +446,12 @@ class ShowSubscriptionViewSet(ModelViewSet):
     def get_serializer_class(self):
         return self.serializers.get(self.action)
 
-    def check_subscription(self, cart_obj, sub_obj):
-        utc=pytz.UTC
-
-        now_datetime = datetime.now().replace(tzinfo=utc)
-        unit = sub_obj.expiry_date_unit
-        amount = sub_obj.expiry_date_amount
-
-        if unit == 'day':
-            expiry_date = cart_obj.date_of_buying_subscription + timedelta(days = amount)
-            expiry_date = expiry_date.replace(tzinfo=utc)
-        else:
-            expiry_date = cart_obj.date_of_buying_subscription + timedelta(hours = amount)
-            expiry_date = expiry_date.replace(tzinfo=utc)
-    
-        if now_datetime < expiry_date:
-            return True
-        else:
-            return False
-    
-    def buy_subscription(self, cart_obj, sub_obj):
-        cart_obj.baught_subscriptions.add(sub_obj)
-        cart_obj.date_of_buying_subscription = datetime.now()
-        cart_obj.save()
+    def buy_subscription(self, user, sub_obj):
+        with transaction.atomic():
+            expires_at = SubscriptionPurchase.objects.buy(user, sub_obj)
+            if expires_at is None:
+                return Response("You have already baught this file")
+            grant_subscription(user, sub_obj, expires_at)
 
         return Response("You baught this file successfully")
     
@@ -245,31 +459,15 @@ class ShowSubscriptionViewSet(ModelViewSet):
         return Response("Please select an exact subscription to buy")
 
     def update(self, request, *args, **kwargs):
-            sub_obj = Subscription.objects.get(pk = int(kwargs['pk']))
-            cart_tuple = Cart.objects.get_or_create(user = request.user)
-            cart_obj = cart_tuple[0]
+            sub_obj = get_object_or_404(Subscription, pk = int(kwargs['pk']))
 
             if request.data['buy_confirmation'] == 'buy':
-                try:
-                    cart_obj.baught_subscriptions.get(id = sub_obj.id)
-                except:
-                    self.buy_subscription(cart_obj, sub_obj)
-                else:
-                    if self.check_subscription(cart_obj, sub_obj):
-                        return Response("You have already baught this file")
-                    else:
-                        self.buy_subscription(cart_obj, sub_obj)
+                return self.buy_subscription(request.user, sub_obj)
 
             else:
-                try:
-                    cart_obj.baught_subscriptions.get(id = sub_obj.id)
-                except:
-                    return Response("You canceled buying this file")
-                else:
-                    if self.check_subscription(cart_obj, sub_obj):
-                        return Response("You have already baught this file")
-                    else:
-                        self.buy_subscription(cart_obj, sub_obj)
+                if SubscriptionPurchase.objects.active(request.user, sub_obj).exists():
+                    return Response("You have already baught this file")
+                return Response("You canceled buying this file")
 
     def partial_update(self, request, *args, **kwargs):
         return None
@@ -277,10 +475,146 @@ class ShowSubscriptionViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return Response("You do not have the permission to delete this subscription")
 
-class ShowStoreViewSet(ReadOnlyModelViewSet):
+class ShowStoreViewSet(CachedResponseMixin, RelatedFieldsMixin, ReadOnlyModelViewSet):
     ''' users can see stores ''' 
 
     permission_classes = [IsAuthenticated]
 
     queryset = Store.objects.all()
-    serializer_class = ShowStoreSerializer
\ No newline at end of file
+
+    cache_dependencies = {
+        'list' : ['store', 'subscription', 'product'],
+        'retrieve' : ['store', 'subscription', 'product'],
+    }
+
+    select_related_fields = {
+        'list' : ['owner', 'subscription'],
+        'retrieve' : ['owner', 'subscription'],
+    }
+    prefetch_related_fields = {
+        'list' : [Prefetch('products_store', queryset = Product.objects.only('pk', 'product_store'))],
+        'retrieve' : [Prefetch('products_store', queryset = Product.objects.only('pk', 'product_store'))],
+    }
+    serializer_class = ShowStoreSerializer
+
+class CheckoutViewSet(GenericViewSet):
+    ''' users buy a basket of products, files and subscriptions with one request '''
+
+    permission_classes = [IsAuthenticated]
+
+    serializer_class = CheckoutSerializer
+
+    def create(self, request):
+        serializer = self.get_serializer(data = request.data)
+        serializer.is_valid(raise_exception = True)
+
+        results = checkout(request.user,
+                           product_ids = serializer.validated_data.get('products', []),
+                           file_ids = serializer.validated_data.get('files', []),
+                           subscription_ids = serializer.validated_data.get('subscriptions', []))
+        return Response(results)
+
+class DownloadFileView(APIView):
+    ''' users download the files they are allowed to, the bytes are sent by the front server '''
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        file_obj = get_object_or_404(File.objects.select_related('file_product__product_store').with_blob(), pk = pk)
+
+        if not can_download(request.user, file_obj):
+            raise PermissionDenied("to download this file, you should first pay for this file or buy its product")
+
+        # the hashes of the files stored before they were hashed are filled by their probe job, see
+        # content.processing.verify_checksum, until then they are sent without an ETag
+        if is_new_download(request):
+            access_tracker.record(file_obj.file_data.name)
+        return sendfile(request, tiered_file(file_obj.file_data.name, bool(file_obj.blob_archived), file_obj.blob_encoding or ''),
+                        file_obj.get_download_name(),
+                        etag = file_obj.content_hash, size = file_obj.blob_size, content_type = file_obj.mime_type)
+
+class StreamFileView(APIView):
+    ''' manifests and segments of the streams of a file, every one of them is checked like the download of the file '''
+
+    permission_classes = [IsAuthenticated]
+
+    # only the names ffmpeg gives the manifests and segments, never . or .. of the package directories
+    segment_name_re = re.compile(r'^[\w$-]+\.(m3u8|ts|mpd|m4s)$')
+    content_types = {
+        '.m3u8' : 'application/vnd.apple.mpegurl',
+        '.ts' : 'video/mp2t',
+        '.mpd' : 'application/dash+xml',
+        '.m4s' : 'video/iso.segment',
+    }
+
+    def get(self, request, pk, stream_format, name):
+        file_obj = get_object_or_404(File.objects.select_related('file_product__product_store'), pk = pk)
+
+        if stream_format not in file_obj.get_stream_formats() or not self.segment_name_re.match(name):
+            raise NotFound()
+
+        if not can_download(request.user, file_obj):
+            raise PermissionDenied("to download this file, you should first pay for this file or buy its product")
+
+        return self.serve(request, os.path.dirname(file_obj.get_stream_name(stream_format, name)), name, file_obj.content_hash)
+
+    def serve(self, request, stream_dir, name, content_hash):
+        stored_file = StoredFile(File._meta.get_field('file_data').storage, stream_dir + '/' + name)
+        if not stored_file.storage.exists(stored_file.name):
+            raise NotFound()
+
+        # segments never change for a content, so the hash of the content names them for caches
+        etag = '%s-%s-%s' % (content_hash, os.path.basename(stream_dir), name)
+        # the manifests name their segments relatively, so they are served from here and not redirected
+        response = sendfile(request, stored_file, name, etag = etag,
+                            content_type = self.content_types.get(os.path.splitext(name)[1]), as_attachment = False,
+                            allow_redirect = name not in stream_manifests.values())
+        if response.status_code in (200, 206, 304):
+            response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+class SignedDownloadView(APIView):
+    ''' downloads through a signed link, the link is the authorization so the database is not touched '''
+
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, token):
+        try:
+            link = load_token(token, download_salt)
+        except InvalidLink:
+            raise PermissionDenied("this download link is invalid or has expired")
+
+        if is_new_download(request):
+            access_tracker.record(link['n'])
+        return sendfile(request, tiered_file(link['n'], link.get('a'), link.get('c', '')), link['d'], etag = link['h'], size = link['s'], content_type = link['t'])
+
+class SignedStreamView(StreamFileView):
+    ''' the manifest and segments of a stream through a signed link, relative segment urls share the token of the manifest '''
+
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, token, name):
+        try:
+            link = load_token(token, stream_salt)
+        except InvalidLink:
+            raise PermissionDenied("this download link is invalid or has expired")
+
+        if not self.segment_name_re.match(name):
+            raise NotFound()
+
+        return self.serve(request, link['p'], name, link['h'])
+
+class MetricsView(APIView):
+    ''' the request metrics of this process for prometheus, only with the bearer token METRICS_TOKEN '''
+
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        # behind the front server every request comes from its address, so the address can not be trusted
+        token = settings.METRICS_TOKEN
+        if not token or not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+            raise PermissionDenied("metrics are only served with the bearer token METRICS_TOKEN")
+        return HttpResponse(registry.render(), content_type = 'text/plain; version=0.0.4; charset=utf-8')
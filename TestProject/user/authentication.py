@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.utils import jwt_payload_handler as default_jwt_payload_handler
+
+from .models import Profile
+
+
+def get_user_cache():
+    return caches[settings.AUTH_USER_CACHE]
+
+def user_cache_key(user_id):
+    return 'auth-user:%s' % user_id
+
+def invalidate_user(user_id):
+    get_user_cache().delete(user_cache_key(user_id))
+
+
+def jwt_payload_handler(user):
+    ''' the default claims plus is_owner and the ids of the stores of the user, for the clients to read '''
+
+    from content.models import Store
+
+    payload = default_jwt_payload_handler(user)
+    try:
+        payload['is_owner'] = user.profiles.is_owner
+    except Profile.DoesNotExist:
+        payload['is_owner'] = False
+    payload['store_ids'] = list(Store.objects.filter(owner = user).values_list('id', flat = True))
+    return payload
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    ''' JWT authentication whose user, with its profile, is kept in AUTH_USER_CACHE for AUTH_USER_CACHE_TIMEOUT
+
+    the permission checks read request.user.profiles, so an authenticated request costs no query for them.
+    saving or deleting a User or Profile removes it from the cache, see user.signals.
+    '''
+
+    def authenticate_credentials(self, payload):
+        user_id = payload.get('user_id')
+        if not user_id:
+            raise exceptions.AuthenticationFailed(_('Invalid payload.'))
+
+        cache = get_user_cache()
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            try:
+                user = User.objects.select_related('profiles').get(pk = user_id)
+            except User.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+            cache.set(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+
+        if user.get_username() != payload.get('username'):
+            raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User account is disabled.'))
+
+        return user
@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .models import Profile
+
+
+@receiver([post_save, post_delete], sender = User)
+def forget_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+@receiver([post_save, post_delete], sender = Profile)
+def forget_profile(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
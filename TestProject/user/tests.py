@@ -1,3 +1,49 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+from rest_framework_jwt.utils import jwt_decode_handler
 
-# Create your tests here.
+from content.models import Store
+from .authentication import CachedJSONWebTokenAuthentication, get_user_cache
+from .models import Profile
+
+
+class CachedAuthenticationTests(TestCase):
+    ''' tokens carry the owner claims and authenticated users are cached with their profile '''
+
+    def setUp(self):
+        get_user_cache().clear()
+        self.user = User.objects.create_user(username = 'owner', password = 'owner-pass')
+        self.profile = Profile.objects.create(user = self.user, is_owner = True)
+        self.store = Store.objects.create(owner = self.user)
+
+        response = self.client.post('/user/login/', {'username' : 'owner', 'password' : 'owner-pass'})
+        self.token = response.data['token']
+
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION = 'JWT ' + self.token)
+        user, token = CachedJSONWebTokenAuthentication().authenticate(request)
+        return user
+
+    def test_claims(self):
+        payload = jwt_decode_handler(self.token)
+        self.assertTrue(payload['is_owner'])
+        self.assertEqual(payload['store_ids'], [self.store.id])
+
+    def test_cached_user_and_profile(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticate().profiles.is_owner)
+
+    def test_profile_save_invalidates(self):
+        self.authenticate()
+        self.profile.is_owner = False
+        self.profile.save()
+        self.assertFalse(self.authenticate().profiles.is_owner)
+
+    def test_owner_permission_costs_no_query(self):
+        self.authenticate()
+        with self.assertNumQueries(1):
+            # only the list of subscriptions itself
+            response = self.client.get('/content/add_subscription/', HTTP_AUTHORIZATION = 'JWT ' + self.token)
+        self.assertEqual(response.status_code, 200)